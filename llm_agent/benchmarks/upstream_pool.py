@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Пул соединений к Completion API против запроса с нуля на каждый вызов.
+
+Заглушка Completion API работает по HTTPS (самоподписанный сертификат)
+в отдельном потоке со своим loop и отвечает через --latency секунд.
+Режимы:
+
+  blocking_per_call — как было: requests.post внутри async обработчика,
+                      новое TCP+TLS соединение на вызов, loop стоит,
+                      поэтому вызовы идут по одному;
+  per_call_async    — параллельно, но новый клиент (и рукопожатие) на
+                      каждый вызов;
+  pooled_serial     — UpstreamClient по одному вызову: та же очередь,
+                      что у blocking_per_call, но без рукопожатий;
+  pooled            — UpstreamClient: общий keep-alive пул;
+  pooled_http2      — то же по HTTP/2 (если установлен h2 и сервер
+                      его поддерживает);
+  agent             — приложение llm_agent целиком (lifespan, пул),
+                      --concurrency одновременных запросов к нему.
+
+Для каждого режима печатается строка JSON: вызовы в секунду, p50/p99,
+число TCP соединений, которые увидел сервер; отдельно — стоимость
+одного TLS рукопожатия.
+
+    python benchmarks/upstream_pool.py --calls 200 --concurrency 16
+"""
+import os
+import ssl
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import datetime
+import ipaddress
+import tempfile
+import threading
+
+import httpx
+import requests
+import uvicorn
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from fastapi import FastAPI, Request
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from upstream import UpstreamClient  # noqa: E402
+
+COMPLETION_PATH = "/foundationModels/v1/completion"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def self_signed(directory: str):
+    """Сертификат на 127.0.0.1: (cert.pem, key.pem)"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName(
+            [x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+            critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class FakeCompletion:
+    """Completion API: ответ после задержки, учёт соединений"""
+
+    def __init__(self, latency: float, jitter: float, seed: int) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.connections = set()
+        self.app = FastAPI()
+        self.app.add_api_route(COMPLETION_PATH, self.handle, methods=["POST"])
+
+    async def handle(self, request: Request):
+        self.connections.add(request.client)
+        await request.json()
+        await asyncio.sleep(
+            self.latency * self.rng.uniform(1 - self.jitter, 1 + self.jitter))
+        return {"result": {"alternatives": [{
+            "message": {"role": "assistant", "text": "Ответ модели."},
+            "status": "ALTERNATIVE_STATUS_FINAL"}]}}
+
+
+class ServerThread:
+    """uvicorn в своём потоке: блокирующий клиент не стопорит сервер"""
+
+    def __init__(self, app, **config) -> None:
+        self.port = free_port()
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=self.port, log_level="warning",
+            access_log=False, **config))
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        while not self.server.started:
+            if not self._thread.is_alive():
+                raise SystemExit("server failed to start")
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self._thread.join(5)
+
+
+def payload(i: int):
+    return {
+        "modelUri": "gpt://folder/yandexgpt-lite",
+        "completionOptions": {"stream": False, "temperature": 0.6,
+                              "maxTokens": 2000},
+        "messages": [{"role": "user", "text": f"Вопрос номер {i}"}],
+    }
+
+
+def summary(mode, concurrency, latencies, elapsed, connections, **extra):
+    ordered = sorted(latencies)
+
+    def pct(q):
+        return round(
+            ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+            * 1000, 1)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "calls": len(latencies),
+        "calls_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": pct(50),
+        "p99_ms": pct(99),
+        "connections": connections,
+        **extra,
+    }
+
+
+async def concurrently(calls, concurrency, call):
+    """calls вызовов call(i), не больше concurrency одновременно"""
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(calls):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            t0 = time.perf_counter()
+            response = await call(i)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - t0
+
+
+async def blocking_per_call(url, cert, args):
+    async def call(i):
+        # Как прежний обработчик: синхронный вызов прямо в корутине
+        return requests.post(url, json=payload(i), verify=cert, timeout=30)
+    return await concurrently(args.calls, 1, call)
+
+
+async def per_call_async(url, context, args):
+    async def call(i):
+        async with httpx.AsyncClient(verify=context) as client:
+            return await client.post(url, json=payload(i), timeout=30)
+    return await concurrently(args.calls, args.concurrency, call)
+
+
+async def pooled(url, context, args, concurrency, http2=False):
+    client = UpstreamClient(
+        pool_size=concurrency, http2=http2, verify=context)
+    try:
+        latencies, elapsed = await concurrently(
+            args.calls, concurrency,
+            lambda i: client.post(url, json=payload(i), timeout=30))
+        version = (await client.post(
+            url, json=payload(0), timeout=30)).http_version
+    finally:
+        await client.aclose()
+    return latencies, elapsed, version
+
+
+async def through_agent(url, context, args):
+    import main
+    from upstream import upstream
+    upstream.verify = context
+    agent = ServerThread(main.app, lifespan="on")
+    agent.start()
+    agent_url = f"http://127.0.0.1:{agent.port}/api/llm_agent/"
+    body = {"headers": {"Authorization": "Bearer fake"},
+            "LLM_URL": url}
+    try:
+        async with httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=args.concurrency)) as client:
+            return await concurrently(
+                args.calls, args.concurrency,
+                lambda i: client.post(
+                    agent_url, json={**body, "payload": payload(i)},
+                    timeout=60))
+    finally:
+        agent.stop()
+
+
+def tls_handshake_ms(port, context, samples=20):
+    timings = []
+    for _ in range(samples):
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            t0 = time.perf_counter()
+            with context.wrap_socket(sock, server_hostname="127.0.0.1"):
+                timings.append(time.perf_counter() - t0)
+    return round(sorted(timings)[len(timings) // 2] * 1000, 2)
+
+
+async def run(args, fake, url, cert, port):
+    context = ssl.create_default_context(cafile=cert)
+    rows = [{"mode": "tls_handshake",
+             "median_ms": tls_handshake_ms(port, context)}]
+
+    def measured(mode, concurrency, latencies, elapsed, **extra):
+        row = summary(mode, concurrency, latencies, elapsed,
+                      len(fake.connections), **extra)
+        fake.connections.clear()
+        return row
+
+    fake.connections.clear()
+    rows.append(measured(
+        "blocking_per_call", 1, *await blocking_per_call(url, cert, args)))
+    rows.append(measured(
+        "per_call_async", args.concurrency,
+        *await per_call_async(url, context, args)))
+    latencies, elapsed, version = await pooled(url, context, args, 1)
+    rows.append(measured("pooled_serial", 1, latencies, elapsed,
+                         http_version=version))
+    latencies, elapsed, version = await pooled(
+        url, context, args, args.concurrency)
+    rows.append(measured("pooled", args.concurrency, latencies, elapsed,
+                         http_version=version))
+    try:
+        import h2  # noqa: F401
+        latencies, elapsed, version = await pooled(
+            url, context, args, args.concurrency, http2=True)
+        rows.append(measured("pooled_http2", args.concurrency, latencies,
+                             elapsed, http_version=version))
+    except ImportError:
+        rows.append({"mode": "pooled_http2", "skipped": "h2 not installed"})
+    rows.append(measured(
+        "agent", args.concurrency, *await through_agent(url, context, args)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="задержка ответа модели, сек")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = self_signed(tmp)
+        fake = FakeCompletion(args.latency, args.jitter, args.seed)
+        server = ServerThread(
+            fake.app, lifespan="off", ssl_certfile=cert, ssl_keyfile=key)
+        server.start()
+        url = f"https://127.0.0.1:{server.port}{COMPLETION_PATH}"
+        try:
+            for row in asyncio.run(run(args, fake, url, cert, server.port)):
+                print(json.dumps(row, ensure_ascii=False))
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Монитор задержки event loop и поиск блокирующих вызовов.
+
+Корутина спит interval и меряет, насколько позже проснулась — это и
+есть задержка loop. Сторожевой поток следит за её пульсом: если loop
+не отвечает дольше threshold, поток снимает стек потока loop и
+запоминает место блокировки — самый глубокий кадр кода сервиса (не
+stdlib и не site-packages). Когда loop оживает, длительность зависания
+приписывается этому месту. GET /debug/loop отдаёт гистограмму задержек
+и места, которые блокировали loop дольше всего.
+
+Эндпоинт показывает пути и кадры стека, поэтому по умолчанию выключен
+(404): он работает, только если задан LOOP_DEBUG_TOKEN и запрос несёт
+тот же токен в заголовке X-Debug-Token.
+
+Модуль одинаков в rag, llm_agent, validator и telegram_bot: каждый
+сервис собирается в отдельный образ из своего каталога (COPY . .), и
+общего пакета между ними нет. Правка одной копии — правка всех четырёх.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Токен доступа к GET /debug/loop; пустой — эндпоинт выключен
+LOOP_DEBUG_TOKEN = os.getenv("LOOP_DEBUG_TOKEN", "")
+DEBUG_TOKEN_HEADER = "X-Debug-Token"
+
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_LIBRARY_PATHS = tuple(
+    {sysconfig.get_paths()[k] for k in ("stdlib", "purelib", "platlib")})
+
+
+def _is_service_code(filename: str) -> bool:
+    return (not filename.startswith(_LIBRARY_PATHS)
+            and not filename.startswith("<")
+            and filename != __file__)
+
+
+def _site(stack: traceback.StackSummary) -> Tuple[str, str]:
+    """(место в коде сервиса, вызов, на котором стоит поток)"""
+    innermost = stack[-1]
+    call = (f"{os.path.basename(innermost.filename)}:{innermost.lineno} "
+            f"in {innermost.name}")
+    for frame in reversed(stack):
+        if _is_service_code(frame.filename):
+            path = os.path.relpath(frame.filename)
+            return f"{path}:{frame.lineno} in {frame.name}", call
+    return call, call
+
+
+def debug_allowed(token: Optional[str]) -> bool:
+    """Доступ к /debug/loop: токен задан и совпадает"""
+    return bool(LOOP_DEBUG_TOKEN) and token is not None and (
+        hmac.compare_digest(LOOP_DEBUG_TOKEN.encode(), token.encode()))
+
+
+class _Site:
+    __slots__ = ("count", "total", "max", "call", "stack")
+
+    def __init__(self, call: str, stack: List[str]) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.call = call
+        self.stack = stack
+
+
+class LoopMonitor:
+    def __init__(
+            self,
+            interval: float = 0.1,
+            threshold: float = 0.1,
+            max_sites: int = 50,
+            stack_depth: int = 12) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.max_sites = max_sites
+        self.stack_depth = stack_depth
+
+        self.buckets = [0] * (len(LAG_BUCKETS) + 1)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.uncaptured = 0
+        self._recent: Deque[float] = deque(maxlen=1000)
+        self._sites: Dict[str, _Site] = {}
+
+        self._heartbeat = 0.0
+        self._captured: Optional[Tuple[float, str, str, List[str]]] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _capture(self) -> None:
+        """Стек потока loop, один раз за зависание"""
+        heartbeat = self._heartbeat
+        if self._captured and self._captured[0] == heartbeat:
+            return
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        site, call = _site(stack)
+        lines = [f"{os.path.basename(f.filename)}:{f.lineno} in {f.name}: "
+                 f"{f.line or ''}" for f in stack[-self.stack_depth:]]
+        self._captured = (heartbeat, site, call, lines)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            if not self._heartbeat:
+                continue
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled >= self.threshold:
+                self._capture()
+
+    def _record(self, lag: float, heartbeat: float) -> None:
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        self._recent.append(lag)
+        for i, bound in enumerate(LAG_BUCKETS):
+            if lag <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        if lag < self.threshold:
+            return
+
+        self.stalls += 1
+        captured = self._captured
+        if not captured or captured[0] != heartbeat:
+            self.uncaptured += 1
+            return
+        _, site, call, lines = captured
+        entry = self._sites.get(site)
+        if entry is None:
+            if len(self._sites) >= self.max_sites:
+                # Вытесняем место с наименьшим суммарным временем
+                del self._sites[min(
+                    self._sites, key=lambda s: self._sites[s].total)]
+            entry = self._sites[site] = _Site(call, lines)
+        entry.count += 1
+        entry.total += lag
+        entry.max = max(entry.max, lag)
+        logger.warning("Event loop blocked %.3fs at %s (%s)", lag, site, call)
+
+    async def _run(self) -> None:
+        while True:
+            heartbeat = self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - heartbeat - self.interval)
+            self._record(lag, heartbeat)
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run(), name="loop-monitor")
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _percentile(self, q: float) -> Optional[float]:
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return round(
+            ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 4)
+
+    def metrics(self, top: int = 10) -> Dict[str, Any]:
+        labels = [f"<={b}" for b in LAG_BUCKETS] + [f">{LAG_BUCKETS[-1]}"]
+        sites = sorted(
+            self._sites.items(), key=lambda kv: kv[1].total, reverse=True)
+        return {
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "samples": self.samples,
+            "lag_p50": self._percentile(50),
+            "lag_p99": self._percentile(99),
+            "lag_max": round(self.max_lag, 4),
+            "histogram": dict(zip(labels, self.buckets)),
+            "stalls": self.stalls,
+            "uncaptured_stalls": self.uncaptured,
+            "top_sites": [
+                {
+                    "site": site,
+                    "call": s.call,
+                    "count": s.count,
+                    "total_s": round(s.total, 3),
+                    "max_s": round(s.max, 3),
+                    "stack": s.stack,
+                }
+                for site, s in sites[:top]
+            ],
+        }
+
+
+loop_monitor = LoopMonitor(
+    interval=float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1")),
+    threshold=float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1")),
+)
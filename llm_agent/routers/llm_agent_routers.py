@@ -1,6 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
+from deadline import DeadlineExceeded
 from models import LLMResult, LLMRequest
-import requests
+from upstream import upstream
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,16 +11,24 @@ router = APIRouter()
 
 
 @router.post('/', response_model=LLMResult)
-async def validate_request(req: LLMRequest):
+async def validate_request(req: LLMRequest, request: Request):
     headers = req.headers
     payload = req.payload
     LLM_URL = req.LLM_URL
 
-    response = requests.post(
-        LLM_URL,
+    # Не ждём модель дольше, чем ответ нужен вызывающему
+    deadline = request.state.deadline
+    try:
+        timeout = deadline.timeout(15) if deadline else 15
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="deadline exceeded")
+
+    # Общий keep-alive пул из lifespan; ожидание не блокирует loop
+    response = await upstream.post(
+        str(LLM_URL),
         headers=headers,
         json=payload,
-        timeout=15
+        timeout=timeout
     )
 
     if response.status_code != 200:
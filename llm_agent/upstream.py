@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Долгоживущий асинхронный клиент к Completion API.
+
+Один httpx.AsyncClient на процесс создаётся в lifespan приложения:
+соединения с llm.api.cloud.yandex.net переиспользуются (без нового
+TLS рукопожатия на каждый запрос), а ожидание генерации не блокирует
+event loop — медленный ответ модели не останавливает остальные запросы.
+
+LLM_POOL_SIZE — предел одновременных соединений, LLM_KEEPALIVE —
+сколько из них держать открытыми между запросами, LLM_KEEPALIVE_EXPIRY —
+сколько секунд простаивающее соединение живёт в пуле, LLM_HTTP2=true —
+HTTP/2 с мультиплексированием запросов в одном соединении (нужен
+пакет h2; без него клиент остаётся на HTTP/1.1).
+"""
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamClient:
+    def __init__(
+            self,
+            pool_size: int = 32,
+            keepalive: Optional[int] = None,
+            keepalive_expiry: float = 60.0,
+            connect_timeout: float = 3.05,
+            http2: bool = False,
+            verify: Any = True) -> None:
+        self.pool_size = pool_size
+        self.keepalive = pool_size if keepalive is None else keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.http2 = http2
+        self.verify = verify
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._requests = 0
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._errors = 0
+        self._busy_time = 0.0
+
+    def _http2_available(self) -> bool:
+        if not self.http2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("LLM_HTTP2 requested but h2 is not installed; "
+                           "falling back to HTTP/1.1")
+            self.http2 = False
+        return self.http2
+
+    def start(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            return
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(30.0, connect=self.connect_timeout),
+            http2=self._http2_available(),
+            verify=self.verify,
+        )
+        logger.info("LLM upstream pool created (max %s, keepalive %s, %s)",
+                    self.pool_size, self.keepalive,
+                    "HTTP/2" if self.http2 else "HTTP/1.1")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Вне lifespan (скрипты, тесты) пул создаётся по первому запросу
+        if self._client is None or self._client.is_closed:
+            self.start()
+        return self._client
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        self._requests += 1
+        self._in_flight += 1
+        self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        t0 = time.monotonic()
+        try:
+            return await self.client.post(url, **kwargs)
+        except httpx.HTTPError:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._busy_time += time.monotonic() - t0
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.pool_size,
+            "keepalive": self.keepalive,
+            "http2": self.http2,
+            "requests": self._requests,
+            "in_flight": self._in_flight,
+            "max_in_flight": self._max_in_flight,
+            "errors": self._errors,
+            "avg_latency_s": (round(self._busy_time / self._requests, 4)
+                              if self._requests else None),
+        }
+
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+
+upstream = UpstreamClient(
+    pool_size=LLM_POOL_SIZE,
+    keepalive=int(os.getenv("LLM_KEEPALIVE", str(LLM_POOL_SIZE))),
+    keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60")),
+    http2=os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes"),
+)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк двухуровневого поиска против полного перебора чанков.
+
+Синтетический корпус: N документов, в каждом M чанков вокруг общего
+центра документа (эмбеддинги одного акта близки друг к другу).
+Запросы — зашумлённые копии случайных чанков. Эталон — точный поиск
+по плоскому индексу; для каждого значения веера групп печатаются
+задержка и recall@k относительно эталона.
+
+    python benchmarks/hierarchical_search.py --docs 1000 --chunks 50
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+import faiss
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "routers"))
+from hierarchy import CoarseIndex, flat_vectors  # noqa: E402
+
+
+def make_corpus(rng, docs: int, chunks: int, dim: int, spread: float):
+    centers = rng.standard_normal((docs, dim)).astype(np.float32)
+    noise = rng.standard_normal((docs, chunks, dim)).astype(np.float32)
+    vectors = (centers[:, None, :] + spread * noise).reshape(-1, dim)
+    groups = {
+        f"doc{d}": list(range(d * chunks, (d + 1) * chunks))
+        for d in range(docs)
+    }
+    return np.ascontiguousarray(vectors), groups
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--spread", type=float, default=1.5)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=12)
+    parser.add_argument("--fanout", type=int, nargs="+",
+                        default=[2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)
+    rng = np.random.default_rng(args.seed)
+    vectors, groups = make_corpus(
+        rng, args.docs, args.chunks, args.dim, args.spread)
+
+    index = faiss.IndexFlatL2(args.dim)
+    index.add(vectors)
+    coarse = CoarseIndex.build(flat_vectors(index), groups)
+
+    picks = rng.integers(0, len(vectors), args.queries)
+    queries = vectors[picks] + args.spread * rng.standard_normal(
+        (args.queries, args.dim)).astype(np.float32)
+
+    flat_times, truth = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), args.k)
+        flat_times.append(time.perf_counter() - t0)
+        truth.append(set(ids[0].tolist()))
+
+    report = {
+        "corpus": {"docs": args.docs, "chunks": len(vectors),
+                   "dim": args.dim, "k": args.k},
+        "flat": {"p50_ms": percentile_ms(flat_times, 50),
+                 "p95_ms": percentile_ms(flat_times, 95)},
+        "hierarchical": [],
+    }
+
+    for fanout in args.fanout:
+        times, hits = [], 0
+        for q, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            xb = flat_vectors(index)
+            _, ids = coarse.search(xb, q, args.k, fanout)
+            times.append(time.perf_counter() - t0)
+            hits += len(expected & set(ids.tolist()))
+        report["hierarchical"].append({
+            "fanout": fanout,
+            "p50_ms": percentile_ms(times, 50),
+            "p95_ms": percentile_ms(times, 95),
+            "speedup_p50": round(
+                float(np.median(flat_times)) / float(np.median(times)), 2),
+            "recall_at_k": round(hits / (args.k * args.queries), 4),
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
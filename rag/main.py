@@ -2,7 +2,11 @@ import uvicorn
 import logging
 import asyncio
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from dataclasses import asdict
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from deadline import deadline_middleware
+from loop_monitor import DEBUG_TOKEN_HEADER, debug_allowed, loop_monitor
 from routers import router
 from routers.rag import YandexRAG
 
@@ -15,29 +19,40 @@ logger = logging.getLogger(__name__)
 rag_system = None
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Управление жизненным циклом приложения"""
-    logger.info("Starting RAG service...")
-
-    global rag_system
-    rag_system = YandexRAG()
-
+async def _initialize_in_background(rag: YandexRAG) -> None:
+    """Загрузка или построение индекса без блокировки старта сервиса"""
     try:
-        success = rag_system.initialize_rag_system()
+        success = await asyncio.to_thread(rag.initialize_rag_system)
         if success:
             logger.info("RAG system initialized successfully")
         else:
             logger.warning(
-                "RAG system initialization failed - service will "
-                "start but search may not work"
+                "RAG system initialization failed - service is "
+                "alive but not ready for search"
             )
     except Exception as e:
+        rag.state.error = str(e)
+        rag.state.state = "failed"
         logger.error(f"Error during RAG initialization: {e}")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Управление жизненным циклом приложения"""
+    logger.info("Starting RAG service...")
+    loop_monitor.start()
+
+    global rag_system
+    rag_system = YandexRAG()
+
+    # Сервис начинает принимать соединения сразу, индекс грузится в фоне
+    init_task = asyncio.create_task(_initialize_in_background(rag_system))
+
     yield
 
     logger.info("Shutting down RAG service...")
+    init_task.cancel()
+    await loop_monitor.stop()
 
 
 app = FastAPI(
@@ -49,13 +64,16 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Запросы с истёкшим X-Request-Deadline отбрасываются сразу
+app.middleware("http")(deadline_middleware)
+
 # Подключение роутеров
 app.include_router(router)
 
 
 @app.get("/")
 async def root():
-    """Корневой эндпоинт"""
+    """Liveness: процесс жив и принимает запросы"""
     return {
         "message": "RAG Service is running",
         "service": "rag",
@@ -63,6 +81,25 @@ async def root():
     }
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness: индекс загружен, модель прогрета, поиск доступен"""
+    rag = rag_system or YandexRAG()
+    body = {
+        "ready": rag.is_ready,
+        **asdict(rag.state),
+    }
+    return JSONResponse(body, status_code=200 if rag.is_ready else 503)
+
+
+@app.get("/debug/loop")
+async def debug_loop(request: Request, top: int = 10):
+    """Задержка event loop и места, которые его блокировали"""
+    if not debug_allowed(request.headers.get(DEBUG_TOKEN_HEADER)):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return loop_monitor.metrics(top)
+
+
 async def main():
     """Основная функция для запуска сервиса"""
     config = uvicorn.Config(
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILES = ("index.faiss", "index.pkl")
+CHECKPOINT_FORMAT = 2
+
+
+def documents_digest(chunks: List[Document]) -> str:
+    """Отпечаток чанков одного файла: меняется при любом изменении текста"""
+    h = hashlib.sha256()
+    for chunk in chunks:
+        h.update(chunk.page_content.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _files_checksum(path: str) -> str:
+    """Контрольная сумма файлов частичного индекса"""
+    h = hashlib.sha256()
+    for name in INDEX_FILES:
+        with open(os.path.join(path, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+
+class BuildCheckpoint:
+    """
+    Контрольная точка построения векторного хранилища.
+
+    Каждая пачка чанков пишется отдельным сегментом — маленьким FAISS
+    индексом только с её векторами, — а манифест перечисляет сегменты
+    по порядку с обработанными файлами, числом векторов и контрольной
+    суммой. Уже записанные сегменты не переписываются, поэтому запись
+    точки стоит O(размер пачки), а не O(размер индекса). Манифест
+    подменяется атомарно после полной записи сегмента: сегмент без
+    записи в манифесте при следующем сохранении перезаписывается.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._manifest_path = os.path.join(path, MANIFEST_FILE)
+        self._shards: List[dict] = []
+
+    def _write_manifest(self) -> None:
+        tmp_path = f"{self._manifest_path}.tmp"
+        manifest = {"format": CHECKPOINT_FORMAT, "shards": self._shards}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest_path)
+
+    def append(self, shard: FAISS, files: Dict[str, str]) -> None:
+        """Сохранение векторов очередной пачки и её файлов"""
+        os.makedirs(self.path, exist_ok=True)
+        name = f"{len(self._shards) + 1:06d}"
+        shard_path = os.path.join(self.path, name)
+        shutil.rmtree(shard_path, ignore_errors=True)
+        shard.save_local(shard_path)
+
+        self._shards.append({
+            "name": name,
+            "files": files,
+            "vectors": shard.index.ntotal,
+            "checksum": _files_checksum(shard_path),
+        })
+        self._write_manifest()
+
+        logger.info(
+            f"Контрольная точка сохранена: сегмент {name}, "
+            f"{sum(len(s['files']) for s in self._shards)} файлов, "
+            f"{sum(s['vectors'] for s in self._shards)} векторов")
+
+    def _load_shard(self, shard: dict, embeddings) -> Optional[FAISS]:
+        shard_path = os.path.join(self.path, shard["name"])
+        if _files_checksum(shard_path) != shard.get("checksum"):
+            logger.warning(f"Контрольная сумма сегмента {shard['name']} "
+                           f"не совпала")
+            return None
+        store = FAISS.load_local(
+            shard_path,
+            embeddings,
+            allow_dangerous_deserialization=True
+        )
+        if store.index.ntotal != shard.get("vectors"):
+            logger.warning(f"Размер сегмента {shard['name']} не совпадает "
+                           f"с манифестом")
+            return None
+        return store
+
+    def load(self, embeddings) -> Optional[Tuple[FAISS, Dict[str, str]]]:
+        """
+        Загрузка контрольной точки.
+
+        Возвращает (частичный индекс, {файл: отпечаток}) или None, если
+        точки нет или она повреждена. Сегменты после первого
+        повреждённого отбрасываются: их файлы будут обработаны заново.
+        """
+        self._shards = []
+        if not os.path.exists(self._manifest_path):
+            return None
+
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+
+            if manifest.get("format") != CHECKPOINT_FORMAT:
+                logger.warning("Неизвестный формат контрольной точки, "
+                               "начинаем построение заново")
+                self.clear()
+                return None
+
+            vectorstore = None
+            processed: Dict[str, str] = {}
+            for shard in manifest.get("shards", []):
+                try:
+                    store = self._load_shard(shard, embeddings)
+                except Exception as e:
+                    logger.warning(f"Сегмент {shard['name']} не читается: {e}")
+                    store = None
+                if store is None:
+                    break
+                if vectorstore is None:
+                    vectorstore = store
+                else:
+                    vectorstore.merge_from(store)
+                processed.update(shard["files"])
+                self._shards.append(shard)
+
+            if vectorstore is None:
+                logger.warning("В контрольной точке нет целых сегментов, "
+                               "начинаем построение заново")
+                self.clear()
+                return None
+
+            # Манифест без отброшенных сегментов
+            self._write_manifest()
+            logger.info(
+                f"Найдена контрольная точка: {len(processed)} файлов, "
+                f"{vectorstore.index.ntotal} векторов")
+            return vectorstore, processed
+
+        except Exception as e:
+            logger.error(f"Ошибка загрузки контрольной точки: {e}")
+            self.clear()
+            return None
+
+    def clear(self) -> None:
+        """Удаление контрольной точки"""
+        self._shards = []
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+COARSE_VECTORS_FILE = "coarse.npy"
+COARSE_GROUPS_FILE = "coarse.json"
+
+
+def _to_runs(ids: Sequence[int]) -> List[List[int]]:
+    """Сжатие списка id в отрезки [start, end)"""
+    runs: List[List[int]] = []
+    for i in sorted(ids):
+        if runs and runs[-1][1] == i:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i, i + 1])
+    return runs
+
+
+def flat_vectors(index) -> Optional[np.ndarray]:
+    """
+    Представление векторов плоского FAISS индекса без копирования.
+    Для остальных типов индексов возвращает None.
+    """
+    index = faiss.downcast_index(index)
+    if not isinstance(index, faiss.IndexFlat):
+        return None
+    return faiss.rev_swig_ptr(
+        index.get_xb(), index.ntotal * index.d
+    ).reshape(index.ntotal, index.d)
+
+
+class CoarseIndex:
+    """
+    Первый уровень двухуровневого индекса.
+
+    Для каждой группы чанков (документ или глава) хранит вектор-сводку —
+    центроид эмбеддингов её чанков — и отрезки id чанков в основном
+    индексе. Запрос сначала выбирает несколько ближайших групп, затем
+    точный поиск идёт только по их чанкам.
+    """
+
+    def __init__(self, keys: List[str], centroids: np.ndarray,
+                 runs: List[List[List[int]]]):
+        self.keys = keys
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.runs = runs
+        self.sizes = [sum(e - s for s, e in r) for r in runs]
+        self._index = faiss.IndexFlatL2(self.centroids.shape[1])
+        self._index.add(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray,
+              groups: Dict[str, List[int]]) -> "CoarseIndex":
+        """Построение по векторам основного индекса и составу групп"""
+        keys = list(groups)
+        centroids = np.stack([
+            vectors[np.asarray(groups[key])].mean(axis=0) for key in keys
+        ])
+        runs = [_to_runs(groups[key]) for key in keys]
+        logger.info(
+            f"Построен грубый индекс: {len(keys)} групп, "
+            f"{len(vectors)} чанков")
+        return cls(keys, centroids, runs)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def save(self, path: str) -> None:
+        np.save(os.path.join(path, COARSE_VECTORS_FILE), self.centroids)
+        with open(os.path.join(path, COARSE_GROUPS_FILE), "w",
+                  encoding="utf-8") as f:
+            json.dump({"keys": self.keys, "runs": self.runs},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CoarseIndex"]:
+        vectors_path = os.path.join(path, COARSE_VECTORS_FILE)
+        groups_path = os.path.join(path, COARSE_GROUPS_FILE)
+        if not (os.path.exists(vectors_path) and os.path.exists(groups_path)):
+            return None
+        with open(groups_path, encoding="utf-8") as f:
+            groups = json.load(f)
+        return cls(groups["keys"], np.load(vectors_path), groups["runs"])
+
+    @staticmethod
+    def remove(path: str) -> None:
+        for name in (COARSE_VECTORS_FILE, COARSE_GROUPS_FILE):
+            file_path = os.path.join(path, name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, k: int,
+               top_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск k ближайших чанков внутри top_groups лучших групп.
+
+        vectors — векторы основного индекса (см. flat_vectors).
+        Возвращает (расстояния L2², id чанков), как faiss.Index.search;
+        если кандидатов нет, оба массива пустые.
+        """
+        empty = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64))
+        top_groups = min(top_groups, len(self.keys))
+        if k < 1 or top_groups < 1:
+            return empty
+
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        _, group_ids = self._index.search(query, top_groups)
+
+        runs = [
+            np.arange(s, e)
+            for g in group_ids[0] if g >= 0
+            for s, e in self.runs[g]
+        ]
+        if not runs:
+            return empty
+        ids = np.concatenate(runs)
+        candidates = vectors[ids]
+        diff = candidates - query
+        distances = np.einsum("ij,ij->i", diff, diff)
+
+        k = min(k, len(ids))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        return distances[best], ids[best]
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+RE_SECTION = re.compile(r"^\s*раздел\s+[ivxlcdm\d]+\b", re.IGNORECASE)
+RE_CHAPTER = re.compile(r"^\s*глава\s+[ivxlcdm\d]+(?:\.\d+)*\b", re.IGNORECASE)
+RE_ARTICLE = re.compile(r"^\s*статья\s+\d+(?:\.\d+)*\b", re.IGNORECASE)
+RE_CLAUSE = re.compile(r"^\s*(?:\d+(?:\.\d+)*[.)]|[а-я]\))\s+", re.IGNORECASE)
+
+
+@dataclass
+class LegalUnit:
+    """Статья (или преамбула) с её положением в структуре акта"""
+    parent_id: str
+    source_file: str
+    title: str
+    section: str = ""
+    chapter: str = ""
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines).strip()
+
+
+class LegalStructureSplitter:
+    """
+    Разбиение нормативных актов по структуре: разделы, главы, статьи,
+    пункты.
+
+    Родительский документ — статья целиком. Для поиска индексируются
+    дочерние чанки: группы соседних пунктов статьи не длиннее
+    child_chunk_size. Каждый дочерний чанк хранит parent_id и смещения
+    в тексте статьи, чтобы при выдаче вернуть статью или её окно.
+    """
+
+    def __init__(self, child_chunk_size: int = 400):
+        self.child_chunk_size = child_chunk_size
+        self._fallback = RecursiveCharacterTextSplitter(
+            chunk_size=child_chunk_size,
+            chunk_overlap=0,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+
+    def split_units(self, doc: Document, first: int = 0) -> List[LegalUnit]:
+        """Выделение статей из документа; first — номер первой статьи"""
+        source = doc.metadata.get('source_file', 'unknown')
+        units: List[LegalUnit] = []
+        section = chapter = ""
+        current: Optional[LegalUnit] = None
+
+        def start_unit(title: str) -> LegalUnit:
+            unit = LegalUnit(
+                parent_id=f"{source}#{first + len(units)}",
+                source_file=source,
+                title=title,
+                section=section,
+                chapter=chapter,
+            )
+            units.append(unit)
+            return unit
+
+        for line in doc.page_content.splitlines():
+            stripped = line.strip()
+            if RE_SECTION.match(stripped):
+                section, chapter = stripped, ""
+                current = None
+                continue
+            if RE_CHAPTER.match(stripped):
+                chapter = stripped
+                current = None
+                continue
+            if RE_ARTICLE.match(stripped):
+                current = start_unit(stripped)
+                current.lines.append(stripped)
+                continue
+            if current is None:
+                if not stripped:
+                    continue
+                current = start_unit(chapter or section or source)
+            current.lines.append(stripped)
+
+        return [u for u in units if u.text]
+
+    def _clauses(self, text: str) -> List[Tuple[int, str]]:
+        """Пункты статьи со смещениями; первая строка — заголовок"""
+        clauses: List[Tuple[int, str]] = []
+        offset = 0
+        start, buf = 0, []
+        for line in text.split("\n"):
+            if buf and RE_CLAUSE.match(line):
+                clauses.append((start, "\n".join(buf)))
+                start, buf = offset, []
+            buf.append(line)
+            offset += len(line) + 1
+        if buf:
+            clauses.append((start, "\n".join(buf)))
+        return clauses
+
+    def split_children(self, unit: LegalUnit) -> List[Document]:
+        """Дочерние чанки статьи для векторного поиска"""
+        text = unit.text
+        header = unit.title if unit.title != unit.source_file else ""
+        pieces: List[Tuple[int, str]] = []
+
+        for start, clause in self._clauses(text):
+            if len(clause) <= self.child_chunk_size:
+                pieces.append((start, clause))
+                continue
+            pos = start
+            for part in self._fallback.split_text(clause):
+                found = text.find(part, pos)
+                pos = found if found >= 0 else pos
+                pieces.append((pos, part))
+
+        # Склеиваем короткие соседние пункты
+        groups: List[Tuple[int, int, str]] = []
+        for start, piece in pieces:
+            if groups:
+                g_start, g_end, g_text = groups[-1]
+                if len(g_text) + len(piece) + 1 <= self.child_chunk_size:
+                    groups[-1] = (g_start, start + len(piece),
+                                  g_text + "\n" + piece)
+                    continue
+            groups.append((start, start + len(piece), piece))
+
+        children = []
+        for start, end, piece in groups:
+            content = piece
+            if header and not piece.startswith(header):
+                content = f"{header}\n{piece}"
+            children.append(Document(
+                page_content=content,
+                metadata={
+                    'source_file': unit.source_file,
+                    'parent_id': unit.parent_id,
+                    'start': start,
+                    'end': end,
+                }
+            ))
+        return children
+
+    def split_documents(
+            self,
+            docs: List[Document]) -> Tuple[Dict[str, dict], List[Document]]:
+        """
+        Возвращает (родительские статьи по parent_id, дочерние чанки).
+        """
+        parents: Dict[str, dict] = {}
+        children: List[Document] = []
+        counters: Dict[str, int] = {}
+
+        for doc in docs:
+            source = doc.metadata.get('source_file', 'unknown')
+            units = self.split_units(doc, counters.get(source, 0))
+            counters[source] = counters.get(source, 0) + len(units)
+            for unit in units:
+                parents[unit.parent_id] = {
+                    'content': unit.text,
+                    'source_file': unit.source_file,
+                    'title': unit.title,
+                    'section': unit.section,
+                    'chapter': unit.chapter,
+                }
+                children.extend(self.split_children(unit))
+
+        logger.info(
+            f"Структурное разбиение: {len(parents)} статей, "
+            f"{len(children)} дочерних чанков")
+        return parents, children
+
+
+def parent_window(content: str, spans: List[Tuple[int, int]],
+                  max_chars: int) -> str:
+    """
+    Окно статьи вокруг найденных фрагментов не длиннее max_chars.
+    Короткая статья возвращается целиком.
+    """
+    if len(content) <= max_chars:
+        return content
+
+    lo = min(s for s, _ in spans)
+    hi = max(e for _, e in spans)
+    if hi - lo >= max_chars:
+        hi = lo + max_chars
+    else:
+        pad = (max_chars - (hi - lo)) // 2
+        lo = max(0, lo - pad)
+        hi = min(len(content), lo + max_chars)
+        lo = max(0, hi - max_chars)
+
+    window = content[lo:hi].strip()
+    # Заголовок статьи сохраняем всегда
+    title = content.split("\n", 1)[0]
+    if lo > 0 and not window.startswith(title):
+        window = f"{title}\n…{window}"
+    if hi < len(content):
+        window += "…"
+    return window
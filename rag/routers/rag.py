@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import os
+import json
+import time
 import tempfile
 import boto3
 import logging
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -11,6 +13,9 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
 from dotenv import load_dotenv
+from .checkpoint import BuildCheckpoint, documents_digest
+from .legal_splitter import LegalStructureSplitter, parent_window
+from .hierarchy import CoarseIndex, flat_vectors
 
 load_dotenv()
 
@@ -30,6 +35,27 @@ CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
 TOP_K_RESULTS = 3
 
+# Структурное разбиение: "legal" — статьи и пункты, "recursive" — по символам
+CHUNKING_MODE = os.getenv('RAG_CHUNKING', 'legal')
+CHILD_CHUNK_SIZE = 400
+PARENT_MAX_CHARS = 2000
+CHILD_FETCH_FACTOR = 4
+PARENTS_FILE = "parents.json"
+VERSION_FILE = "version"
+
+# Двухуровневый поиск: сначала группы (документы/главы), затем их чанки
+HIERARCHICAL_SEARCH = os.getenv('RAG_HIERARCHICAL', '1') == '1'
+COARSE_TOP_GROUPS = int(os.getenv('RAG_COARSE_TOP_GROUPS', '8'))
+HIERARCHY_MIN_CHUNKS = int(os.getenv('RAG_HIERARCHY_MIN_CHUNKS', '2000'))
+if HIERARCHICAL_SEARCH and COARSE_TOP_GROUPS < 1:
+    logger.warning(f"RAG_COARSE_TOP_GROUPS={COARSE_TOP_GROUPS} меньше 1, "
+                   f"двухуровневый поиск отключён")
+    HIERARCHICAL_SEARCH = False
+
+# Контрольные точки построения индекса
+CHECKPOINT_PATH = f"{VECTORSTORE_PATH}_checkpoint"
+CHECKPOINT_EVERY = int(os.getenv('RAG_CHECKPOINT_EVERY', '256'))
+
 
 @dataclass
 class RetrievedDocument:
@@ -40,6 +66,16 @@ class RetrievedDocument:
     rank: int
 
 
+@dataclass
+class RAGState:
+    """Состояние готовности RAG системы для readiness-проверки"""
+    state: str = "starting"
+    progress: float = 0.0
+    index_version: Optional[str] = None
+    model_warm: bool = False
+    error: Optional[str] = None
+
+
 class YandexRAG:
     """RAG система для работы с Yandex Object Storage"""
 
@@ -58,10 +94,28 @@ class YandexRAG:
         self.s3_client = None
         self.embeddings = None
         self.vectorstore = None
+        self.parents: Dict[str, dict] = {}
+        self.coarse = None
+        self.state = RAGState()
+        # Модель эмбеддингов загружается в initialize_rag_system,
+        # чтобы импорт модуля не блокировал старт сервиса
         self._init_s3_client()
-        self._init_embeddings()
         self._initialized = True
 
+    @property
+    def is_ready(self) -> bool:
+        """Индекс загружен и модель прогрета — можно искать"""
+        return (
+            self.state.state == "ready"
+            and self.state.model_warm
+            and self.vectorstore is not None
+        )
+
+    def _set_state(self, state: str, progress: float = 0.0) -> None:
+        self.state.state = state
+        self.state.progress = progress
+        logger.info(f"Состояние RAG системы: {state}")
+
     def _init_s3_client(self):
         """Инициализация S3 клиента для Yandex Object Storage"""
         try:
@@ -91,6 +145,18 @@ class YandexRAG:
         except Exception as e:
             logger.error(f"Ошибка загрузки модели эмбеддингов: {e}")
 
+    def _warm_up_embeddings(self) -> bool:
+        """Прогрев модели: первый вызов заметно медленнее последующих"""
+        try:
+            t0 = time.time()
+            self.embeddings.embed_query("прогрев модели")
+            self.state.model_warm = True
+            logger.info(f"Модель эмбеддингов прогрета за {time.time() - t0:.2f}s")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка прогрева модели эмбеддингов: {e}")
+            return False
+
     def download_docs_from_s3(self) -> List[str]:
         """Загрузка документов из Yandex Object Storage"""
         if not self.s3_client:
@@ -156,7 +222,13 @@ class YandexRAG:
             logger.warning("Нет валидных документов для обработки")
             return []
 
+        if CHUNKING_MODE == 'legal':
+            self.parents, chunks = LegalStructureSplitter(
+                CHILD_CHUNK_SIZE).split_documents(docs)
+            return chunks
+
         # Разбиваем документы на чанки
+        self.parents = {}
         splitter = RecursiveCharacterTextSplitter(
             chunk_size=CHUNK_SIZE,
             chunk_overlap=CHUNK_OVERLAP,
@@ -169,7 +241,16 @@ class YandexRAG:
         return chunks
 
     def build_vectorstore(self, chunks: List[Document]) -> bool:
-        """Создание векторного хранилища"""
+        """
+        Создание векторного хранилища с контрольными точками.
+
+        Чанки эмбеддятся пачками по файлам; каждые CHECKPOINT_EVERY чанков
+        векторы пачки дописываются в контрольную точку отдельным сегментом.
+        Если предыдущее построение было прервано, уже обработанные файлы
+        с неизменным содержимым берутся из контрольной точки. Идентификаторы
+        чанков зависят только от файла и позиции в нём, поэтому продолженное
+        построение даёт тот же индекс, что и непрерывное.
+        """
         if not chunks:
             logger.error("Нет чанков для создания векторного хранилища")
             return False
@@ -179,11 +260,67 @@ class YandexRAG:
             return False
 
         try:
-            self.vectorstore = FAISS.from_documents(chunks, self.embeddings)
+            by_file: Dict[str, List[Document]] = {}
+            for chunk in chunks:
+                source = chunk.metadata.get('source_file', 'unknown')
+                by_file.setdefault(source, []).append(chunk)
+            digests = {
+                source: documents_digest(file_chunks)
+                for source, file_chunks in by_file.items()
+            }
+
+            checkpoint = BuildCheckpoint(CHECKPOINT_PATH)
+            vectorstore = None
+            processed: Dict[str, str] = {}
+
+            restored = checkpoint.load(self.embeddings)
+            if restored:
+                restored_store, restored_files = restored
+                if all(digests.get(source) == digest
+                       for source, digest in restored_files.items()):
+                    vectorstore, processed = restored_store, restored_files
+                    logger.info(
+                        f"Продолжаем построение: пропускаем "
+                        f"{len(processed)} из {len(by_file)} файлов")
+                else:
+                    logger.info("Документы изменились с момента "
+                                "контрольной точки, начинаем заново")
+                    checkpoint.clear()
+
+            batch: List[Document] = []
+            batch_files: List[str] = []
+            pending = [s for s in by_file if s not in processed]
+
+            for i, source in enumerate(pending):
+                batch.extend(by_file[source])
+                batch_files.append(source)
+
+                if len(batch) < CHECKPOINT_EVERY and i < len(pending) - 1:
+                    continue
+
+                ids = [f"{done}#{n}" for done in batch_files
+                       for n in range(len(by_file[done]))]
+                shard = FAISS.from_documents(batch, self.embeddings, ids=ids)
+                files = {done: digests[done] for done in batch_files}
+                checkpoint.append(shard, files)
+                if vectorstore is None:
+                    vectorstore = shard
+                else:
+                    vectorstore.merge_from(shard)
+
+                processed.update(files)
+                self.state.progress = len(processed) / len(by_file)
+                batch, batch_files = [], []
+
+            self.vectorstore = vectorstore
 
             # Сохраняем векторное хранилище на диск
             os.makedirs(os.path.dirname(VECTORSTORE_PATH), exist_ok=True)
             self.vectorstore.save_local(VECTORSTORE_PATH)
+            self._save_version()
+            self._save_parents()
+            self._build_coarse()
+            checkpoint.clear()
 
             logger.info("Векторное хранилище успешно создано и сохранено")
             return True
@@ -192,6 +329,96 @@ class YandexRAG:
             logger.error(f"Ошибка создания векторного хранилища: {e}")
             return False
 
+    def _save_version(self) -> None:
+        """Версия индекса: время построения и число векторов"""
+        version = (f"{time.strftime('%Y%m%d%H%M%S')}-"
+                   f"{self.vectorstore.index.ntotal}")
+        with open(os.path.join(VECTORSTORE_PATH, VERSION_FILE), "w") as f:
+            f.write(version)
+        self.state.index_version = version
+
+    def _load_version(self) -> None:
+        """Чтение версии индекса; для старых индексов — по mtime файла"""
+        path = os.path.join(VECTORSTORE_PATH, VERSION_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state.index_version = f.read().strip()
+            return
+        mtime = os.path.getmtime(os.path.join(VECTORSTORE_PATH, "index.faiss"))
+        self.state.index_version = (
+            f"{time.strftime('%Y%m%d%H%M%S', time.localtime(mtime))}-"
+            f"{self.vectorstore.index.ntotal}")
+
+    def _save_parents(self) -> None:
+        """Сохранение родительских статей рядом с индексом"""
+        path = os.path.join(VECTORSTORE_PATH, PARENTS_FILE)
+        if not self.parents:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.parents, f, ensure_ascii=False)
+
+    def _load_parents(self) -> None:
+        """Загрузка родительских статей; старые индексы их не содержат"""
+        path = os.path.join(VECTORSTORE_PATH, PARENTS_FILE)
+        self.parents = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.parents = json.load(f)
+            logger.info(f"Загружено {len(self.parents)} родительских статей")
+
+    def _build_coarse(self) -> None:
+        """Построение грубого уровня: группа — глава статьи или файл"""
+        self.coarse = None
+        vectors = flat_vectors(self.vectorstore.index)
+        if vectors is None:
+            CoarseIndex.remove(VECTORSTORE_PATH)
+            logger.warning("Индекс не плоский, двухуровневый поиск отключён")
+            return
+
+        groups: Dict[str, List[int]] = {}
+        docstore = self.vectorstore.docstore
+        for i, doc_id in self.vectorstore.index_to_docstore_id.items():
+            metadata = docstore.search(doc_id).metadata
+            key = metadata.get('source_file', 'unknown')
+            parent = self.parents.get(metadata.get('parent_id'))
+            if parent and parent.get('chapter'):
+                key = f"{key}|{parent['chapter']}"
+            groups.setdefault(key, []).append(i)
+
+        self.coarse = CoarseIndex.build(vectors, groups)
+        self.coarse.save(VECTORSTORE_PATH)
+
+    def _search_chunks(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        """
+        Поиск k ближайших чанков: двухуровневый для больших индексов,
+        иначе полный перебор.
+        """
+        index = self.vectorstore.index
+        use_coarse = (
+            HIERARCHICAL_SEARCH
+            and self.coarse is not None
+            and index.ntotal >= HIERARCHY_MIN_CHUNKS
+        )
+        vectors = flat_vectors(index) if use_coarse else None
+        if vectors is None:
+            return self.vectorstore.similarity_search_with_score(query, k=k)
+
+        query_vector = self.embeddings.embed_query(query)
+        distances, ids = self.coarse.search(
+            vectors, query_vector, k, COARSE_TOP_GROUPS)
+        if len(ids) == 0:
+            # Ни одной группы не нашлось — ищем по всему индексу
+            return self.vectorstore.similarity_search_with_score(query, k=k)
+
+        docstore = self.vectorstore.docstore
+        id_map = self.vectorstore.index_to_docstore_id
+        return [
+            (docstore.search(id_map[int(i)]), float(d))
+            for d, i in zip(distances, ids)
+        ]
+
     def load_vectorstore(self) -> bool:
         """Загрузка векторного хранилища с диска"""
         if not self.embeddings:
@@ -208,6 +435,9 @@ class YandexRAG:
                 self.embeddings,
                 allow_dangerous_deserialization=True
             )
+            self._load_parents()
+            self.coarse = CoarseIndex.load(VECTORSTORE_PATH)
+            self._load_version()
 
             logger.info("Векторное хранилище успешно загружено")
             return True
@@ -217,30 +447,54 @@ class YandexRAG:
             return False
 
     def initialize_rag_system(self) -> bool:
-        """Полная инициализация RAG системы"""
+        """
+        Полная инициализация RAG системы.
+
+        Долгая операция (загрузка модели, S3, построение индекса) —
+        сервис запускает её в фоне и отслеживает ход через self.state.
+        """
         logger.info("Начинаем инициализацию RAG системы...")
+        self.state.error = None
+
+        self._set_state("loading_model")
+        if not self.embeddings:
+            self._init_embeddings()
+        if not self.embeddings or not self._warm_up_embeddings():
+            return self._fail("Модель эмбеддингов не загружена")
 
         # Пытаемся загрузить существующее векторное хранилище
+        self._set_state("loading_index")
         if self.load_vectorstore():
+            self._set_state("ready", 1.0)
             return True
 
         # Если не удалось, создаем новое
         logger.info("Создаем новое векторное хранилище...")
 
         # Загружаем документы из S3
+        self._set_state("downloading")
         files = self.download_docs_from_s3()
         if not files:
-            logger.error("Не удалось загрузить файлы из S3")
-            return False
+            return self._fail("Не удалось загрузить файлы из S3")
 
         # Обрабатываем документы
+        self._set_state("building")
         chunks = self.load_and_split_documents(files)
         if not chunks:
-            logger.error("Не удалось создать чанки документов")
-            return False
+            return self._fail("Не удалось создать чанки документов")
 
         # Создаем векторное хранилище
-        return self.build_vectorstore(chunks)
+        if not self.build_vectorstore(chunks):
+            return self._fail("Ошибка создания векторного хранилища")
+
+        self._set_state("ready", 1.0)
+        return True
+
+    def _fail(self, reason: str) -> bool:
+        logger.error(reason)
+        self.state.error = reason
+        self._set_state("failed", self.state.progress)
+        return False
 
     def retrieve_documents(self, query: str, top_k: int = TOP_K_RESULTS) -> List[RetrievedDocument]:
         """Поиск релевантных документов с ранжированием"""
@@ -250,9 +504,10 @@ class YandexRAG:
                 return []
 
         try:
-            docs_with_scores = self.vectorstore.similarity_search_with_score(
-                query, k=top_k
-            )
+            if self.parents:
+                return self._retrieve_parents(query, top_k)
+
+            docs_with_scores = self._search_chunks(query, top_k)
 
             retrieved_docs = []
             for rank, (doc, score) in enumerate(docs_with_scores, 1):
@@ -271,6 +526,47 @@ class YandexRAG:
             logger.error(f"Ошибка поиска документов: {e}")
             return []
 
+    def _retrieve_parents(self, query: str, top_k: int) -> List[RetrievedDocument]:
+        """
+        Поиск по дочерним чанкам с выдачей родительских статей.
+
+        Несколько попаданий в одну статью схлопываются в один документ
+        с лучшим score; длинная статья обрезается до окна вокруг
+        найденных фрагментов.
+        """
+        docs_with_scores = self._search_chunks(
+            query, top_k * CHILD_FETCH_FACTOR)
+
+        hits: Dict[str, Tuple[float, List[Tuple[int, int]]]] = {}
+        order: List[str] = []
+        for doc, score in docs_with_scores:
+            parent_id = doc.metadata.get('parent_id')
+            if parent_id not in self.parents:
+                continue
+            span = (doc.metadata.get('start', 0), doc.metadata.get('end', 0))
+            if parent_id not in hits:
+                hits[parent_id] = (float(score), [span])
+                order.append(parent_id)
+            else:
+                hits[parent_id][1].append(span)
+
+        retrieved_docs = []
+        for rank, parent_id in enumerate(order[:top_k], 1):
+            score, spans = hits[parent_id]
+            parent = self.parents[parent_id]
+            retrieved_docs.append(RetrievedDocument(
+                content=parent_window(
+                    parent['content'], spans, PARENT_MAX_CHARS),
+                source=parent.get('source_file', 'unknown'),
+                score=score,
+                rank=rank
+            ))
+
+        logger.info(
+            f"Найдено {len(retrieved_docs)} статей "
+            f"по {len(docs_with_scores)} фрагментам")
+        return retrieved_docs
+
     def format_context_for_llm(self, retrieved_docs: List[RetrievedDocument]) -> str:
         """Форматирование контекста для передачи в LLM"""
         if not retrieved_docs:
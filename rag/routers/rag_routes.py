@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
 import logging
 from models import RAGRequest, RAGResult, DocumentResult
 from routers.rag import YandexRAG
@@ -22,6 +23,18 @@ async def search_documents(req: RAGRequest):
         if top_k < 1 or top_k > 20:
             raise HTTPException(status_code=400, detail="top_k must be between 1 and 20")
 
+        # Пока индекс строится, отвечаем сразу, а не ждём загрузки
+        if not rag_system.is_ready:
+            return JSONResponse(
+                status_code=503,
+                content=RAGResult(
+                    success=False,
+                    context="",
+                    error=f"RAG index is not ready: {rag_system.state.state}"
+                ).model_dump(),
+                headers={"Retry-After": "5"}
+            )
+
         context, retrieved_docs = rag_system.search(query, top_k)
 
         document_results = []
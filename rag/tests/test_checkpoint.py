@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Прерванное и продолженное построение индекса даёт тот же индекс,
+что и непрерывное.
+
+    cd rag && python -m pytest -q tests
+"""
+import os
+import sys
+import importlib
+
+import pytest
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from routers.checkpoint import BuildCheckpoint  # noqa: E402
+
+# routers.rag в пакете заслонён роутером с тем же именем
+rag_module = importlib.import_module("routers.rag")
+
+BATCH = 4
+
+
+class CrashingEmbedding(DeterministicFakeEmbedding):
+    """Эмбеддинги, которые "падают" после заданного числа пачек"""
+
+    fail_after: int = -1
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        if self.calls == self.fail_after:
+            raise RuntimeError("процесс убит")
+        self.calls += 1
+        return super().embed_documents(texts)
+
+
+def make_chunks(files=9, per_file=3):
+    return [
+        Document(page_content=f"Статья {n} документа {f}: текст {f * n}",
+                 metadata={"source_file": f"law_{f}.txt"})
+        for f in range(files) for n in range(per_file)
+    ]
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rag_module, "CHECKPOINT_EVERY", BATCH)
+    monkeypatch.setattr(rag_module, "VECTORSTORE_PATH",
+                        str(tmp_path / "vectorstore_faiss"))
+    monkeypatch.setattr(rag_module, "CHECKPOINT_PATH",
+                        str(tmp_path / "checkpoint"))
+    monkeypatch.setattr(rag_module.YandexRAG, "_instance", None)
+    return rag_module.YandexRAG()
+
+
+def doc_ids(vectorstore):
+    return [vectorstore.index_to_docstore_id[i]
+            for i in range(vectorstore.index.ntotal)]
+
+
+def test_resume_matches_uninterrupted_build(rag):
+    chunks = make_chunks()
+
+    rag.embeddings = CrashingEmbedding(size=16)
+    assert rag.build_vectorstore(chunks)
+    expected_total = rag.vectorstore.index.ntotal
+    expected_ids = doc_ids(rag.vectorstore)
+    expected_vectors = rag.vectorstore.index.reconstruct_n(0, expected_total)
+    assert expected_total == len(chunks)
+    assert not os.path.exists(rag_module.CHECKPOINT_PATH)
+
+    # Убиваем построение после двух пачек
+    rag.vectorstore = None
+    rag.embeddings = CrashingEmbedding(size=16, fail_after=2)
+    assert not rag.build_vectorstore(chunks)
+    restored = BuildCheckpoint(rag_module.CHECKPOINT_PATH).load(rag.embeddings)
+    assert restored is not None
+    partial, processed = restored
+    assert 0 < partial.index.ntotal < expected_total
+    assert len(processed) < len({c.metadata["source_file"] for c in chunks})
+
+    # Продолжаем: эмбеддятся только необработанные файлы
+    rag.embeddings = CrashingEmbedding(size=16)
+    assert rag.build_vectorstore(chunks)
+    assert rag.embeddings.calls < -(-len(chunks) // BATCH)
+    assert rag.vectorstore.index.ntotal == expected_total
+    assert doc_ids(rag.vectorstore) == expected_ids
+    assert (rag.vectorstore.index.reconstruct_n(0, expected_total)
+            == expected_vectors).all()
+
+
+def test_checkpoint_appends_without_rewriting_shards(rag, tmp_path):
+    rag.embeddings = CrashingEmbedding(size=16, fail_after=3)
+    assert not rag.build_vectorstore(make_chunks())
+
+    path = rag_module.CHECKPOINT_PATH
+    shards = sorted(d for d in os.listdir(path) if d.isdigit())
+    assert len(shards) == 3
+    first = os.path.join(path, shards[0], "index.faiss")
+    mtime = os.stat(first).st_mtime_ns
+    size = os.path.getsize(first)
+
+    # Ещё одна пачка дописывается рядом, первый сегмент не трогается
+    rag.embeddings = CrashingEmbedding(size=16, fail_after=1)
+    assert not rag.build_vectorstore(make_chunks())
+    assert len([d for d in os.listdir(path) if d.isdigit()]) == 4
+    assert os.stat(first).st_mtime_ns == mtime
+    assert os.path.getsize(first) == size
+
+
+def test_corrupt_shard_drops_only_the_tail(rag):
+    rag.embeddings = CrashingEmbedding(size=16, fail_after=3)
+    assert not rag.build_vectorstore(make_chunks())
+
+    path = rag_module.CHECKPOINT_PATH
+    with open(os.path.join(path, "000002", "index.faiss"), "ab") as f:
+        f.write(b"garbage")
+
+    checkpoint = BuildCheckpoint(path)
+    restored = checkpoint.load(rag.embeddings)
+    assert restored is not None
+    partial, processed = restored
+    # Пачка — два файла по три чанка: остаётся только первый сегмент
+    assert processed == {"law_0.txt": processed["law_0.txt"],
+                         "law_1.txt": processed["law_1.txt"]}
+    assert partial.index.ntotal == 6
+    assert [s["name"] for s in checkpoint._shards] == ["000001"]
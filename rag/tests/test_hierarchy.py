@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from routers.hierarchy import CoarseIndex  # noqa: E402
+
+
+def make_index(groups=4, per_group=5, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((groups * per_group, dim)).astype(np.float32)
+    members = {f"g{g}": list(range(g * per_group, (g + 1) * per_group))
+               for g in range(groups)}
+    return vectors, CoarseIndex.build(vectors, members)
+
+
+def test_search_matches_brute_force_over_all_groups():
+    vectors, coarse = make_index()
+    query = vectors[3] + 0.01
+    distances, ids = coarse.search(vectors, query, 5, len(coarse))
+    expected = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+    assert list(ids) == list(expected)
+    assert np.all(np.diff(distances) >= 0)
+
+
+def test_zero_top_groups_returns_empty():
+    vectors, coarse = make_index()
+    distances, ids = coarse.search(vectors, vectors[0], 5, 0)
+    assert len(distances) == len(ids) == 0
+
+
+def test_zero_k_returns_empty():
+    vectors, coarse = make_index()
+    distances, ids = coarse.search(vectors, vectors[0], 0, 2)
+    assert len(distances) == len(ids) == 0
+
+
+def test_empty_groups_return_empty():
+    vectors, _ = make_index()
+    coarse = CoarseIndex(["a", "b"], vectors[:2], [[], []])
+    distances, ids = coarse.search(vectors, vectors[0], 3, 2)
+    assert len(distances) == len(ids) == 0
+
+
+def test_k_larger_than_candidates():
+    vectors, coarse = make_index(per_group=2)
+    _, ids = coarse.search(vectors, vectors[0], 10, 1)
+    assert len(ids) == 2 and ids[0] // 2 == ids[1] // 2
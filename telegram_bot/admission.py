@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Адаптивный контроль допуска и справедливая очередь для тяжёлого пути бота.
+
+Лимит одновременных запросов подбирается по AIMD: каждый быстрый
+успешный запрос прибавляет 1/limit (≈ +1 за «окно» из limit запросов),
+ошибка или задержка выше target_latency умножают лимит на backoff — не
+чаще раза за target_latency, чтобы одна волна медленных ответов не
+обрушила лимит до минимума. Очередь ожидания ограничена max_queue:
+сверх неё запрос сразу отклоняется (Overloaded), пока это дёшево.
+
+Очередь не FIFO, а взвешенная справедливая (start-time fair queueing).
+Поток — пользователь; каждый запрос получает метку
+start = max(V, finish потока), finish = start + cost / weight, где cost —
+среднее время, которое запросы этого потока держат слот. Слот получает
+ожидающий с наименьшей меткой start, V — метка последнего допущенного.
+Пользователь, заваливающий бота длинными запросами, уходит вперёд по
+виртуальному времени и ждёт сам, не задерживая остальных; вес > 1
+(администраторы, платные тарифы) даёт потоку пропорционально больше слотов.
+"""
+import asyncio
+import heapq
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import (Any, AsyncIterator, Awaitable, Callable, Deque, Dict,
+                    Hashable, List, Optional, Tuple)
+
+QueuedCallback = Callable[[int, float], Awaitable[None]]
+
+# Выше этого числа потоков неактивные записи вычищаются
+FLOWS_PRUNE_THRESHOLD = 1024
+
+
+class Overloaded(Exception):
+    """Очередь заполнена, запрос отклонён"""
+
+    def __init__(self, queue_depth: int) -> None:
+        super().__init__(f"admission queue is full ({queue_depth})")
+        self.queue_depth = queue_depth
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """'user:1=4,chat:-100500=2' -> {'user:1': 4.0, 'chat:-100500': 2.0}"""
+    weights: Dict[str, float] = {}
+    for item in spec.split(","):
+        key, sep, value = item.strip().rpartition("=")
+        if sep and key:
+            weights[key.strip()] = float(value)
+    return weights
+
+
+class _Flow:
+    __slots__ = ("finish", "cost", "weight")
+
+    def __init__(self, weight: float) -> None:
+        self.finish = 0.0
+        self.cost: Optional[float] = None
+        self.weight = weight
+
+
+class AdmissionController:
+    def __init__(
+            self,
+            initial_limit: int = 4,
+            min_limit: int = 1,
+            max_limit: int = 32,
+            max_queue: int = 50,
+            target_latency: float = 10.0,
+            backoff: float = 0.7) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.target_latency = target_latency
+        self.backoff = backoff
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+
+        # (start, seq, future); отменённые удаляются лениво
+        self._heap: List[Tuple[float, int, "asyncio.Future[None]"]] = []
+        self._depth = 0
+        self._seq = 0
+        self._vtime = 0.0
+        self._flows: Dict[Hashable, _Flow] = {}
+
+        self._admitted = 0
+        self._queued = 0
+        self._shed = 0
+        self._errors = 0
+        self._slow = 0
+        self._service_time: Optional[float] = None
+        self._waits: Deque[float] = deque(maxlen=1000)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._depth
+
+    def estimated_wait(self, position: int) -> float:
+        """Оценка ожидания для позиции в очереди (1 — первый)"""
+        service_time = self._service_time or self.target_latency
+        return position * service_time / max(self.limit, 1)
+
+    def _tag(self, flow: Hashable, weight: float) -> float:
+        """Метка start для нового запроса потока; сдвигает finish потока"""
+        state = self._flows.get(flow)
+        if state is None:
+            if len(self._flows) >= FLOWS_PRUNE_THRESHOLD:
+                self._prune_flows()
+            state = self._flows[flow] = _Flow(weight)
+        state.weight = weight
+        start = max(self._vtime, state.finish)
+        cost = state.cost or self._service_time or self.target_latency
+        state.finish = start + cost / weight
+        return start
+
+    def _prune_flows(self) -> None:
+        # Поток, отстающий от V, ничем не отличается от нового
+        for flow in [f for f, s in self._flows.items()
+                     if s.finish <= self._vtime]:
+            del self._flows[flow]
+
+    async def acquire(
+            self,
+            on_queued: Optional[QueuedCallback] = None,
+            flow: Hashable = None,
+            weight: float = 1.0) -> float:
+        """
+        Занять слот. Если слотов нет — встать в очередь потока flow и
+        вызвать on_queued(позиция, оценка ожидания). Возвращает время
+        ожидания.
+        """
+        if self._in_flight < self.limit and not self._depth:
+            self._vtime = max(self._vtime, self._tag(flow, weight))
+            self._in_flight += 1
+            self._admitted += 1
+            self._waits.append(0.0)
+            return 0.0
+        if self._depth >= self.max_queue:
+            self._shed += 1
+            raise Overloaded(self._depth)
+
+        t0 = time.monotonic()
+        start = self._tag(flow, weight)
+        waiter: "asyncio.Future[None]" = (
+            asyncio.get_running_loop().create_future())
+        # Место в очереди занято до первого await: гонки нет
+        self._seq += 1
+        heapq.heappush(self._heap, (start, self._seq, waiter))
+        self._depth += 1
+        self._queued += 1
+        try:
+            if on_queued is not None:
+                position = sum(
+                    1 for s, _, w in self._heap
+                    if s <= start and not w.done())
+                await on_queued(position, self.estimated_wait(position))
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже выдан, но забрать его некому
+                self._in_flight -= 1
+                self._wake()
+            else:
+                # Запись в куче удалит _wake
+                waiter.cancel()
+                self._depth -= 1
+            raise
+        wait = time.monotonic() - t0
+        self._admitted += 1
+        self._waits.append(wait)
+        return wait
+
+    def release(
+            self,
+            latency: float,
+            ok: bool = True,
+            flow: Hashable = None) -> None:
+        """Освободить слот и скорректировать лимит по итогам запроса"""
+        self._in_flight -= 1
+        self._service_time = (
+            latency if self._service_time is None
+            else 0.8 * self._service_time + 0.2 * latency)
+        state = self._flows.get(flow)
+        if state is not None:
+            state.cost = (
+                latency if state.cost is None
+                else 0.7 * state.cost + 0.3 * latency)
+
+        if not ok or latency > self.target_latency:
+            if not ok:
+                self._errors += 1
+            else:
+                self._slow += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.target_latency:
+                self._limit = max(
+                    float(self.min_limit), self._limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self._limit = min(
+                float(self.max_limit), self._limit + 1.0 / self._limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._heap and self._in_flight < self.limit:
+            start, _, waiter = heapq.heappop(self._heap)
+            if waiter.done():
+                continue
+            self._depth -= 1
+            self._vtime = max(self._vtime, start)
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(
+            self,
+            on_queued: Optional[QueuedCallback] = None,
+            flow: Hashable = None,
+            weight: float = 1.0) -> AsyncIterator[float]:
+        """async with admission.slot(): ... — исключение считается ошибкой"""
+        wait = await self.acquire(on_queued, flow, weight)
+        t0 = time.monotonic()
+        ok = False
+        try:
+            yield wait
+            ok = True
+        finally:
+            self.release(time.monotonic() - t0, ok, flow)
+
+    def _wait_percentile(self, q: float) -> float:
+        if not self._waits:
+            return 0.0
+        ordered = sorted(self._waits)
+        return round(
+            ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 3)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queue_depth": self._depth,
+            "max_queue": self.max_queue,
+            "flows": len(self._flows),
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "shed": self._shed,
+            "errors": self._errors,
+            "slow": self._slow,
+            "service_time": (
+                round(self._service_time, 3)
+                if self._service_time is not None else None),
+            "wait_p50": self._wait_percentile(50),
+            "wait_p95": self._wait_percentile(95),
+        }
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш готовых ответов на первые вопросы диалога.
+
+Ключ — эмбеддинг вопроса: попадание, если косинусная близость к
+сохранённому вопросу не ниже threshold. Записи живут ttl секунд и
+сбрасываются целиком при смене версии индекса RAG (ответ опирался на
+старые документы). Модель эмбеддингов (sentence-transformers) грузится
+в фоне; пока её нет или пакет не установлен, кэш просто пропускается.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAnswer:
+    __slots__ = ("question", "answer", "latency", "index_version",
+                 "created_at", "hits")
+
+    def __init__(self, question: str, answer: str, latency: float,
+                 index_version: Optional[str]) -> None:
+        self.question = question
+        self.answer = answer
+        # Сколько занял полный конвейер, когда ответ был получен
+        self.latency = latency
+        self.index_version = index_version
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class AnswerCache:
+    def __init__(
+            self,
+            model_name: str,
+            threshold: float = 0.92,
+            ttl: float = 6 * 3600,
+            max_entries: int = 1000,
+            enabled: bool = True) -> None:
+        self.model_name = model_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.index_version: Optional[str] = None
+
+        self._model = None
+        self._load_error: Optional[str] = None
+        # Нормированные эмбеддинги вопросов, строка i — запись _entries[i]
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[CachedAnswer]] = []
+        self._next_slot = 0
+
+        self._lookups = 0
+        self._hits = 0
+        self._stored = 0
+        self._invalidations = 0
+        self._saved = 0.0
+        self._embed_time = 0.0
+        self._embeds = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and self._model is not None
+
+    def _load(self) -> None:
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(self.model_name)
+
+    async def warmup(self) -> bool:
+        """Загрузка модели в отдельном потоке; ошибка отключает кэш"""
+        if not self.enabled or self._model is not None:
+            return self.ready
+        t0 = time.monotonic()
+        try:
+            await asyncio.to_thread(self._load)
+        except Exception as e:
+            self._load_error = str(e)
+            self.enabled = False
+            logger.warning("Answer cache disabled: %s", e)
+            return False
+        logger.info("Answer cache model %s loaded in %.2fs",
+                    self.model_name, time.monotonic() - t0)
+        return True
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        if not self.ready:
+            return None
+        t0 = time.monotonic()
+        vector = await asyncio.to_thread(
+            self._model.encode, text, normalize_embeddings=True)
+        self._embed_time += time.monotonic() - t0
+        self._embeds += 1
+        return np.asarray(vector, dtype=np.float32)
+
+    def _best(self, vector: np.ndarray) -> Optional[int]:
+        if self._vectors is None or not self._entries:
+            return None
+        count = len(self._entries)
+        scores = self._vectors[:count] @ vector
+        deadline = time.monotonic() - self.ttl
+        for i, entry in enumerate(self._entries):
+            if entry is None or entry.created_at < deadline:
+                scores[i] = -1.0
+        best = int(np.argmax(scores))
+        return best if scores[best] >= self.threshold else None
+
+    def lookup(self, vector: np.ndarray) -> Optional[CachedAnswer]:
+        self._lookups += 1
+        best = self._best(vector)
+        if best is None:
+            return None
+        entry = self._entries[best]
+        entry.hits += 1
+        self._hits += 1
+        return entry
+
+    def record_saved(self, entry: CachedAnswer, latency: float) -> None:
+        """Сэкономленное время: полный конвейер минус обслуживание попадания"""
+        self._saved += max(0.0, entry.latency - latency)
+
+    def store(self, vector: np.ndarray, question: str, answer: str,
+              latency: float) -> None:
+        if self._vectors is None:
+            self._vectors = np.zeros(
+                (self.max_entries, vector.shape[0]), dtype=np.float32)
+        # Почти такой же вопрос уже есть — обновляем его запись
+        slot = self._best(vector)
+        if slot is None:
+            slot = self._next_slot
+            self._next_slot = (self._next_slot + 1) % self.max_entries
+            if slot == len(self._entries):
+                self._entries.append(None)
+        self._vectors[slot] = vector
+        self._entries[slot] = CachedAnswer(
+            question, answer, latency, self.index_version)
+        self._stored += 1
+
+    def clear(self) -> None:
+        self._entries = []
+        self._next_slot = 0
+
+    def set_index_version(self, version: Optional[str]) -> None:
+        if version is None or version == self.index_version:
+            return
+        if self.index_version is not None and self._entries:
+            logger.info("RAG index %s -> %s: dropping %d cached answers",
+                        self.index_version, version, len(self))
+            self._invalidations += 1
+            self.clear()
+        self.index_version = version
+
+    def __len__(self) -> int:
+        deadline = time.monotonic() - self.ttl
+        return sum(1 for e in self._entries
+                   if e is not None and e.created_at >= deadline)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "model": self.model_name,
+            "load_error": self._load_error,
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+            "index_version": self.index_version,
+            "entries": len(self),
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "misses": self._lookups - self._hits,
+            "hit_rate": (
+                round(self._hits / self._lookups, 3) if self._lookups
+                else None),
+            "stored": self._stored,
+            "invalidations": self._invalidations,
+            "saved_seconds": round(self._saved, 3),
+            "embed_avg_ms": (
+                round(self._embed_time / self._embeds * 1000, 1)
+                if self._embeds else None),
+        }
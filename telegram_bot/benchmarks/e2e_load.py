@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+"""
+Сквозной нагрузочный прогон всех четырёх сервисов на заглушках.
+
+Поднимаются FakeTelegram, FakeIAM и FakeYandexGPT (benchmarks/fakes.py)
+с заданными моделями задержки и долей ошибок, затем llm_agent,
+validator, rag и telegram_bot отдельными процессами uvicorn с
+окружением, направленным на заглушки. N чатов ведут диалоги: первый
+вопрос, уточнения, иногда команды и вопрос, разбитый на два сообщения
+подряд; между ходами — время на чтение ответа.
+
+Итог — одна строка JSON (и --output файл) с сообщениями в секунду,
+p50/p95/p99 времени до ответа и числом вызовов апстримов на сообщение;
+--baseline сравнивает с сохранённым прошлым прогоном.
+
+    python benchmarks/e2e_load.py --chats 50 --messages 4 \\
+        --llm-latency lognormal:2,0.4 --llm-errors 0.02 --output run.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import (  # noqa: E402
+    FakeIAM, FakeTelegram, FakeYandexGPT, LatencyModel, free_port)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+TELEGRAM_TOKEN = "123456:FAKE-load-test"
+
+QUESTIONS = [
+    "Меня уволили без предупреждения, что делать?",
+    "Сосед затопил квартиру и отказывается платить за ремонт. "
+    "Как взыскать ущерб?",
+    "Какие документы нужны для расторжения брака через суд?",
+    "Как вернуть товар надлежащего качества в интернет-магазин?",
+    "Работодатель задерживает зарплату второй месяц. Куда жаловаться?",
+    "Можно ли не платить кредит, если банк продал долг коллекторам?",
+    "Как оформить наследство, если пропущен срок в шесть месяцев?",
+    "Арендодатель не возвращает залог после выезда из квартиры. "
+    "Договор был письменный, акт приёма-передачи подписан, "
+    "претензию я отправил месяц назад, ответа нет. "
+    "Какие у меня шансы в суде и сколько это займёт?",
+    "Что грозит за езду без ОСАГО?",
+    "Как оспорить штраф с камеры, если за рулём был другой человек?",
+]
+FOLLOW_UPS = [
+    "А если договора не было?",
+    "Сколько это стоит?",
+    "А сроки какие?",
+    "Можно подробнее про второй пункт?",
+    "А если он откажется?",
+    "Спасибо, а куда подавать заявление?",
+]
+COMMANDS = ["/start", "/rag_status", "/clear"]
+
+# Префиксы служебных ответов бота (после экранирования MarkdownV2)
+OUTCOMES = (
+    ("⏳", "queued_notice"),
+    ("Произошла", "error"),
+    ("⌛", "deadline"),
+    ("🚦", "shed"),
+    ("Дружище, я не могу", "blocked"),
+)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def outcome(text: str) -> str:
+    for prefix, name in OUTCOMES:
+        if text.startswith(prefix):
+            return name
+    return "ok"
+
+
+def private_key_pem() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode()
+
+
+class Services:
+    """Четыре сервиса отдельными процессами, направленные на заглушки"""
+
+    NAMES = ("llm_agent", "validator", "rag", "telegram_bot")
+
+    def __init__(self, telegram: FakeTelegram, iam: FakeIAM,
+                 gpt: FakeYandexGPT, rag: bool = True,
+                 extra_env: Optional[Dict[str, str]] = None,
+                 log_dir: Optional[str] = None) -> None:
+        self.telegram = telegram
+        self.iam = iam
+        self.gpt = gpt
+        self.rag = rag
+        self.extra_env = extra_env or {}
+        self.log_dir = log_dir or tempfile.mkdtemp(prefix="e2e-load-")
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.ports = {name: free_port() for name in self.NAMES}
+        self.procs: Dict[str, asyncio.subprocess.Process] = {}
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.ports[name]}"
+
+    @staticmethod
+    def service(name: str) -> str:
+        """Каталог сервиса: "telegram_bot-1" — реплика telegram_bot"""
+        return name.partition("-")[0]
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "TELEGRAM_TOKEN": TELEGRAM_TOKEN,
+            "TELEGRAM_BASE_URL": self.telegram.base_url,
+            "IAM_URL": self.iam.tokens_url,
+            "FOLDER_ID": "fake-folder",
+            "SERVICE_ACCOUNT_ID": "fake-sa",
+            "KEY_ID": "fake-key",
+            "PRIVATE_KEY": private_key_pem(),
+            "LLM_URL": self.gpt.completion_url,
+            "LLM_AGENT_URL": f"{self.url('llm_agent')}/api/llm_agent/",
+            "VALIDATOR_URL": f"{self.url('validator')}/api/val/",
+            "RAG_SERVICE_URL": self.url("rag"),
+            # Модель эмбеддингов кэша ответов в прогоне не скачиваем
+            "ANSWER_CACHE_ENABLED": "false",
+            "PYTHONUNBUFFERED": "1",
+        })
+        env.update(self.extra_env)
+        return env
+
+    async def start(self) -> None:
+        env = self.env()
+        for name in self.NAMES:
+            if self.service(name) == "rag" and not self.rag:
+                continue
+            await self.spawn(name, env)
+
+    async def spawn(self, name: str, env: Dict[str, str]) -> None:
+        log = open(os.path.join(self.log_dir, f"{name}.log"), "ab")
+        self.procs[name] = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(self.ports[name]),
+            "--log-level", "warning", "--no-access-log",
+            cwd=os.path.join(ROOT, self.service(name)), env=env,
+            stdout=log, stderr=asyncio.subprocess.STDOUT)
+
+    async def wait_ready(
+            self, timeout: float = 60.0,
+            names: Optional[List[str]] = None) -> Dict[str, float]:
+        """Время готовности каждого сервиса; бот — по его /ready"""
+        checks = {
+            "llm_agent": "/docs",
+            "validator": "/docs",
+            "rag": "/",
+            "telegram_bot": "/ready",
+        }
+        names = names or list(self.procs)
+        ready: Dict[str, float] = {}
+        t0 = time.monotonic()
+        async with httpx.AsyncClient(timeout=2) as client:
+            while len(ready) < len(names):
+                if time.monotonic() - t0 > timeout:
+                    missing = sorted(set(names) - set(ready))
+                    raise RuntimeError(
+                        f"Not ready in {timeout:.0f}s: {missing}, "
+                        f"logs in {self.log_dir}")
+                for name in names:
+                    proc = self.procs[name]
+                    if name in ready:
+                        continue
+                    if proc.returncode is not None:
+                        raise RuntimeError(
+                            f"{name} exited with {proc.returncode}, "
+                            f"see {self.log_dir}/{name}.log")
+                    try:
+                        resp = await client.get(
+                            self.url(name) + checks[self.service(name)])
+                        if resp.status_code == 200:
+                            ready[name] = round(time.monotonic() - t0, 2)
+                    except httpx.HTTPError:
+                        pass
+                await asyncio.sleep(0.2)
+        return ready
+
+    async def bot_metrics(self) -> Dict[str, Any]:
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                resp = await client.get(
+                    f"{self.url('telegram_bot')}/api/telegram_bot/metrics")
+                return resp.json()
+        except (httpx.HTTPError, ValueError):
+            return {}
+
+    async def stop(self, timeout: float = 40.0) -> None:
+        # Бот первым: он доотвечает принятым ходам, пока апстримы живы
+        for name in reversed(self.NAMES):
+            proc = self.procs.get(name)
+            if proc is None or proc.returncode is not None:
+                continue
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+
+
+class ChatStats:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Counter = Counter()
+        self.turns = 0
+        self.messages = 0
+
+    def summary(self) -> Dict[str, Any]:
+        everything = [x for v in self.latencies.values() for x in v]
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            "latency_ms": {
+                "p50": ms(percentile(everything, 50)),
+                "p95": ms(percentile(everything, 95)),
+                "p99": ms(percentile(everything, 99)),
+                "mean": ms(sum(everything) / len(everything)
+                           if everything else None),
+                "max": ms(max(everything) if everything else None),
+            },
+            "by_kind": {
+                kind: {
+                    "count": len(values),
+                    "p50_ms": ms(percentile(values, 50)),
+                    "p95_ms": ms(percentile(values, 95)),
+                }
+                for kind, values in sorted(self.latencies.items())
+            },
+            "outcomes": dict(self.outcomes),
+        }
+
+
+async def await_reply(telegram: FakeTelegram, chat_id: int, sent: float,
+                      timeout: float,
+                      stats: ChatStats) -> Optional[Tuple[str, float]]:
+    """Первый содержательный ответ чату; уведомления об очереди — мимо"""
+    queue = telegram.replies[chat_id]
+    deadline = sent + timeout
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return None
+        try:
+            replied_at, text = await asyncio.wait_for(queue.get(), left)
+        except asyncio.TimeoutError:
+            return None
+        kind = outcome(text)
+        if kind == "queued_notice":
+            stats.outcomes[kind] += 1
+            continue
+        return kind, replied_at - sent
+
+
+async def chat_client(chat_id: int, telegram: FakeTelegram,
+                      args, think: LatencyModel, stats: ChatStats) -> None:
+    rng = random.Random(args.seed * 100003 + chat_id)
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    for turn in range(args.messages):
+        if rng.random() < args.command_rate:
+            kind, parts = "command", [rng.choice(COMMANDS)]
+        elif turn == 0:
+            kind, parts = "first", [rng.choice(QUESTIONS)]
+        else:
+            kind, parts = "follow_up", [rng.choice(FOLLOW_UPS)]
+        if kind != "command" and rng.random() < args.burst_rate:
+            # Вопрос двумя сообщениями подряд — бот склеит их в один ход
+            words = parts[0].split()
+            cut = max(1, len(words) // 2)
+            parts = [" ".join(words[:cut]), " ".join(words[cut:]) or "?"]
+            kind += "_burst"
+
+        sent = time.monotonic()
+        for i, part in enumerate(parts):
+            if i:
+                await asyncio.sleep(rng.uniform(0.05, 0.3))
+            telegram.push_message(chat_id, chat_id, part)
+            stats.messages += 1
+        stats.turns += 1
+
+        reply = await await_reply(
+            telegram, chat_id, sent, args.reply_timeout, stats)
+        if reply is None:
+            stats.outcomes["timeout"] += 1
+        else:
+            result, latency = reply
+            stats.outcomes[result] += 1
+            stats.latencies[kind].append(latency)
+        await asyncio.sleep(think.sample())
+        # Лишние ответы (например, если склейка не удалась) — не в счёт
+        queue = telegram.replies[chat_id]
+        while not queue.empty():
+            queue.get_nowait()
+            stats.outcomes["extra_reply"] += 1
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict:
+    def pick(report: Dict[str, Any]) -> Dict[str, Optional[float]]:
+        return {
+            "msg_per_s": report.get("msg_per_s"),
+            "p50_ms": report.get("latency_ms", {}).get("p50"),
+            "p95_ms": report.get("latency_ms", {}).get("p95"),
+            "p99_ms": report.get("latency_ms", {}).get("p99"),
+            "error_rate": report.get("error_rate"),
+        }
+
+    now, before = pick(current), pick(baseline)
+    return {
+        key: {
+            "baseline": before[key],
+            "current": now[key],
+            "delta_pct": (
+                round((now[key] - before[key]) / before[key] * 100, 1)
+                if before[key] and now[key] is not None else None),
+        }
+        for key in now
+    }
+
+
+class Upstreams:
+    """Заглушки Telegram, IAM и YandexGPT по аргументам командной строки"""
+
+    def __init__(self, args, rng: random.Random) -> None:
+        self.telegram = FakeTelegram(LatencyModel(
+            args.telegram_latency, args.telegram_errors,
+            random.Random(rng.random())))
+        self.iam = FakeIAM(LatencyModel(
+            args.iam_latency, args.iam_errors, random.Random(rng.random())))
+        self.gpt = FakeYandexGPT(
+            LatencyModel(args.llm_latency, args.llm_errors,
+                         random.Random(rng.random())),
+            LatencyModel(args.moderation_latency, args.llm_errors,
+                         random.Random(rng.random())),
+            block_rate=args.block_rate)
+        self.all = (self.telegram, self.iam, self.gpt)
+
+    async def start(self) -> None:
+        for stand_in in self.all:
+            await stand_in.start()
+
+    async def stop(self) -> None:
+        for stand_in in self.all:
+            await stand_in.stop()
+
+    def reset(self) -> None:
+        # Стартовые вызовы (getMe, токен) не относятся к сообщениям
+        for stand_in in self.all:
+            stand_in.calls.clear()
+
+    def config(self) -> Dict[str, Any]:
+        return {
+            "telegram": self.telegram.latency.describe(),
+            "iam": self.iam.latency.describe(),
+            "llm": {
+                "generation": self.gpt.latency.describe(),
+                "moderation": self.gpt.moderation.describe(),
+                "block_rate": self.gpt.block_rate,
+            },
+        }
+
+    def report(self, turns: int) -> Dict[str, Any]:
+        upstream = {
+            "iam.tokens": self.iam.calls["tokens"],
+            "llm.moderation": self.gpt.calls["moderation"],
+            "llm.generation": self.gpt.calls["generation"],
+            **{f"telegram.{m}": n for m, n in self.telegram.calls.items()
+               if m != "getUpdates"},
+        }
+        return {
+            "upstream": upstream,
+            "upstream_per_message": {
+                k: round(v / turns, 3) for k, v in upstream.items()
+            } if turns else {},
+            "upstream_errors": {
+                "iam": dict(self.iam.errors),
+                "llm": dict(self.gpt.errors),
+                "telegram": dict(self.telegram.errors)},
+        }
+
+
+def outcome_report(stats: ChatStats, elapsed: float) -> Dict[str, Any]:
+    answered = sum(n for k, n in stats.outcomes.items()
+                   if k not in ("timeout", "extra_reply", "queued_notice"))
+    failed = sum(stats.outcomes[k] for k in
+                 ("error", "deadline", "shed", "timeout"))
+    return {
+        "turns": stats.turns,
+        "messages": stats.messages,
+        "answered": answered,
+        "elapsed_s": round(elapsed, 2),
+        "msg_per_s": round(answered / elapsed, 2) if elapsed else None,
+        **stats.summary(),
+        "error_rate": round(failed / stats.turns, 4) if stats.turns else None,
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    upstreams = Upstreams(args, rng)
+    think = LatencyModel(args.think, rng=random.Random(rng.random()))
+    await upstreams.start()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    services = Services(
+        upstreams.telegram, upstreams.iam, upstreams.gpt,
+        rag=not args.no_rag, extra_env=extra_env, log_dir=args.logs)
+    stats = ChatStats()
+    try:
+        await services.start()
+        ready = await services.wait_ready(args.start_timeout)
+        upstreams.reset()
+
+        t0 = time.monotonic()
+        await asyncio.gather(*(
+            chat_client(10_000 + c, upstreams.telegram, args, think, stats)
+            for c in range(args.chats)))
+        elapsed = time.monotonic() - t0
+        bot = await services.bot_metrics()
+    finally:
+        await services.stop()
+        await upstreams.stop()
+
+    return {
+        "scenario": "e2e",
+        "config": {
+            "chats": args.chats,
+            "turns_per_chat": args.messages,
+            "think": args.think,
+            "ramp": args.ramp,
+            "burst_rate": args.burst_rate,
+            "command_rate": args.command_rate,
+            "rag": not args.no_rag,
+            "env": extra_env,
+            **upstreams.config(),
+            "seed": args.seed,
+        },
+        "ready_s": ready,
+        **outcome_report(stats, elapsed),
+        **upstreams.report(stats.turns),
+        "bot": {k: bot.get(k) for k in ("admission", "chat_queues", "rag")},
+        "logs": services.log_dir,
+    }
+
+
+def add_upstream_args(parser: argparse.ArgumentParser) -> None:
+    """Аргументы заглушек, сервисов и вывода, общие с replay.py"""
+    parser.add_argument("--reply-timeout", type=float, default=90.0)
+    parser.add_argument("--telegram-latency", default="lognormal:0.03,0.3")
+    parser.add_argument("--telegram-errors", type=float, default=0.0)
+    parser.add_argument("--iam-latency", default="fixed:0.1")
+    parser.add_argument("--iam-errors", type=float, default=0.0)
+    parser.add_argument("--llm-latency", default="lognormal:2,0.4",
+                        help="генерация ответа")
+    parser.add_argument("--moderation-latency", default="lognormal:0.6,0.3")
+    parser.add_argument("--llm-errors", type=float, default=0.0)
+    parser.add_argument("--block-rate", type=float, default=0.0,
+                        help="доля запросов, которые модерация блокирует")
+    parser.add_argument("--no-rag", action="store_true",
+                        help="не запускать rag (бот работает без RAG)")
+    parser.add_argument("--env", action="append", default=[],
+                        metavar="KEY=VALUE",
+                        help="дополнительное окружение сервисов")
+    parser.add_argument("--start-timeout", type=float, default=90.0)
+    parser.add_argument("--logs", default=None,
+                        help="каталог для логов сервисов")
+    parser.add_argument("--output", default=None,
+                        help="сохранить результат в файл JSON")
+    parser.add_argument("--baseline", default=None,
+                        help="сравнить с результатом прошлого прогона")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def write_result(args, result: Dict[str, Any]) -> None:
+    print(json.dumps(result, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(json.dumps({"compare": compare(result, baseline)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=3,
+                        help="ходов на чат")
+    parser.add_argument("--think", default="lognormal:3,0.5",
+                        help="пауза между ответом и следующим вопросом")
+    parser.add_argument("--ramp", type=float, default=10.0,
+                        help="чаты стартуют равномерно за столько секунд")
+    parser.add_argument("--burst-rate", type=float, default=0.15)
+    parser.add_argument("--command-rate", type=float, default=0.05)
+    add_upstream_args(parser)
+    args = parser.parse_args()
+    write_result(args, asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
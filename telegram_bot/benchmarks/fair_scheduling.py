@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Симуляция: задержка лёгких пользователей, пока тяжёлый заваливает бота.
+
+Лимит допуска фиксирован (min_limit = max_limit), upstream — sleep.
+Лёгкие пользователи присылают короткие запросы с пуассоновскими
+интервалами; тяжёлый держит flood запросов в очереди, каждый в heavy_cost
+раз длиннее. Сценарии: без тяжёлого, с тяжёлым в FIFO (все запросы в
+одном потоке) и с тяжёлым в справедливой очереди (поток = пользователь).
+Печатаются перцентили полной задержки (ожидание + обслуживание) лёгких.
+
+    python benchmarks/fair_scheduling.py --light-users 20 --flood 40
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from admission import AdmissionController  # noqa: E402
+
+
+def percentile_ms(samples, q):
+    ordered = sorted(samples)
+    return round(
+        ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] * 1000, 1)
+
+
+async def request(admission, flow, cost, latencies=None):
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    async with admission.slot(flow=flow):
+        await asyncio.sleep(cost)
+    if latencies is not None:
+        latencies.append(loop.time() - t0)
+
+
+async def light_user(admission, user, args, rng, fifo, latencies):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration
+    tasks = []
+    while loop.time() < deadline:
+        await asyncio.sleep(rng.expovariate(1 / args.think))
+        flow = None if fifo else f"light{user}"
+        tasks.append(asyncio.create_task(
+            request(admission, flow, args.cost, latencies)))
+    await asyncio.gather(*tasks)
+
+
+async def heavy_user(admission, args, fifo, stop):
+    flow = None if fifo else "heavy"
+    in_flight = set()
+    while not stop.is_set():
+        # Тяжёлый держит в системе args.flood запросов одновременно
+        while len(in_flight) < args.flood:
+            task = asyncio.create_task(
+                request(admission, flow, args.cost * args.heavy_cost))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        await asyncio.sleep(args.cost / 10)
+    for task in list(in_flight):
+        task.cancel()
+    await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+async def scenario(args, heavy, fifo):
+    admission = AdmissionController(
+        initial_limit=args.limit, min_limit=args.limit,
+        max_limit=args.limit, max_queue=10 ** 6,
+        target_latency=3600)
+    rng = random.Random(args.seed)
+    latencies = []
+    stop = asyncio.Event()
+    heavy_task = (
+        asyncio.create_task(heavy_user(admission, args, fifo, stop))
+        if heavy else None)
+    await asyncio.gather(*[
+        light_user(admission, u, args, rng, fifo, latencies)
+        for u in range(args.light_users)
+    ])
+    if heavy_task:
+        stop.set()
+        await heavy_task
+    return {
+        "requests": len(latencies),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=4)
+    parser.add_argument("--light-users", type=int, default=20)
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="средний интервал между запросами, с")
+    parser.add_argument("--cost", type=float, default=0.05,
+                        help="время обслуживания лёгкого запроса, с")
+    parser.add_argument("--heavy-cost", type=float, default=5.0)
+    parser.add_argument("--flood", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for name, heavy, fifo in [
+            ("baseline", False, False),
+            ("flood_fifo", True, True),
+            ("flood_fair", True, False)]:
+        result = asyncio.run(scenario(args, heavy, fifo))
+        print(json.dumps({"scenario": name, **result}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
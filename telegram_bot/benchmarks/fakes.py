@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Локальные заглушки внешних апстримов для нагрузочных прогонов.
+
+FakeTelegram  — Bot API: getMe, getUpdates (long polling), sendMessage,
+                sendChatAction и служебные методы webhook;
+FakeIAM       — выдача IAM токена (JWT не проверяется);
+FakeYandexGPT — Completion API: модерация (maxTokens <= 50) отвечает
+                «НЕТ»/«ДА», генерация — текстом нужной длины.
+
+У каждой заглушки своя модель задержки и доля ошибок (LatencyModel),
+счётчики вызовов по методам и запуск через uvicorn в текущем loop.
+"""
+import asyncio
+import json
+import math
+import random
+import socket
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LatencyModel:
+    """
+    Задержка ответа: "0.2" или "fixed:0.2", "uniform:0.1,0.3",
+    "exp:0.5" (среднее), "lognormal:1.5,0.4" (медиана, sigma).
+    """
+
+    def __init__(self, spec: str, error_rate: float = 0.0,
+                 rng: Optional[random.Random] = None) -> None:
+        self.spec = spec
+        self.error_rate = error_rate
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        if not params:
+            kind, params = "fixed", kind
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")]
+        if kind not in ("fixed", "uniform", "exp", "lognormal"):
+            raise ValueError(f"Unknown latency model: {spec}")
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(p[0], p[1])
+        if self.kind == "exp":
+            return self.rng.expovariate(1 / p[0]) if p[0] > 0 else 0.0
+        return self.rng.lognormvariate(math.log(p[0]), p[1])
+
+    def fail(self) -> bool:
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    def describe(self) -> Dict[str, Any]:
+        return {"latency": self.spec, "error_rate": self.error_rate}
+
+
+class StandIn:
+    def __init__(self, latency: LatencyModel) -> None:
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.app = FastAPI()
+        self.port = 0
+        self._server: Optional[uvicorn.Server] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def delay(self, name: str) -> bool:
+        """Учёт вызова и задержка; False — ответить ошибкой"""
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency.sample())
+        if self.latency.fail():
+            self.errors[name] += 1
+            return False
+        return True
+
+    async def start(self, port: int = 0) -> None:
+        self.port = port or free_port()
+        config = uvicorn.Config(
+            self.app, host="127.0.0.1", port=self.port,
+            log_level="warning", access_log=False, lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                await self._task
+            await asyncio.sleep(0.01)
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.should_exit = True
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.latency.describe(),
+            "calls": dict(self.calls),
+            "errors": dict(self.errors),
+        }
+
+
+class FakeTelegram(StandIn):
+    """Bot API по адресу {url}/bot<token>/<method>"""
+
+    def __init__(self, latency: LatencyModel) -> None:
+        super().__init__(latency)
+        self._updates: List[Dict[str, Any]] = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_updates = asyncio.Event()
+        self.replies: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        # Вместо очереди replies: on_reply(chat_id, время, текст)
+        self.on_reply: Optional[Callable[[int, float, str], None]] = None
+        self.chat_actions: Counter = Counter()
+        self.app.add_api_route(
+            "/bot{token}/{method}", self.handle, methods=["GET", "POST"])
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/bot"
+
+    def make_update(self, chat_id: int, user_id: int,
+                    text: str) -> Dict[str, Any]:
+        """Обновление с сообщением пользователя (для webhook)"""
+        message = {
+            "message_id": self._next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False,
+                     "first_name": f"user{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(command)}]
+        self._next_message_id += 1
+        update = {"update_id": self._next_update_id, "message": message}
+        self._next_update_id += 1
+        return update
+
+    def push_message(self, chat_id: int, user_id: int, text: str) -> int:
+        """Входящее сообщение пользователя; ответ придёт в replies[chat_id]"""
+        update = self.make_update(chat_id, user_id, text)
+        self._updates.append(update)
+        self._new_updates.set()
+        return update["update_id"]
+
+    @staticmethod
+    async def _params(request: Request) -> Dict[str, Any]:
+        # PTB шлёт form-urlencoded, сложные значения — строками JSON
+        body = await request.body()
+        if not body:
+            return dict(request.query_params)
+        if request.headers.get("content-type", "").startswith(
+                "application/json"):
+            return json.loads(body)
+        params: Dict[str, Any] = {}
+        for key, value in parse_qsl(body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        wait = float(params.get("timeout") or 0)
+        # Подтверждённые апдейты (update_id < offset) больше не отдаются
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        deadline = time.monotonic() + wait
+        while not self._updates and time.monotonic() < deadline:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_updates.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+        return self._updates[:limit]
+
+    async def handle(self, token: str, method: str, request: Request):
+        params = await self._params(request)
+        if method == "getUpdates":
+            self.calls[method] += 1
+            return {"ok": True, "result": await self._get_updates(params)}
+        if not await self.delay(method):
+            return JSONResponse(
+                {"ok": False, "error_code": 502,
+                 "description": "Bad Gateway"}, status_code=502)
+        if method == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "Saul",
+                           "username": "fake_saul_bot"}
+        elif method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            result = {
+                "message_id": self._next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Saul"},
+                "text": params.get("text", ""),
+            }
+            self._next_message_id += 1
+            reply = (time.monotonic(), params.get("text", ""))
+            if self.on_reply is not None:
+                self.on_reply(chat_id, *reply)
+            else:
+                self.replies[chat_id].put_nowait(reply)
+        elif method == "sendChatAction":
+            self.chat_actions[params.get("action")] += 1
+            result = True
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False,
+                      "pending_update_count": len(self._updates)}
+        else:
+            # deleteWebhook, setWebhook, close и прочие служебные
+            result = True
+        return {"ok": True, "result": result}
+
+
+class FakeIAM(StandIn):
+    """POST /iam/v1/tokens"""
+
+    def __init__(self, latency: LatencyModel,
+                 lifetime: float = 12 * 3600) -> None:
+        super().__init__(latency)
+        self.lifetime = lifetime
+        self.app.add_api_route(
+            "/iam/v1/tokens", self.handle, methods=["POST"])
+
+    @property
+    def tokens_url(self) -> str:
+        return f"{self.url}/iam/v1/tokens"
+
+    async def handle(self, request: Request):
+        if not await self.delay("tokens"):
+            return JSONResponse({"message": "internal"}, status_code=500)
+        expires = datetime.now(timezone.utc) + timedelta(
+            seconds=self.lifetime)
+        return {
+            "iamToken": f"t1.fake-{self.calls['tokens']}",
+            "expiresAt": expires.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        }
+
+
+ANSWER_WORDS = (
+    "согласно", "статье", "гражданского", "кодекса", "вы", "вправе",
+    "обратиться", "в", "суд", "с", "требованием", "о", "возмещении",
+    "ущерба", "при", "этом", "срок", "исковой", "давности", "составляет",
+    "три", "года", "рекомендую", "сохранить", "все", "документы",
+)
+
+
+class FakeYandexGPT(StandIn):
+    """POST /foundationModels/v1/completion"""
+
+    def __init__(
+            self,
+            latency: LatencyModel,
+            moderation: LatencyModel,
+            block_rate: float = 0.0,
+            answer_tokens: Tuple[int, int] = (150, 600)) -> None:
+        super().__init__(latency)
+        self.moderation = moderation
+        self.block_rate = block_rate
+        self.answer_tokens = answer_tokens
+        self.app.add_api_route(
+            "/foundationModels/v1/completion", self.handle, methods=["POST"])
+
+    @property
+    def completion_url(self) -> str:
+        return f"{self.url}/foundationModels/v1/completion"
+
+    def _answer(self, max_tokens: int) -> Tuple[str, int]:
+        rng = self.latency.rng
+        tokens = min(max_tokens, rng.randint(*self.answer_tokens))
+        # ~3 токена на русское слово
+        words = [rng.choice(ANSWER_WORDS) for _ in range(max(1, tokens // 3))]
+        return " ".join(words).capitalize() + ".", tokens
+
+    async def handle(self, request: Request):
+        payload = await request.json()
+        options = payload.get("completionOptions", {})
+        max_tokens = int(options.get("maxTokens", 2000))
+        moderation = max_tokens <= 50
+        name = "moderation" if moderation else "generation"
+        model = self.moderation if moderation else self.latency
+        self.calls[name] += 1
+        await asyncio.sleep(model.sample())
+        if model.fail():
+            self.errors[name] += 1
+            return JSONResponse(
+                {"error": {"message": "Internal error"}}, status_code=500)
+        if moderation:
+            blocked = self.latency.rng.random() < self.block_rate
+            text, tokens = ("ДА" if blocked else "НЕТ"), 1
+        else:
+            text, tokens = self._answer(max_tokens)
+        input_tokens = sum(
+            len(m.get("text", "")) // 4 for m in payload.get("messages", []))
+        return {
+            "result": {
+                "alternatives": [{
+                    "message": {"role": "assistant", "text": text},
+                    "status": "ALTERNATIVE_STATUS_FINAL",
+                }],
+                "usage": {
+                    "inputTextTokens": str(input_tokens),
+                    "completionTokens": str(tokens),
+                    "totalTokens": str(input_tokens + tokens),
+                },
+                "modelVersion": "fake",
+            }
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **super().metrics(),
+            "moderation": self.moderation.describe(),
+            "block_rate": self.block_rate,
+        }
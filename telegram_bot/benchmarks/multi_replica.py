@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный прогон нескольких реплик бота — отдельных процессов.
+
+Поднимаются заглушки Telegram, IAM и YandexGPT (как в e2e_load.py) и
+локальный Redis-сервер (RESP поверх TCP), затем llm_agent, validator,
+rag и N процессов telegram_bot с общими BOT_REPLICAS и
+STATE_BACKEND_URL. Обновления уходят POST-ом на webhook случайной
+реплики — как от балансировщика перед репликами; чужой чат реплика
+пересылает владельцу. Недоступная реплика или 503 — повтор через
+паузу, как это делает Telegram. Ответы бот шлёт в FakeTelegram.
+
+Сценарии: одна реплика, N реплик и N реплик с рестартом реплики 0
+посреди прогона. Для каждого — строка JSON: пропускная способность,
+время до ответа, порядок сообщений в истории чатов (читается из
+заглушки Redis) и сколько чатов реплики подтянули из общего хранилища.
+
+    python benchmarks/multi_replica.py --replicas 3 --chats 30 --no-rag \\
+        --llm-latency lognormal:0.5,0.3
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from e2e_load import (  # noqa: E402
+    FOLLOW_UPS, QUESTIONS, ChatStats, Services, Upstreams,
+    add_upstream_args, await_reply, outcome_report)
+from fakes import LatencyModel  # noqa: E402
+from state_backend import read_reply  # noqa: E402
+
+WEBHOOK_SECRET = "multi-replica-secret"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+SEQ = re.compile(r"#(\d+)")
+
+
+class RespStandIn:
+    """Минимальный Redis-сервер: PING, GET, SET [PX|EX], DEL, SELECT, AUTH"""
+
+    def __init__(self) -> None:
+        self.data = {}
+        self.commands = 0
+        self.port = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def start(self, host="127.0.0.1", port=0) -> None:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _reply(self, value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode()
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _execute(self, args):
+        cmd = args[0].upper()
+        now = time.monotonic()
+        if cmd in (b"PING", b"SELECT", b"AUTH"):
+            return "PONG" if cmd == b"PING" else "OK"
+        if cmd == b"GET":
+            item = self.data.get(args[1])
+            if item is None or (item[1] and item[1] <= now):
+                self.data.pop(args[1], None)
+                return None
+            return item[0]
+        if cmd == b"SET":
+            ttl = None
+            if len(args) >= 5:
+                scale = 1000 if args[3].upper() == b"PX" else 1
+                ttl = now + int(args[4]) / scale
+            self.data[args[1]] = (args[2], ttl)
+            return "OK"
+        if cmd == b"DEL":
+            return int(self.data.pop(args[1], None) is not None)
+        raise ValueError(cmd)
+
+    async def _serve(self, reader, writer) -> None:
+        try:
+            while True:
+                args = await read_reply(reader)
+                self.commands += 1
+                writer.write(self._reply(self._execute(args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def history(self, chat_id: int) -> List[List[str]]:
+        item = self.data.get(f"history:{chat_id}".encode())
+        return json.loads(item[0])["messages"] if item else []
+
+
+class ReplicaServices(Services):
+    """llm_agent, validator, rag и N реплик telegram_bot"""
+
+    def __init__(self, upstreams: Upstreams, replicas: int,
+                 state_url: str, **kwargs) -> None:
+        self.NAMES = ("llm_agent", "validator", "rag") + tuple(
+            f"telegram_bot-{i}" for i in range(replicas))
+        super().__init__(
+            upstreams.telegram, upstreams.iam, upstreams.gpt, **kwargs)
+        self.replicas = [n for n in self.NAMES
+                         if self.service(n) == "telegram_bot"]
+        self.state_url = state_url
+        self._env: Optional[Dict[str, str]] = None
+
+    def env(self) -> Dict[str, str]:
+        # Один ключ сервисного аккаунта на все процессы и рестарты
+        if self._env is None:
+            env = super().env()
+            env.update({
+                "BOT_REPLICAS": ",".join(self.url(n) for n in self.replicas),
+                "STATE_BACKEND_URL": self.state_url,
+                "TELEGRAM_WEBHOOK_SECRET": WEBHOOK_SECRET,
+                # Вся история прогона помещается: проверяется порядок
+                "HISTORY_MAX_MESSAGES": "1000",
+            })
+            env.update(self.extra_env)
+            self._env = env
+        return self._env
+
+    async def spawn(self, name: str, env: Dict[str, str]) -> None:
+        if name in self.replicas:
+            env = {**env, "BOT_REPLICA_INDEX": str(self.replicas.index(name))}
+        await super().spawn(name, env)
+
+    async def restart(self, name: str, timeout: float) -> float:
+        """Штатная остановка (drain) и запуск; время недоступности"""
+        t0 = time.monotonic()
+        proc = self.procs[name]
+        proc.terminate()
+        await proc.wait()
+        await self.spawn(name, self.env())
+        await self.wait_ready(timeout, [name])
+        return round(time.monotonic() - t0, 2)
+
+    async def replica_metrics(self) -> List[Dict[str, Any]]:
+        rows = []
+        async with httpx.AsyncClient(timeout=5) as client:
+            for name in self.replicas:
+                base = f"{self.url(name)}/api/telegram_bot"
+                try:
+                    bot = (await client.get(f"{base}/metrics")).json()
+                    webhook = (
+                        await client.get(f"{base}/webhook-metrics")).json()
+                    rows.append({**bot, "webhook": webhook})
+                except (httpx.HTTPError, ValueError):
+                    rows.append({})
+        return rows
+
+
+class Webhook:
+    """Доставка обновлений на реплики, как от Telegram через балансировщик"""
+
+    def __init__(self, services: ReplicaServices, rng: random.Random,
+                 timeout: float) -> None:
+        self.services = services
+        self.rng = rng
+        self.timeout = timeout
+        self.client = httpx.AsyncClient(timeout=10)
+        self.attempts = 0
+        self.retries = 0
+
+    async def deliver(self, update: Dict[str, Any]) -> bool:
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            self.attempts += 1
+            name = self.rng.choice(self.services.replicas)
+            try:
+                resp = await self.client.post(
+                    f"{self.services.url(name)}/api/telegram_bot/webhook",
+                    json=update, headers={SECRET_HEADER: WEBHOOK_SECRET})
+                if resp.status_code == 200:
+                    return True
+            except httpx.HTTPError:
+                pass
+            self.retries += 1
+            await asyncio.sleep(0.2)
+        return False
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+async def chat_client(chat_id: int, webhook: Webhook, args,
+                      think: LatencyModel, stats: ChatStats,
+                      sent: List[int]) -> None:
+    """Диалог чата; у каждого сообщения номер #seq для проверки порядка"""
+    telegram = webhook.services.telegram
+    rng = random.Random(args.seed * 100003 + chat_id)
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    for turn in range(args.messages):
+        kind = "first" if turn == 0 else "follow_up"
+        text = rng.choice(QUESTIONS if turn == 0 else FOLLOW_UPS)
+        parts = [text]
+        if rng.random() < args.burst_rate:
+            # Вопрос двумя сообщениями подряд — могут прийти на разные
+            # реплики, владелец чата склеит их в один ход
+            words = text.split()
+            cut = max(1, len(words) // 2)
+            parts = [" ".join(words[:cut]), " ".join(words[cut:]) or "?"]
+            kind += "_burst"
+
+        start = time.monotonic()
+        for part in parts:
+            seq = len(sent)
+            update = telegram.make_update(chat_id, chat_id, f"{part} #{seq}")
+            if await webhook.deliver(update):
+                sent.append(seq)
+                stats.messages += 1
+            else:
+                stats.outcomes["undelivered"] += 1
+        stats.turns += 1
+
+        reply = await await_reply(
+            telegram, chat_id, start, args.reply_timeout, stats)
+        if reply is None:
+            stats.outcomes["timeout"] += 1
+        else:
+            result, latency = reply
+            stats.outcomes[result] += 1
+            stats.latencies[kind].append(latency)
+        await asyncio.sleep(think.sample())
+        queue = telegram.replies[chat_id]
+        while not queue.empty():
+            queue.get_nowait()
+            stats.outcomes["extra_reply"] += 1
+
+
+def history_report(kv: RespStandIn,
+                   sent: Dict[int, List[int]]) -> Dict[str, Any]:
+    """Порядок и полнота сообщений в истории из общего хранилища"""
+    violations = missing = 0
+    for chat_id, seqs in sent.items():
+        seen = [int(n) for role, text in kv.history(chat_id)
+                if role == "user" for n in SEQ.findall(text)]
+        violations += sum(1 for a, b in zip(seen, seen[1:]) if b < a)
+        missing += len(set(seqs) - set(seen))
+    return {"order_violations": violations, "missing_in_history": missing}
+
+
+async def run(args, replicas: int,
+              restart_at: Optional[float] = None) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    upstreams = Upstreams(args, rng)
+    think = LatencyModel(args.think, rng=random.Random(rng.random()))
+    kv = RespStandIn()
+    await upstreams.start()
+    await kv.start()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    services = ReplicaServices(
+        upstreams, replicas, kv.url, rag=not args.no_rag,
+        extra_env=extra_env, log_dir=args.logs)
+    webhook = Webhook(services, random.Random(rng.random()),
+                      args.reply_timeout)
+    stats = ChatStats()
+    chats = [10_000 + c for c in range(args.chats)]
+    sent: Dict[int, List[int]] = {chat: [] for chat in chats}
+    downtime = None
+
+    async def restarter() -> None:
+        nonlocal downtime
+        await asyncio.sleep(restart_at)
+        downtime = await services.restart(
+            services.replicas[0], args.start_timeout)
+
+    try:
+        await services.start()
+        ready = await services.wait_ready(args.start_timeout)
+        upstreams.reset()
+
+        t0 = time.monotonic()
+        tasks = [chat_client(chat, webhook, args, think, stats, sent[chat])
+                 for chat in chats]
+        if restart_at is not None:
+            tasks.append(restarter())
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - t0
+        metrics = await services.replica_metrics()
+    finally:
+        await webhook.aclose()
+        await services.stop()
+        await upstreams.stop()
+
+    history = history_report(kv, sent)
+    await kv.stop()
+    report = outcome_report(stats, elapsed)
+    return {
+        "replicas": replicas,
+        "ready_s": max(ready.values()),
+        **{k: report[k] for k in (
+            "turns", "messages", "answered", "elapsed_s", "msg_per_s",
+            "latency_ms", "outcomes", "error_rate")},
+        **history,
+        "restart_downtime_s": downtime,
+        "webhook_attempts": webhook.attempts,
+        "webhook_retries": webhook.retries,
+        "forwarded": sum(m.get("webhook", {}).get("forwarded", 0)
+                         for m in metrics),
+        "restored_chats": sum(m.get("state", {}).get("loads", 0)
+                              for m in metrics),
+        "kv_commands": kv.commands,
+        **upstreams.report(stats.turns),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=4,
+                        help="ходов на чат")
+    parser.add_argument("--think", default="lognormal:1,0.5",
+                        help="пауза между ответом и следующим вопросом")
+    parser.add_argument("--ramp", type=float, default=5.0)
+    parser.add_argument("--burst-rate", type=float, default=0.2)
+    parser.add_argument("--restart-at", type=float, default=None,
+                        help="секунда рестарта реплики 0 (по умолчанию — "
+                             "середина прогона)")
+    add_upstream_args(parser)
+    args = parser.parse_args()
+
+    restart_at = args.restart_at or args.ramp + args.messages * 1.5
+    for scenario, replicas, restart in (
+            ("single", 1, None),
+            ("multi", args.replicas, None),
+            ("multi_restart", args.replicas, restart_at)):
+        result = asyncio.run(run(args, replicas, restart))
+        print(json.dumps({"scenario": scenario, **result},
+                         ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
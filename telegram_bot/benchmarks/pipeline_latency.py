@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Время до ответа: последовательные этапы против графа этапов.
+
+Апстримы — заглушки с задержками (с джиттером): IAM токен из кэша,
+валидатор, LLM-модерация, RAG, генерация. Сравниваются три режима:
+последовательный (как было), граф с параллельными проверками и RAG,
+граф со спекулятивной генерацией. Для заблокированных сообщений
+печатается время до отказа и число отменённых генераций.
+
+    python benchmarks/pipeline_latency.py --runs 50
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline import Blocked, Pipeline, Stage  # noqa: E402
+
+
+def stub(latency, rng, value=None, log=None, name=None):
+    async def fn(results):
+        try:
+            await asyncio.sleep(latency * rng.uniform(0.8, 1.2))
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(name)
+            raise
+        return value
+    return fn
+
+
+def stages(args, rng, blocked, speculative, cancelled):
+    generate_deps = ["rag"]
+    if not speculative:
+        generate_deps += ["validate", "injection"]
+    return [
+        Stage("iam_token", stub(0.0, rng, "token")),
+        Stage("validate", stub(args.validator, rng, False),
+              deps=["iam_token"], gate=True),
+        Stage("injection", stub(args.injection, rng, blocked), gate=True),
+        Stage("rag", stub(args.rag, rng, "context"), optional=True),
+        Stage("generate",
+              stub(args.generation, rng, "answer", cancelled, "generate"),
+              deps=generate_deps),
+    ]
+
+
+async def sequential(args, rng, blocked):
+    # Порядок из прежнего handle_message
+    for latency in (args.validator, args.injection):
+        await asyncio.sleep(latency * rng.uniform(0.8, 1.2))
+    if blocked:
+        return
+    for latency in (args.rag, args.generation):
+        await asyncio.sleep(latency * rng.uniform(0.8, 1.2))
+
+
+async def measure(args, mode, blocked):
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+    samples, cancelled = [], []
+    for _ in range(args.runs):
+        t0 = loop.time()
+        if mode == "sequential":
+            await sequential(args, rng, blocked)
+        else:
+            try:
+                await Pipeline(stages(
+                    args, rng, blocked, mode == "speculative",
+                    cancelled)).run()
+            except Blocked:
+                pass
+        samples.append(loop.time() - t0)
+    ordered = sorted(samples)
+    return {
+        "mode": mode,
+        "blocked": blocked,
+        "mean_ms": round(statistics.mean(samples) * 1000, 1),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95)] * 1000, 1),
+        "cancelled_generations": len(cancelled),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--validator", type=float, default=0.4)
+    parser.add_argument("--injection", type=float, default=0.8)
+    parser.add_argument("--rag", type=float, default=0.5)
+    parser.add_argument("--generation", type=float, default=2.0)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for blocked in (False, True):
+        for mode in ("sequential", "dag", "speculative"):
+            result = asyncio.run(measure(args, mode, blocked))
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
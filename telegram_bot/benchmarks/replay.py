@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Воспроизведение записанного трафика (traffic_capture.py) на заглушках.
+
+Сервисы и заглушки поднимаются так же, как в e2e_load.py. События
+трассы отправляются в FakeTelegram с исходными интервалами, делёнными
+на --speed (1 — реальное время, 10 — в десять раз быстрее, max — всё
+сразу, порядок внутри чата сохраняется). Хеши чатов превращаются в
+синтетические chat_id; текст берётся из трассы (вычищенный), а если
+он не записан — генерируется той же длины.
+
+Ответ сопоставляется с самым старым неотвеченным сообщением чата;
+сообщения, пришедшие в пределах --coalesce-window от него, считаются
+склеенными в тот же ход. Ответы на команды узнаются по тексту.
+
+    python benchmarks/replay.py traffic.ndjson.gz --speed 5 \\
+        --output replay.json --baseline replay-main.json
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from e2e_load import (  # noqa: E402
+    QUESTIONS, ChatStats, Services, Upstreams, add_upstream_args,
+    outcome, outcome_report, percentile, write_result)
+
+# Начало ответов бота на команды (после экранирования MarkdownV2)
+COMMAND_REPLIES = ("Привет", "Статус RAG", "🧹", "Дружище, а")
+FILLER = " ".join(QUESTIONS).split()
+
+
+def load_trace(path: str, limit: int = 0) -> List[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    events = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if "t" in event and "c" in event:
+                events.append(event)
+    events.sort(key=lambda e: e["t"])
+    return events[:limit] if limit else events
+
+
+def event_text(event: Dict[str, Any], rng: random.Random) -> str:
+    if event.get("x"):
+        return event["x"]
+    words: List[str] = []
+    while len(" ".join(words)) < event.get("n", 20):
+        words.append(rng.choice(FILLER))
+    return " ".join(words)[:max(1, event.get("n", 20))]
+
+
+class ReplyMatcher:
+    """Сопоставление ответов бота отправленным сообщениям"""
+
+    def __init__(self, stats: ChatStats, coalesce_window: float) -> None:
+        self.stats = stats
+        self.coalesce_window = coalesce_window
+        self.messages: Dict[int, Deque[float]] = defaultdict(deque)
+        self.commands: Dict[int, Deque[float]] = defaultdict(deque)
+        self.last_reply = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        return (sum(len(q) for q in self.messages.values())
+                + sum(len(q) for q in self.commands.values()))
+
+    def sent(self, chat_id: int, command: bool, at: float) -> None:
+        (self.commands if command else self.messages)[chat_id].append(at)
+
+    def __call__(self, chat_id: int, at: float, text: str) -> None:
+        self.last_reply = at
+        kind = outcome(text)
+        if kind == "queued_notice":
+            self.stats.outcomes[kind] += 1
+            return
+        command = text.startswith(COMMAND_REPLIES)
+        queue = (self.commands if command else self.messages)[chat_id]
+        if not queue:
+            self.stats.outcomes["extra_reply"] += 1
+            return
+        first = queue.popleft()
+        # Сообщения, склеенные ботом в тот же ход
+        while queue and queue[0] <= first + self.coalesce_window:
+            queue.popleft()
+        self.stats.turns += 1
+        self.stats.outcomes[kind] += 1
+        self.stats.latencies["command" if command else "message"].append(
+            at - first)
+
+
+async def replay(events: List[Dict[str, Any]], upstreams: Upstreams,
+                 matcher: ReplyMatcher, speed: float,
+                 rng: random.Random) -> List[float]:
+    """Отправка событий по расписанию; возвращает опоздания отправки"""
+    chat_ids: Dict[str, int] = {}
+    user_ids: Dict[str, int] = {}
+    lags: List[float] = []
+    start, origin = time.monotonic(), events[0]["t"]
+    for event in events:
+        chat_id = chat_ids.setdefault(event["c"], 20_000 + len(chat_ids))
+        user_id = user_ids.setdefault(
+            event.get("u", event["c"]), 50_000 + len(user_ids))
+        if speed > 0:
+            due = start + (event["t"] - origin) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, time.monotonic() - due))
+        text = event_text(event, rng)
+        command = event.get("k") == "c"
+        matcher.sent(chat_id, command, time.monotonic())
+        upstreams.telegram.push_message(chat_id, user_id, text)
+        matcher.stats.messages += 1
+    return lags
+
+
+async def run(args) -> Dict[str, Any]:
+    events = load_trace(args.trace, args.limit)
+    if not events:
+        raise SystemExit(f"{args.trace}: no events")
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+    rng = random.Random(args.seed)
+    upstreams = Upstreams(args, rng)
+    await upstreams.start()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    services = Services(
+        upstreams.telegram, upstreams.iam, upstreams.gpt,
+        rag=not args.no_rag, extra_env=extra_env, log_dir=args.logs)
+    stats = ChatStats()
+    matcher = ReplyMatcher(stats, args.coalesce_window)
+    upstreams.telegram.on_reply = matcher
+    try:
+        await services.start()
+        ready = await services.wait_ready(args.start_timeout)
+        upstreams.reset()
+
+        t0 = time.monotonic()
+        lags = await replay(events, upstreams, matcher, speed, rng)
+        # Ждём ответы, пока они приходят; тишина дольше таймаута — конец
+        while matcher.pending and (
+                time.monotonic() - matcher.last_reply < args.reply_timeout):
+            await asyncio.sleep(0.1)
+        elapsed = time.monotonic() - t0
+        bot = await services.bot_metrics()
+    finally:
+        await services.stop()
+        await upstreams.stop()
+    stats.outcomes["timeout"] += matcher.pending
+
+    span = events[-1]["t"] - events[0]["t"]
+    return {
+        "scenario": "replay",
+        "config": {
+            "trace": os.path.basename(args.trace),
+            "events": len(events),
+            "chats": len({e["c"] for e in events}),
+            "commands": sum(1 for e in events if e.get("k") == "c"),
+            "with_text": sum(1 for e in events if e.get("x")),
+            "trace_span_s": round(span, 1),
+            "speed": args.speed,
+            "coalesce_window": args.coalesce_window,
+            "rag": not args.no_rag,
+            "env": extra_env,
+            **upstreams.config(),
+            "seed": args.seed,
+        },
+        "ready_s": ready,
+        **outcome_report(stats, elapsed),
+        "send_lag_ms": {
+            "p99": round((percentile(lags, 99) or 0) * 1000, 1),
+            "max": round(max(lags, default=0) * 1000, 1),
+        },
+        **upstreams.report(stats.turns),
+        "bot": {k: bot.get(k) for k in ("admission", "chat_queues", "rag")},
+        "logs": services.log_dir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="файл TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--speed", default="1",
+                        help="множитель скорости или max")
+    parser.add_argument("--limit", type=int, default=0,
+                        help="только первые N событий")
+    parser.add_argument("--coalesce-window", type=float, default=0.5,
+                        help="как CHAT_COALESCE_WINDOW бота")
+    add_upstream_args(parser)
+    args = parser.parse_args()
+    write_result(args, asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
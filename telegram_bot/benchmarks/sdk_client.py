@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Пропускная способность клиента YandexGPTBot против локального сервиса.
+
+Заглушка HTTP API бота (POST /api/telegram_bot/, GET /status) работает
+в отдельном потоке со своим loop и заданной задержкой. Сравниваются:
+прежний клиент (requests.Session внутри async — вызовы по одному,
+loop стоит) и YandexGPTBot.process_many с разным параллелизмом.
+Печатаются вызовы в секунду, число TCP соединений, которые увидел
+сервер, и доля успешных запросов статуса при ошибках 503 с повторами.
+
+    python benchmarks/sdk_client.py --messages 500 --concurrency 1,8,32
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+import requests
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fakes import LatencyModel, StandIn  # noqa: E402
+from yandex_gpt_bot import YandexGPTBot  # noqa: E402
+
+
+class FakeBotService(StandIn):
+    """HTTP API telegram_bot: ответ эхом после задержки"""
+
+    def __init__(self, latency: LatencyModel,
+                 status_errors: float = 0.0) -> None:
+        super().__init__(latency)
+        self.status_errors = status_errors
+        self.connections = set()
+        self.app.add_api_route(
+            "/api/telegram_bot/", self.message, methods=["POST"])
+        self.app.add_api_route(
+            "/api/telegram_bot/status", self.status, methods=["GET"])
+
+    @property
+    def service_url(self) -> str:
+        return f"{self.url}/api/telegram_bot"
+
+    async def message(self, request: Request):
+        self.connections.add(request.client)
+        payload = await request.json()
+        await self.delay("message")
+        return {"chat_id": payload["chat_id"],
+                "response_text": payload["message_text"][::-1]}
+
+    async def status(self, request: Request):
+        self.connections.add(request.client)
+        self.calls["status"] += 1
+        if self.latency.rng.random() < self.status_errors:
+            self.errors["status"] += 1
+            return JSONResponse({"detail": "busy"}, status_code=503)
+        return {"status": "running", "message": "ok"}
+
+
+class ServerThread:
+    """Заглушка в своём потоке: клиент может блокировать свой loop"""
+
+    def __init__(self, service: StandIn) -> None:
+        self.service = service
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(
+            self.service.start(), self.loop).result(10)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(
+            self.service.stop(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+
+
+def messages(n):
+    return [{"chat_id": 1000 + i % 50, "user_id": i,
+             "message_text": f"вопрос номер {i}"} for i in range(n)]
+
+
+async def blocking_session(url, items):
+    """Как прежний клиент: async def, но внутри requests.Session"""
+    session = requests.Session()
+
+    async def process(m):
+        response = session.post(url + "/", json=m, timeout=30)
+        return response.json()
+
+    try:
+        return await asyncio.gather(*(process(m) for m in items))
+    finally:
+        session.close()
+
+
+async def measure(service, name, concurrency, run):
+    service.connections.clear()
+    t0 = time.perf_counter()
+    results = await run()
+    elapsed = time.perf_counter() - t0
+    ok = sum(1 for r in results if "ошибка" not in r["response_text"]
+             and "недоступен" not in r["response_text"])
+    return {
+        "mode": name,
+        "concurrency": concurrency,
+        "messages": len(results),
+        "ok": ok,
+        "elapsed_s": round(elapsed, 3),
+        "calls_per_s": round(len(results) / elapsed, 1),
+        "connections": len(service.connections),
+    }
+
+
+async def status_retries(service, args):
+    service.connections.clear()
+    service.status_errors = args.status_errors
+    async with YandexGPTBot(service.service_url,
+                            retries=args.retries,
+                            backoff_base=0.01) as bot:
+        statuses = await asyncio.gather(
+            *(bot.get_bot_status() for _ in range(args.status_calls)))
+        metrics = bot.metrics()
+    service.status_errors = 0.0
+    return {
+        "mode": "status_retries",
+        "error_rate": args.status_errors,
+        "retries": args.retries,
+        "calls": args.status_calls,
+        "ok": sum(1 for s in statuses if s["status"] == "running"),
+        "requests_sent": metrics["calls"],
+        "retried": metrics["retried"],
+    }
+
+
+async def run(args, service):
+    items = messages(args.messages)
+    rows = [await measure(
+        service, "blocking_session", 1,
+        lambda: blocking_session(service.service_url, items))]
+    for concurrency in args.concurrency:
+        async with YandexGPTBot(service.service_url,
+                                max_concurrency=concurrency) as bot:
+            rows.append(await measure(
+                service, "process_many", concurrency,
+                lambda: bot.process_many(items)))
+    rows.append(await status_retries(service, args))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--concurrency", default="1,8,32",
+                        type=lambda s: [int(c) for c in s.split(",")])
+    parser.add_argument("--latency", default="uniform:0.02,0.05",
+                        help="модель задержки сервиса (см. fakes.py)")
+    parser.add_argument("--status-calls", type=int, default=200)
+    parser.add_argument("--status-errors", type=float, default=0.3)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    service = FakeBotService(
+        LatencyModel(args.latency, rng=random.Random(args.seed)))
+    server = ServerThread(service)
+    server.start()
+    try:
+        for row in asyncio.run(run(args, service)):
+            print(json.dumps(row, ensure_ascii=False))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
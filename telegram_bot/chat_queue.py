@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Последовательные очереди сообщений по чатам.
+
+У каждого чата не больше одного обработчика: ход чата идёт строго по
+порядку, разные чаты — параллельно. Сообщения, пришедшие пока ход чата
+в работе (или в течение coalesce_window после первого), склеиваются в
+один следующий ход — один вызов LLM и один ответ вместо нескольких.
+Очередь чата живёт только пока в ней есть работа: после последнего
+хода запись удаляется. Ожидающих сообщений у чата не больше
+max_pending: сверх этого submit отказывает, и вызывающий просит
+пользователя подождать ответа.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+TurnHandler = Callable[[int, List[Any]], Awaitable[None]]
+
+
+class ChatQueues:
+    def __init__(
+            self,
+            handler: TurnHandler,
+            coalesce_window: float = 0.5,
+            max_batch: int = 10,
+            max_pending: int = 20) -> None:
+        self._handler = handler
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+
+        self._pending: Dict[int, List[Any]] = {}
+        self._workers: Dict[int, "asyncio.Task[None]"] = {}
+
+        self._received = 0
+        self._turns = 0
+        self._coalesced = 0
+        self._failures = 0
+        self._dropped = 0
+
+    def submit(self, chat_id: int, item: Any) -> bool:
+        """
+        Поставить сообщение в очередь чата; ответ придёт из обработчика.
+        False — у чата уже max_pending ожидающих, сообщение не принято.
+        """
+        self._received += 1
+        pending = self._pending.setdefault(chat_id, [])
+        if len(pending) >= self.max_pending:
+            self._dropped += 1
+            return False
+        pending.append(item)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(
+                self._run(chat_id), name=f"chat-queue-{chat_id}")
+        return True
+
+    def pending(self, chat_id: int) -> int:
+        return len(self._pending.get(chat_id, ()))
+
+    async def _run(self, chat_id: int) -> None:
+        try:
+            if self.coalesce_window > 0:
+                # Даём дописать вопрос, разбитый на несколько сообщений
+                await asyncio.sleep(self.coalesce_window)
+            while True:
+                pending = self._pending.get(chat_id)
+                if not pending:
+                    break
+                batch = pending[:self.max_batch]
+                del pending[:self.max_batch]
+                self._turns += 1
+                self._coalesced += len(batch) - 1
+                try:
+                    await self._handler(chat_id, batch)
+                except Exception:
+                    self._failures += 1
+                    logger.exception("Chat %s turn failed", chat_id)
+        finally:
+            # Между последней проверкой и этим местом await нет:
+            # новое сообщение не может потеряться
+            self._pending.pop(chat_id, None)
+            self._workers.pop(chat_id, None)
+
+    async def drain(self, timeout: float) -> bool:
+        """Дождаться текущих ходов; True — все завершились в срок"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._workers:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            await asyncio.wait(list(self._workers.values()), timeout=remaining)
+        return True
+
+    async def aclose(self) -> None:
+        """Отмена незавершённых ходов при остановке"""
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def __len__(self) -> int:
+        return len(self._workers)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "active_chats": len(self._workers),
+            "pending_messages": sum(len(p) for p in self._pending.values()),
+            "received": self._received,
+            "turns": self._turns,
+            "coalesced": self._coalesced,
+            "failures": self._failures,
+            "dropped": self._dropped,
+            "coalesce_window": self.coalesce_window,
+            "max_pending": self.max_pending,
+        }
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Автомат защиты для вызовов зависимого сервиса и фоновый проверяющий.
+
+closed    — вызовы идут; failure_threshold подряд ошибок или медленных
+            (дольше slow_call) ответов размыкают цепь;
+open      — вызовы сразу отклоняются, вызывающий работает без сервиса;
+half_open — проверка готовности прошла, пропускается один пробный
+            вызов: успех замыкает цепь, ошибка снова размыкает.
+
+HealthProber периодически опрашивает готовность сервиса: неудача
+размыкает цепь сразу, не дожидаясь пользовательских таймаутов, успех
+переводит разомкнутую цепь в half_open.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 3,
+            slow_call: float = 3.0,
+            initial_state: str = OPEN) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+
+        self.state = initial_state
+        self.reason: Optional[str] = (
+            "not probed yet" if initial_state == OPEN else None)
+        self.changed_at = time.time()
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+
+        self._rejected = 0
+        self._opened = 0
+        self._latencies: Deque[float] = deque(maxlen=100)
+
+    def _set_state(self, state: str, reason: Optional[str] = None) -> None:
+        if state == self.state:
+            return
+        logger.info("Circuit %s: %s -> %s (%s)",
+                    self.name, self.state, state, reason or "ok")
+        if state == OPEN:
+            self._opened += 1
+        self.state = state
+        self.reason = reason
+        self.changed_at = time.time()
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Можно ли вызывать сервис сейчас"""
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self._rejected += 1
+        return False
+
+    def record(self, latency: float, ok: bool = True,
+               error: Optional[str] = None) -> None:
+        """Итог вызова; медленный успешный ответ считается ошибкой"""
+        self._latencies.append(latency)
+        if ok and latency > self.slow_call:
+            ok = False
+            error = f"slow call {latency:.2f}s"
+        if ok:
+            self._consecutive_failures = 0
+            # Запоздавший ответ не замыкает цепь, разомкнутую проверкой
+            if self.state != OPEN:
+                self._set_state(CLOSED)
+            return
+        self._consecutive_failures += 1
+        if (self.state == HALF_OPEN
+                or self._consecutive_failures >= self.failure_threshold):
+            self._set_state(OPEN, error)
+        self._trial_in_flight = False
+
+    def cancel(self) -> None:
+        """Вызов отменён, не завершившись: не успех и не ошибка сервиса"""
+        self._trial_in_flight = False
+
+    def probe(self, ok: bool, error: Optional[str] = None) -> None:
+        """Результат проверки готовности"""
+        if not ok:
+            self._set_state(OPEN, error or "probe failed")
+        elif self.state == OPEN:
+            self._set_state(HALF_OPEN, "probe succeeded")
+
+    def reset(self) -> None:
+        self._consecutive_failures = 0
+        self._set_state(CLOSED)
+
+    def _latency_percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return round(
+            ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 3)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "reason": self.reason,
+            "since": self.changed_at,
+            "consecutive_failures": self._consecutive_failures,
+            "rejected": self._rejected,
+            "opened": self._opened,
+            "last_latency": (
+                round(self._latencies[-1], 3) if self._latencies else None),
+            "latency_p50": self._latency_percentile(50),
+            "latency_p95": self._latency_percentile(95),
+        }
+
+
+class HealthProber:
+    def __init__(
+            self,
+            breaker: CircuitBreaker,
+            check: Callable[[], Awaitable[bool]],
+            interval: float = 5.0) -> None:
+        self.breaker = breaker
+        self.check = check
+        self.interval = interval
+        self.last_probe_at: Optional[float] = None
+        self.last_probe_ok: Optional[bool] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def probe_once(self) -> bool:
+        try:
+            ok = await self.check()
+            error = None if ok else "not ready"
+        except Exception as e:
+            ok, error = False, str(e)
+        self.last_probe_at = time.time()
+        self.last_probe_ok = ok
+        self.breaker.probe(ok, error)
+        return ok
+
+    async def _run(self) -> None:
+        # Первую проверку делает вызывающий (probe_once при старте)
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.probe_once()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(
+                self._run(), name=f"probe-{self.breaker.name}")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "last_probe_at": self.last_probe_at,
+            "last_probe_ok": self.last_probe_ok,
+        }
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Абсолютный дедлайн обработки сообщения, общий для всех сервисов.
+
+Заголовок X-Request-Deadline — unix-время в секундах, после которого
+ответ пользователю уже не нужен. Каждый переход ограничивает таймаут
+апстрима остатком бюджета и передаёт заголовок дальше; сервисы
+отбрасывают запросы с истёкшим дедлайном (504), не начиная работу.
+"""
+import time
+from typing import Dict, Optional
+
+DEADLINE_HEADER = "X-Request-Deadline"
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени на сообщение исчерпан"""
+
+
+class Deadline:
+    __slots__ = ("at",)
+
+    def __init__(self, at: float) -> None:
+        self.at = at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.time() + seconds)
+
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> Optional["Deadline"]:
+        try:
+            return cls(float(value)) if value else None
+        except ValueError:
+            return None
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.time())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float, reserve: float = 0.0) -> float:
+        """Таймаут вызова: не больше cap и остатка за вычетом reserve"""
+        left = self.remaining() - reserve
+        if left <= 0:
+            raise DeadlineExceeded(
+                f"{self.remaining():.2f}s left, {reserve:.2f}s reserved")
+        return min(cap, left)
+
+    def headers(self) -> Dict[str, str]:
+        return {DEADLINE_HEADER: f"{self.at:.3f}"}
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Ограниченное хранилище истории диалогов.
+
+Системный промпт в истории не хранится: у чата есть только ссылка на
+скомпилированный промпт (см. prompts.py), текст подставляется при
+сборке payload.
+
+Чаты лежат в OrderedDict в порядке последнего обращения: вытеснение
+по LRU (max_chats), по простою (idle_ttl) и по бюджету памяти идёт
+с головы словаря и стоит O(вытесненных). Простаивающий чат удаляется
+целиком и памяти не занимает.
+"""
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+from state_backend import StateBackend, StateBackendError
+from token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Накладные расходы на сообщение и чат сверх самих строк
+MESSAGE_OVERHEAD = sys.getsizeof(object()) + 3 * 8 + 8
+CHAT_OVERHEAD = 200
+
+
+class Message:
+    """Компактное сообщение: без __dict__, роль, текст и оценка токенов"""
+    __slots__ = ("role", "text", "tokens")
+
+    def __init__(self, role: str, text: str) -> None:
+        self.role = sys.intern(role)
+        self.text = text
+        self.tokens = estimate_tokens(text)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "text": self.text}
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.text) + MESSAGE_OVERHEAD
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.text[:30]!r})"
+
+
+class ChatHistory:
+    __slots__ = ("messages", "last_access", "nbytes", "system_ref")
+
+    def __init__(self, system_ref: Optional[str] = None) -> None:
+        self.messages: List[Message] = []
+        self.system_ref = system_ref
+        self.last_access = time.monotonic()
+        self.nbytes = CHAT_OVERHEAD
+
+
+class HistoryStore:
+    def __init__(
+            self,
+            max_chats: int = 10000,
+            idle_ttl: float = 24 * 3600,
+            memory_budget: int = 64 * 1024 * 1024,
+            max_messages: int = 10) -> None:
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self.max_messages = max_messages
+
+        self._chats: "OrderedDict[int, ChatHistory]" = OrderedDict()
+        self._nbytes = 0
+        self._evictions = {"lru": 0, "ttl": 0, "memory": 0}
+
+    def __contains__(self, chat_id: int) -> bool:
+        return self._get(chat_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self._chats))
+
+    def _get(self, chat_id: int) -> Optional[ChatHistory]:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return None
+        now = time.monotonic()
+        if now - chat.last_access > self.idle_ttl:
+            self._drop(chat_id, "ttl")
+            return None
+        chat.last_access = now
+        self._chats.move_to_end(chat_id)
+        return chat
+
+    def _drop(self, chat_id: int, reason: Optional[str] = None) -> None:
+        chat = self._chats.pop(chat_id, None)
+        if chat is None:
+            return
+        self._nbytes -= chat.nbytes
+        if reason:
+            self._evictions[reason] += 1
+
+    def start(self, chat_id: int, system_ref: Optional[str]) -> None:
+        """Новый диалог со ссылкой на системный промпт"""
+        self._drop(chat_id)
+        chat = ChatHistory(system_ref)
+        self._chats[chat_id] = chat
+        self._nbytes += chat.nbytes
+        self.evict()
+
+    def system_ref(self, chat_id: int) -> Optional[str]:
+        chat = self._get(chat_id)
+        return chat.system_ref if chat else None
+
+    def messages(self, chat_id: int) -> List[Message]:
+        chat = self._get(chat_id)
+        return list(chat.messages) if chat else []
+
+    def payload(self, chat_id: int) -> List[Dict[str, str]]:
+        """История чата в формате messages для Completion API"""
+        return [m.to_dict() for m in self.messages(chat_id)]
+
+    def append(self, chat_id: int, role: str, text: str) -> None:
+        chat = self._get(chat_id)
+        if chat is None:
+            chat = ChatHistory()
+            self._chats[chat_id] = chat
+            self._nbytes += chat.nbytes
+
+        message = Message(role, text)
+        chat.messages.append(message)
+        chat.nbytes += message.nbytes()
+        self._nbytes += message.nbytes()
+
+        if len(chat.messages) > self.max_messages:
+            dropped = chat.messages[:-self.max_messages]
+            freed = sum(m.nbytes() for m in dropped)
+            chat.messages = chat.messages[-self.max_messages:]
+            chat.nbytes -= freed
+            self._nbytes -= freed
+
+        self.evict()
+
+    def delete(self, chat_id: int) -> None:
+        self._drop(chat_id)
+
+    def export(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Снимок чата для внешнего хранилища"""
+        chat = self._get(chat_id)
+        if chat is None:
+            return None
+        return {
+            "system_ref": chat.system_ref,
+            "messages": [[m.role, m.text] for m in chat.messages],
+        }
+
+    def restore(self, chat_id: int, data: Dict[str, Any]) -> None:
+        """Восстановление чата из снимка export()"""
+        self.start(chat_id, data.get("system_ref"))
+        for role, text in data.get("messages", [])[-self.max_messages:]:
+            self.append(chat_id, role, text)
+
+    def evict(self) -> None:
+        """Вытеснение по простою, числу чатов и бюджету памяти"""
+        now = time.monotonic()
+        while self._chats:
+            chat_id, chat = next(iter(self._chats.items()))
+            if now - chat.last_access > self.idle_ttl:
+                self._drop(chat_id, "ttl")
+            elif len(self._chats) > self.max_chats:
+                self._drop(chat_id, "lru")
+            elif self._nbytes > self.memory_budget and len(self._chats) > 1:
+                self._drop(chat_id, "memory")
+            else:
+                break
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "chats": len(self._chats),
+            "messages": sum(len(c.messages) for c in self._chats.values()),
+            "bytes": self._nbytes,
+            "memory_budget": self.memory_budget,
+            "max_chats": self.max_chats,
+            "idle_ttl": self.idle_ttl,
+            "evictions": dict(self._evictions),
+        }
+
+
+class HistorySync:
+    """
+    Копия истории в общем хранилище: переживает рестарт и переезд чата
+    на другую реплику. Локальный HistoryStore остаётся основным — чат
+    привязан к реплике, поэтому хранилище читается только при промахе.
+    Сбой хранилища не ломает диалог, а только логируется.
+    """
+
+    def __init__(
+            self,
+            history: HistoryStore,
+            backend: StateBackend,
+            prefix: str = "history:") -> None:
+        self.history = history
+        self.backend = backend
+        self.prefix = prefix
+        self._loads = 0
+        self._saves = 0
+        self._errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        # Хранилище в памяти процесса лишь продублировало бы HistoryStore
+        return self.backend.shared
+
+    async def load(self, chat_id: int) -> bool:
+        """Подтянуть чат из хранилища, если локально его нет"""
+        if not self.enabled or chat_id in self.history:
+            return False
+        try:
+            raw = await self.backend.get(f"{self.prefix}{chat_id}")
+        except StateBackendError as e:
+            self._errors += 1
+            logger.warning("History load for %s failed: %s", chat_id, e)
+            return False
+        if raw is None:
+            return False
+        self.history.restore(chat_id, json.loads(raw))
+        self._loads += 1
+        return True
+
+    async def save(self, chat_id: int) -> None:
+        if not self.enabled:
+            return
+        data = self.history.export(chat_id)
+        if data is None:
+            return
+        try:
+            await self.backend.set(
+                f"{self.prefix}{chat_id}",
+                json.dumps(data, ensure_ascii=False).encode(),
+                ttl=self.history.idle_ttl)
+            self._saves += 1
+        except StateBackendError as e:
+            self._errors += 1
+            logger.warning("History save for %s failed: %s", chat_id, e)
+
+    async def delete(self, chat_id: int) -> None:
+        if not self.enabled:
+            return
+        try:
+            await self.backend.delete(f"{self.prefix}{chat_id}")
+        except StateBackendError as e:
+            self._errors += 1
+            logger.warning("History delete for %s failed: %s", chat_id, e)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "loads": self._loads,
+            "saves": self._saves,
+            "errors": self._errors,
+            "backend": self.backend.metrics(),
+        }
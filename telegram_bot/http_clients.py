@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Общие асинхронные HTTP клиенты к микросервисам.
+
+На каждый сервис — один httpx.AsyncClient с keep-alive пулом и своим
+лимитом соединений, чтобы медленный сервис не занимал весь пул.
+"""
+import logging
+import os
+from typing import Dict
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Лимиты соединений по сервисам: <NAME>_POOL_SIZE в окружении
+POOL_SIZES = {
+    "validator": int(os.getenv("VALIDATOR_POOL_SIZE", "16")),
+    "rag": int(os.getenv("RAG_POOL_SIZE", "16")),
+    "llm_agent": int(os.getenv("LLM_AGENT_POOL_SIZE", "16")),
+    "llm": int(os.getenv("LLM_POOL_SIZE", "8")),
+    "replicas": int(os.getenv("REPLICAS_POOL_SIZE", "16")),
+}
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+
+class ServiceClients:
+    """Реестр пулов соединений, создаваемых по первому обращению"""
+
+    def __init__(self, pool_sizes: Dict[str, int] | None = None) -> None:
+        self.pool_sizes = dict(pool_sizes or POOL_SIZES)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(self, service: str) -> httpx.AsyncClient:
+        client = self._clients.get(service)
+        if client is None or client.is_closed:
+            size = self.pool_sizes.get(service, 8)
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=size,
+                    max_keepalive_connections=size,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(30.0, connect=3.05),
+            )
+            self._clients[service] = client
+            logger.info("HTTP pool for %s created (max %s)", service, size)
+        return client
+
+    async def aclose(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+http_clients = ServiceClients()
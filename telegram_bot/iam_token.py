@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Общий менеджер IAM токена Yandex Cloud.
+
+Токен обновляется фоновым потоком заранее, за IAM_REFRESH_MARGIN секунд
+до истечения, поэтому на пути запроса get_token() просто отдаёт
+закэшированное значение. Если токена ещё нет или он истёк, обновление
+выполняет ровно один вызывающий, остальные ждут его результат. В event
+loop ожидание тоже общее: на всю волну aget_token() уходит один поток
+default executor, а не по потоку на вызывающего.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import jwt
+import requests
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger(__name__)
+
+IAM_URL = os.getenv(
+    "IAM_URL", "https://iam.api.cloud.yandex.net/iam/v1/tokens")
+IAM_AUDIENCE = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
+# Срок жизни, если IAM не вернул expiresAt
+IAM_TOKEN_LIFETIME = int(os.getenv("IAM_TOKEN_LIFETIME", "3600"))
+IAM_REFRESH_MARGIN = int(os.getenv("IAM_REFRESH_MARGIN", "600"))
+IAM_REQUEST_TIMEOUT = float(os.getenv("IAM_REQUEST_TIMEOUT", "10"))
+# Токен, которому осталось жить меньше, считается истёкшим
+EXPIRY_SKEW = 30
+MAX_RETRY_DELAY = 60
+
+
+class IAMTokenError(Exception):
+    """Не удалось получить IAM токен"""
+
+
+def _parse_expires_at(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        # 2024-01-01T12:00:00.123456789Z — наносекунды fromisoformat не ест
+        head, _, frac = value.rstrip("Z").partition(".")
+        ts = datetime.fromisoformat(head + "+00:00").timestamp()
+        return ts + float(f"0.{frac}") if frac else ts
+    except ValueError:
+        return None
+
+
+class IAMTokenManager:
+    def __init__(
+            self,
+            service_account_id: Optional[str],
+            key_id: Optional[str],
+            private_key: Optional[str],
+            iam_url: str = IAM_URL,
+            refresh_margin: float = IAM_REFRESH_MARGIN,
+            timeout: float = IAM_REQUEST_TIMEOUT) -> None:
+        self.service_account_id = service_account_id
+        self.key_id = key_id
+        self.private_key = private_key
+        self.iam_url = iam_url
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+
+        self._token: Optional[str] = None
+        self._expires_at: float = 0.0
+        self._lock = threading.Lock()
+        self._refresh_task: Optional[asyncio.Future] = None
+        self._session = requests.Session()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._refreshes = 0
+        self._failures = 0
+        self._last_latency: Optional[float] = None
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._last_error: Optional[str] = None
+        self._last_refresh_at: Optional[float] = None
+
+    def _valid(self) -> bool:
+        return (self._token is not None
+                and time.time() < self._expires_at - EXPIRY_SKEW)
+
+    def peek(self) -> Optional[str]:
+        """Закэшированный токен без обращения к сети"""
+        return self._token if self._valid() else None
+
+    def get_token(self) -> str:
+        """Токен для запроса: из кэша, либо single-flight обновление"""
+        token = self.peek()
+        if token is not None:
+            return token
+        with self._lock:
+            # Пока ждали блокировку, токен мог обновить другой поток
+            token = self.peek()
+            if token is not None:
+                return token
+            return self._refresh_locked()
+
+    async def aget_token(self) -> str:
+        """
+        Асинхронный вариант: обновление идёт в одном потоке, все
+        вызывающие в loop ждут общую задачу
+        """
+        token = self.peek()
+        if token is not None:
+            return token
+        task = self._refresh_task
+        if (task is None or task.done()
+                or task.get_loop() is not asyncio.get_running_loop()):
+            task = self._refresh_task = asyncio.ensure_future(
+                asyncio.to_thread(self.get_token))
+            # Ошибку заберут ожидающие; если все отменены — не теряем её
+            task.add_done_callback(
+                lambda t: t.cancelled() or t.exception())
+        # Отмена одного ожидающего не отменяет обновление для остальных
+        return await asyncio.shield(task)
+
+    def refresh(self) -> str:
+        """Принудительное обновление (одно на всех конкурентных вызывающих)"""
+        with self._lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> str:
+        if not all([self.service_account_id, self.key_id, self.private_key]):
+            raise IAMTokenError(
+                "SERVICE_ACCOUNT_ID, KEY_ID и PRIVATE_KEY должны быть заданы")
+
+        t0 = time.monotonic()
+        try:
+            now = int(time.time())
+            encoded_token = jwt.encode(
+                {
+                    'aud': IAM_AUDIENCE,
+                    'iss': self.service_account_id,
+                    'iat': now,
+                    'exp': now + 3600
+                },
+                self.private_key,
+                algorithm='PS256',
+                headers={'kid': self.key_id})
+            response = self._session.post(
+                self.iam_url,
+                json={'jwt': encoded_token},
+                timeout=self.timeout,
+            )
+            if response.status_code != 200:
+                raise IAMTokenError(
+                    f"Ошибка генерации токена: {response.status_code} "
+                    f"{response.text[:200]}")
+            token_data = response.json()
+        except Exception as e:
+            self._failures += 1
+            self._last_error = str(e)
+            logger.error("IAM token refresh failed: %s", e)
+            if isinstance(e, IAMTokenError):
+                raise
+            raise IAMTokenError(str(e)) from e
+
+        latency = time.monotonic() - t0
+        self._token = token_data['iamToken']
+        self._expires_at = (
+            _parse_expires_at(token_data.get('expiresAt'))
+            or now + IAM_TOKEN_LIFETIME)
+        self._refreshes += 1
+        self._last_latency = latency
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+        self._last_error = None
+        self._last_refresh_at = time.time()
+        logger.info(
+            "IAM token refreshed in %.3fs, expires in %ds",
+            latency, self._expires_at - time.time())
+        return self._token
+
+    def _next_refresh_in(self) -> float:
+        return max(0.0, self._expires_at - self.refresh_margin - time.time())
+
+    def _run(self) -> None:
+        retry_delay = 1.0
+        while not self._stop.is_set():
+            if self._token is not None:
+                self._wakeup.wait(self._next_refresh_in())
+                self._wakeup.clear()
+                if self._stop.is_set():
+                    return
+            try:
+                self.refresh()
+                retry_delay = 1.0
+            except Exception:
+                # Старый токен продолжает обслуживать запросы, пока жив
+                self._stop.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+    def start(self) -> None:
+        """Запуск фонового обновления"""
+        if self._thread and self._thread.is_alive():
+            return
+        if not all([self.service_account_id, self.key_id, self.private_key]):
+            logger.warning("IAM credentials are not set, "
+                           "background refresh disabled")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="iam-token-refresh", daemon=True)
+        self._thread.start()
+        logger.info("IAM token background refresh started")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=self.timeout + 1)
+            self._thread = None
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "has_token": self._valid(),
+            "expires_in": (
+                round(self._expires_at - time.time(), 1)
+                if self._token else None),
+            "refreshes": self._refreshes,
+            "failures": self._failures,
+            "last_refresh_latency": self._last_latency,
+            "avg_refresh_latency": (
+                self._total_latency / self._refreshes
+                if self._refreshes else None),
+            "max_refresh_latency": self._max_latency,
+            "last_refresh_at": self._last_refresh_at,
+            "last_error": self._last_error,
+            "background_refresh": bool(
+                self._thread and self._thread.is_alive()),
+        }
+
+
+iam_tokens = IAMTokenManager(
+    os.getenv("SERVICE_ACCOUNT_ID"),
+    os.getenv("KEY_ID"),
+    os.getenv("PRIVATE_KEY"),
+)
@@ -1,44 +1,87 @@
 import asyncio
+import time
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 from routers import router
-from bot_app import start_bot_in_background
+from routers.telegram_webhook import webhook_workers
+from bot_app import bot_runtime, ingestion_mode
+from iam_token import iam_tokens
+from loop_monitor import DEBUG_TOKEN_HEADER, debug_allowed, loop_monitor
+from sharding import replica_ring
 import logging
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    title="Telegram Bot Service",
-    description="Основной сервис Telegram бота с поддержкой ИИ",
-    version="1.0.0",
-    debug=True
-)
 
-app.include_router(router)
-
-
-@app.on_event("startup")
-async def startup_event():
-    """Инициализация при запуске"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Бот живёт в том же event loop, что и FastAPI"""
+    t0 = time.monotonic()
     logger.info("🚀 Telegram Bot Service запущен")
-    start_bot_in_background()
+    loop_monitor.start()
+    iam_tokens.start()
+    if replica_ring.enabled:
+        logger.info("Реплика %d из %d",
+                    replica_ring.index, len(replica_ring.replicas))
+    # Приём обновлений задаёт BOT_INGESTION; запись трафика при polling
+    # идёт в обработчике PTB, при webhook — при приёме
+    mode = ingestion_mode()
+    logger.info("📥 Приём обновлений: %s", mode)
+    # Старт бота и проверки зависимостей идут в фоне
+    bot_runtime.start(polling=mode == "polling")
     logger.info("📋 Доступные эндпоинты:")
     logger.info("• POST /api/telegram_bot/ - Обработка сообщений")
     logger.info("• GET /api/telegram_bot/status - Статус бота")
+    logger.info("• GET /ready - Готовность бота")
     logger.info("• POST /api/telegram_bot/webhook - Webhook для Telegram")
+    logger.info("• GET /api/telegram_bot/webhook-metrics - Метрики webhook")
     logger.info("• GET /api/telegram_bot/set-webhook - Установка webhook")
     logger.info("• GET /api/telegram_bot/delete-webhook - Удаление webhook")
     logger.info("• GET /api/telegram_bot/webhook-info - Информация о webhook")
+    logger.info("Сервис принимает запросы через %.3fs",
+                time.monotonic() - t0)
 
+    yield
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Очистка при остановке"""
+    # Один срок BOT_DRAIN_TIMEOUT на очередь webhook и ходы чатов
+    await webhook_workers.drain(bot_runtime.drain_remaining())
+    await webhook_workers.aclose()
+    await bot_runtime.stop()
+    await asyncio.to_thread(iam_tokens.stop)
+    await loop_monitor.stop()
     logger.info("🛑 Telegram Bot Service остановлен")
 
 
+app = FastAPI(
+    title="Telegram Bot Service",
+    description="Основной сервис Telegram бота с поддержкой ИИ",
+    version="1.0.0",
+    debug=True,
+    lifespan=lifespan
+)
+
+app.include_router(router)
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: бот запущен и принимает апдейты"""
+    body = bot_runtime.status()
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@app.get("/debug/loop")
+async def debug_loop(request: Request, top: int = 10):
+    """Задержка event loop и места, которые его блокировали"""
+    if not debug_allowed(request.headers.get(DEBUG_TOKEN_HEADER)):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return loop_monitor.metrics(top)
+
+
 async def main():
     uvicorn.run(
         "main:app",
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Выполнение этапов обработки сообщения как небольшого графа зависимостей.
+
+Этап запускается, как только готовы все его зависимости; независимые
+этапы идут параллельно. Этап-проверка (gate) возвращает True, если
+сообщение надо заблокировать: тогда остальные этапы отменяются, в том
+числе уже начатая спекулятивная генерация, и run() поднимает Blocked.
+Результаты возвращаются только после того, как все проверки прошли.
+"""
+import asyncio
+import logging
+import time
+from typing import (Any, Awaitable, Callable, Dict, Iterable, List,
+                    Optional, Sequence)
+
+logger = logging.getLogger(__name__)
+
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class Blocked(Exception):
+    """Этап-проверка заблокировал сообщение"""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__(f"blocked by {stage}")
+        self.stage = stage
+
+
+class Stage:
+    __slots__ = ("name", "fn", "deps", "gate", "optional")
+
+    def __init__(
+            self,
+            name: str,
+            fn: StageFn,
+            deps: Iterable[str] = (),
+            gate: bool = False,
+            optional: bool = False) -> None:
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.gate = gate
+        # Ошибка необязательного этапа даёт None вместо срыва всего графа
+        self.optional = optional
+
+
+class Pipeline:
+    def __init__(self, stages: Sequence[Stage]) -> None:
+        self.stages = {s.name: s for s in stages}
+        for stage in stages:
+            missing = set(stage.deps) - set(self.stages)
+            if missing:
+                raise ValueError(
+                    f"Stage {stage.name} depends on unknown {missing}")
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self.cancelled: List[str] = []
+
+    async def _call(self, stage: Stage, results: Dict[str, Any]) -> Any:
+        if not stage.optional:
+            return await stage.fn(results)
+        try:
+            return await stage.fn(results)
+        except Exception as e:
+            logger.warning("Stage %s failed: %s", stage.name, e)
+            return None
+
+    async def run(self) -> Dict[str, Any]:
+        t0 = time.monotonic()
+        results: Dict[str, Any] = {}
+        pending = dict(self.stages)
+        running: Dict[asyncio.Task, Stage] = {}
+
+        def launch_ready() -> None:
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.deps):
+                    del pending[name]
+                    self.timings[name] = {
+                        "start": round(time.monotonic() - t0, 3)}
+                    task = asyncio.create_task(
+                        self._call(stage, results), name=f"stage-{name}")
+                    running[task] = stage
+
+        async def cancel_running() -> None:
+            for task, stage in running.items():
+                task.cancel()
+                self.cancelled.append(stage.name)
+            await asyncio.gather(*running, return_exceptions=True)
+            running.clear()
+
+        launch_ready()
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    self.timings[stage.name]["end"] = round(
+                        time.monotonic() - t0, 3)
+                    # Исключение этапа прерывает весь граф
+                    results[stage.name] = task.result()
+                    if stage.gate and results[stage.name]:
+                        await cancel_running()
+                        raise Blocked(stage.name)
+                launch_ready()
+        except BaseException:
+            await cancel_running()
+            raise
+        if pending:
+            raise ValueError(f"Unreachable stages: {sorted(pending)}")
+        return results
+
+    def report(self) -> Optional[str]:
+        return ", ".join(
+            f"{name} {t['start']:.2f}-{t.get('end', float('nan')):.2f}s"
+            for name, t in self.timings.items()) or None
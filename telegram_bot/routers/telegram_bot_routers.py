@@ -1,15 +1,34 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 from models.telegram_bot_models import (
     TelegramMessage,
     TelegramResponse,
     BotStatus
 )
-import requests
+import asyncio
+import codecs
+import json
 import logging
 import os
 import time
-import jwt
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+
+from admission import Overloaded
+from bot_app import (
+    answer_cache, answer_detached, chat_queues, rag_breaker, rag_prober,
+    yandex_bot)
+from deadline import DeadlineExceeded
+from http_clients import http_clients
+from iam_token import iam_tokens, IAMTokenError
+from prompts import prompt_report
+from pipeline import Blocked
 from prompt_injection import PromptInjectionFilter
+from sharding import replica_ring
+from traffic_capture import traffic_recorder
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -27,64 +46,24 @@ FOLDER_ID = os.getenv("FOLDER_ID", "")
 SERVICE_ACCOUNT_ID = os.getenv("SERVICE_ACCOUNT_ID", "")
 KEY_ID = os.getenv("KEY_ID", "")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
-LLM_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-
-# Кэш для IAM токена
-_iam_token_cache = {"token": None, "expires": 0}
-
-
-def get_iam_token():
-    """Получение IAM токена для Yandex Cloud"""
-    current_time = time.time()
-
-    # Проверяем, не истек ли токен
-    if (
-        _iam_token_cache["token"]
-        and current_time < _iam_token_cache["expires"]
-    ):
-        return _iam_token_cache["token"]
-
-    try:
-        # Создаем JWT токен
-        now = int(time.time())
-        payload = {
-            'aud': 'https://iam.api.cloud.yandex.net/iam/v1/tokens',
-            'iss': SERVICE_ACCOUNT_ID,
-            'iat': now,
-            'exp': now + 3600
-        }
-
-        # Создаем JWT
-        encoded_token = jwt.encode(
-            payload,
-            PRIVATE_KEY,
-            algorithm='PS256',
-            headers={'kid': KEY_ID}
-        )
-
-        # Получаем IAM токен
-        response = requests.post(
-            'https://iam.api.cloud.yandex.net/iam/v1/tokens',
-            json={'jwt': encoded_token},
-            headers={'Content-Type': 'application/json'}
-        )
+LLM_URL = os.getenv(
+    "LLM_URL", "https://llm.api.cloud.yandex.net/foundationModels/v1/completion")
 
-        if response.status_code == 200:
-            iam_token = response.json()['iamToken']
-            _iam_token_cache["token"] = iam_token
-            _iam_token_cache["expires"] = current_time + 3300  # 55 минут
-            logger.info("IAM токен успешно получен")
-            return iam_token
-        else:
-            logger.error(
-                "Ошибка получения IAM токена: "
-                f"{response.status_code} - {response.text}"
-            )
-            return None
+# Пакетная обработка: параллелизм по умолчанию и потолок для ?concurrency
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "64"))
+# Все пакеты — один поток справедливой очереди допуска с малым весом:
+# сколько бы их ни шло, чаты получают слоты в первую очередь
+BULK_FLOW = "bulk"
+BULK_FAIR_WEIGHT = float(os.getenv("BULK_FAIR_WEIGHT", "0.25"))
 
-    except Exception as e:
-        logger.error(f"Ошибка при получении IAM токена: {e}")
-        return None
+# Один фильтр на процесс: модерация идёт через общий пул "llm"
+injection_filter = PromptInjectionFilter(
+    f"gpt://{FOLDER_ID}/yandexgpt-lite",
+    folder_id=FOLDER_ID,
+    token_getter=iam_tokens.get_token,
+    atoken_getter=iam_tokens.aget_token
+)
 
 
 @router.post("/", response_model=TelegramResponse)
@@ -92,9 +71,8 @@ async def process_message(message: TelegramMessage):
     """Обработка сообщения от Telegram бота"""
     try:
         logger.info(
-            f"Получено сообщение от пользователя {
-                message.user_id}: {
-                message.message_text}")
+            f"Получено сообщение от пользователя {message.user_id}: "
+            f"{message.message_text}")
 
         # Проверяем наличие необходимых переменных окружения
         if not all([FOLDER_ID, SERVICE_ACCOUNT_ID, KEY_ID, PRIVATE_KEY]):
@@ -106,13 +84,8 @@ async def process_message(message: TelegramMessage):
             )
 
         # Проверка на prompt injection
-        injection_filter = PromptInjectionFilter(
-            f"gpt://{FOLDER_ID}/yandexgpt-lite",
-            folder_id=FOLDER_ID,
-            token_getter=lambda: get_iam_token()
-        )
-
-        if injection_filter.detect_llm(message.message_text):
+        if await injection_filter.adetect_llm(
+                message.message_text, http_clients.get("llm")):
             logger.warning(
                 "Обнаружена попытка prompt injection "
                 f"от пользователя {message.user_id}"
@@ -139,6 +112,185 @@ async def process_message(message: TelegramMessage):
         )
 
 
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    Ответ пишется, пока тело запроса ещё загружается. StreamingResponse
+    при ASGI < 2.4 параллельно ждёт http.disconnect и съедает куски тела;
+    здесь отключение клиента видно по ошибке чтения тела или отправки.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+
+async def _bulk_lines(request: Request) -> AsyncIterator[str]:
+    """Строки тела: JSON-массив целиком или NDJSON по мере загрузки"""
+    if request.headers.get("content-type", "").startswith(
+            "application/json"):
+        body = json.loads(await request.body() or b"[]")
+        if isinstance(body, dict):
+            body = body.get("messages", [])
+        for item in body:
+            yield json.dumps(item, ensure_ascii=False)
+        return
+    # Символ UTF-8 может оказаться разрезан между кусками загрузки
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    async for chunk in request.stream():
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    tail += decoder.decode(b"", final=True)
+    if tail.strip():
+        yield tail
+
+
+async def _bulk_process(
+        message: TelegramMessage,
+        timings: Dict[str, float]) -> Tuple[TelegramResponse, str]:
+    """
+    Сообщение пакета через конвейер бота (answer_detached). Исход: ok,
+    blocked, overloaded или deadline; прочие ошибки — вызывающему.
+    """
+    try:
+        response_text = await answer_detached(
+            message.chat_id, message.message_text,
+            BULK_FLOW, BULK_FAIR_WEIGHT, timings)
+    except Blocked as e:
+        logger.warning(
+            f"Пакет: сообщение пользователя {message.user_id} "
+            f"заблокировано этапом {e.stage}")
+        return TelegramResponse(
+            chat_id=message.chat_id,
+            response_text="⚠️ Сообщение заблокировано проверкой "
+            "безопасности."
+        ), "blocked"
+    except Overloaded:
+        return TelegramResponse(
+            chat_id=message.chat_id,
+            response_text="🚦 Сервис перегружен, повторите позже."
+        ), "overloaded"
+    except (TimeoutError, DeadlineExceeded):
+        return TelegramResponse(
+            chat_id=message.chat_id,
+            response_text="⌛ Ответ не готов за отведённое время."
+        ), "deadline"
+    return TelegramResponse(
+        chat_id=message.chat_id,
+        response_text=response_text
+    ), "ok"
+
+
+async def _bulk_item(
+        index: int, line: str, received: float) -> Dict[str, Any]:
+    """Одна строка пакета -> строка результата"""
+    started = time.perf_counter()
+    result: Dict[str, Any] = {"index": index}
+    timings = {"queue_ms": round((started - received) * 1000, 1)}
+    try:
+        raw = json.loads(line)
+        if isinstance(raw, dict) and "id" in raw:
+            result["id"] = raw["id"]
+        message = TelegramMessage.model_validate(raw)
+    except (ValueError, ValidationError) as e:
+        result.update(status="invalid", error=str(e)[:500])
+        return result
+    try:
+        response, status = await _bulk_process(message, timings)
+        result.update(
+            status=status,
+            chat_id=response.chat_id,
+            response_text=response.response_text)
+    except Exception as e:
+        logger.error(f"Ошибка пакетной обработки #{index}: {e}")
+        result.update(
+            status="error", chat_id=message.chat_id, error=str(e)[:500])
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    result["timings"] = timings
+    return result
+
+
+async def _bulk_stream(
+        request: Request, concurrency: int) -> AsyncIterator[str]:
+    """
+    Чтение, обработка и выдача результатов идут одновременно: очередь
+    входа ограничена, так что загрузка не убегает далеко вперёд.
+    """
+    t0 = time.perf_counter()
+    inbox: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    outbox: asyncio.Queue = asyncio.Queue()
+    counts: Dict[str, int] = {}
+
+    async def read() -> None:
+        index = 0
+        try:
+            async for line in _bulk_lines(request):
+                await inbox.put((index, line, time.perf_counter()))
+                index += 1
+        except Exception as e:
+            logger.error(f"Ошибка чтения пакета после #{index}: {e}")
+            await outbox.put({"index": index, "status": "invalid",
+                              "error": f"Некорректное тело запроса: {e}"})
+        for _ in range(concurrency):
+            await inbox.put(None)
+
+    async def work() -> None:
+        while (item := await inbox.get()) is not None:
+            await outbox.put(await _bulk_item(*item))
+        await outbox.put(None)
+
+    tasks = [asyncio.create_task(read())] + [
+        asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        running = concurrency
+        while running:
+            result = await outbox.get()
+            if result is None:
+                running -= 1
+                continue
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "summary": {
+                "items": sum(counts.values()),
+                **counts,
+                "concurrency": concurrency,
+                "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+            }
+        }, ensure_ascii=False) + "\n"
+    finally:
+        # Клиент отключился — недоделанные элементы не нужны
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router.post("/bulk")
+async def process_bulk(request: Request, concurrency: Optional[int] = None):
+    """
+    Пакетная обработка для оффлайн-оценки и рассылок.
+
+    Каждое сообщение проходит конвейер бота, как ход чата, но без
+    истории; слоты допуска пакеты делят с чатами с весом
+    BULK_FAIR_WEIGHT. Тело — JSON-массив TelegramMessage (или
+    {"messages": [...]}) либо NDJSON, по сообщению в строке, можно
+    потоком. Ответ — NDJSON в порядке готовности: index, id (если был
+    во входе), status (ok, blocked, overloaded, deadline, invalid,
+    error), response_text и timings (queue_ms, admission_ms, <этап>_ms
+    для этапов конвейера, total_ms); последняя строка — summary.
+    """
+    concurrency = max(1, min(
+        concurrency or BULK_CONCURRENCY, BULK_MAX_CONCURRENCY))
+    return _DuplexStreamingResponse(
+        _bulk_stream(request, concurrency),
+        media_type="application/x-ndjson")
+
+
 @router.get("/status", response_model=BotStatus)
 async def get_bot_status():
     """Получение статуса бота"""
@@ -148,11 +300,35 @@ async def get_bot_status():
     )
 
 
+@router.get("/metrics")
+async def get_metrics():
+    """Внутренние метрики сервиса"""
+    return {
+        "iam_token": iam_tokens.metrics(),
+        "history": yandex_bot.history.metrics(),
+        "prompts": prompt_report(yandex_bot.system_prompt),
+        "prompt_sizes": yandex_bot.prompt_sizes.metrics(),
+        "chat_queues": chat_queues.metrics(),
+        "admission": yandex_bot.admission.metrics(),
+        "state": yandex_bot.history_sync.metrics(),
+        "rag": {**rag_breaker.metrics(), "probe": rag_prober.metrics()},
+        "answer_cache": answer_cache.metrics(),
+        "traffic_capture": traffic_recorder.metrics(),
+        "replica": {
+            "index": replica_ring.index,
+            "replicas": len(replica_ring.replicas) or 1,
+        },
+    }
+
+
 async def ask_gpt(message_text: str) -> str:
     """Запрос к LLM через микросервис LLM Agent"""
     try:
         # Получаем IAM токен
-        iam_token = get_iam_token()
+        try:
+            iam_token = await iam_tokens.aget_token()
+        except IAMTokenError:
+            iam_token = None
         if not iam_token:
             return "❌ Ошибка аутентификации с Yandex Cloud"
 
@@ -179,18 +355,23 @@ async def ask_gpt(message_text: str) -> str:
             "LLM_URL": LLM_URL
         }
 
-        # Отправляем запрос к LLM Agent
-        response = requests.post(LLM_AGENT_URL, json=llm_request, timeout=30)
+        # Отправляем запрос к LLM Agent через общий пул соединений;
+        # редирект на адрес со слэшем — как раньше делал requests
+        response = await http_clients.get("llm_agent").post(
+            LLM_AGENT_URL, json=llm_request, timeout=30,
+            follow_redirects=True)
 
         if response.status_code == 200:
             result = response.json()
-            return result.get("result", "❌ Пустой ответ от ИИ")
+            # LLM Agent отвечает моделью LLMResult с полем gen_text
+            text = result.get("gen_text") or result.get("result")
+            return text or "❌ Пустой ответ от ИИ"
         else:
             logger.error(
                 f"Ошибка LLM Agent: {response.status_code} - {response.text}")
             return "❌ Ошибка при обращении к ИИ"
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Ошибка соединения с LLM Agent: {e}")
         return "❌ Ошибка соединения с сервисом ИИ"
     except Exception as e:
@@ -1,9 +1,23 @@
 from fastapi import APIRouter, Request, HTTPException
-from telegram import Update, Bot
-from telegram.ext import Application, ContextTypes
+from telegram import Bot
 import logging
 import os
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from bot_app import bot_runtime
+from http_clients import http_clients
+from sharding import FORWARDED_HEADER, replica_ring
+from traffic_capture import traffic_recorder
+from webhook_ingest import (
+    AckLatency,
+    UpdateDeduplicator,
+    WebhookWorkers,
+    update_chat_id,
+    verify_secret
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -14,13 +28,16 @@ router = APIRouter()
 # Telegram Bot настройки
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
-TELEGRAM_SERVICE_URL = os.getenv(
-    "TELEGRAM_SERVICE_URL",
-    "http://localhost:9999/api/telegram_bot")
+# Секрет, который Telegram присылает в заголовке каждого webhook-запроса
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "1000"))
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", "3600"))
 
 # Глобальная переменная для бота
 bot: Optional[Bot] = None
-application: Optional[Application] = None
 
 
 def get_bot():
@@ -31,131 +48,102 @@ def get_bot():
     return bot
 
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start"""
-    await update.message.reply_text(
-        "🤖 Привет! Я бот с поддержкой ИИ.\n"
-        "Отправьте мне любое сообщение, и я отвечу с помощью YandexGPT!"
-    )
-
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /help"""
-    await update.message.reply_text(
-        "📋 Доступные команды:\n"
-        "/start - Начать работу с ботом\n"
-        "/help - Показать это сообщение\n"
-        "/status - Проверить статус бота\n"
-        "\nПросто отправьте сообщение, и я отвечу!"
-    )
-
-
-async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /status"""
-    import requests
-    try:
-        response = requests.get(f"{TELEGRAM_SERVICE_URL}/status", timeout=5)
-        if response.status_code == 200:
-            status_data = response.json()
-            await update.message.reply_text(
-                f"✅ Статус: {status_data['status']}\n"
-                f"📝 Сообщение: {status_data['message']}"
-            )
-        else:
-            await update.message.reply_text("❌ Ошибка получения статуса")
-    except Exception as e:
-        logger.error(f"Ошибка получения статуса: {e}")
-        await update.message.reply_text("❌ Ошибка соединения с сервисом")
-
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик текстовых сообщений"""
-    if not update.message or not update.message.text:
-        return
-
-    user_id = update.effective_user.id
-    chat_id = update.message.chat_id
-    message_text = update.message.text
-    username = update.effective_user.username
-
-    logger.info(
-        f"Получено сообщение от {user_id} (@{username}): {message_text}")
-
-    # Показываем, что бот печатает
-    await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-
+deduplicator = UpdateDeduplicator(WEBHOOK_DEDUP_SIZE, WEBHOOK_DEDUP_TTL)
+# Обновления идут через PTB-приложение бота: валидатор, RAG, история
+# и очереди чатов те же, что при polling
+webhook_workers = WebhookWorkers(
+    bot_runtime.process_update,
+    workers=WEBHOOK_WORKERS, max_queue=WEBHOOK_MAX_QUEUE)
+ack_latency = AckLatency()
+webhook_counters = {
+    "duplicates": 0, "unauthorized": 0, "invalid": 0,
+    "forwarded": 0, "forward_failures": 0}
+
+
+async def forward_update(chat_id: int, data: Dict[str, Any]) -> bool:
+    """Передать обновление реплике-владельцу чата"""
+    url = f"{replica_ring.owner_url(chat_id)}/api/telegram_bot/webhook"
+    headers = {FORWARDED_HEADER: str(replica_ring.index)}
+    if WEBHOOK_SECRET:
+        headers[SECRET_HEADER] = WEBHOOK_SECRET
     try:
-        # Отправляем запрос к микросервису обработки сообщений
-        import requests
-
-        message_data = {
-            "chat_id": chat_id,
-            "user_id": user_id,
-            "message_text": message_text,
-            "username": username
-        }
-
-        response = requests.post(
-            f"{TELEGRAM_SERVICE_URL}/",
-            json=message_data,
-            timeout=30
-        )
-
-        if response.status_code == 200:
-            result = response.json()
-            await update.message.reply_text(
-                result["response_text"],
-                parse_mode=result.get("parse_mode", "HTML")
-            )
-        else:
-            logger.error(f"Ошибка микросервиса: {response.status_code}")
-            await update.message.reply_text("❌ Ошибка обработки сообщения")
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка соединения с микросервисом: {e}")
-        await update.message.reply_text("❌ Ошибка соединения с сервисом")
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка: {e}")
-        await update.message.reply_text("❌ Произошла внутренняя ошибка")
-
-
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик ошибок"""
-    logger.error(f"Ошибка при обработке обновления: {context.error}")
-    if update and update.effective_message:
-        await update.effective_message.reply_text(
-            "❌ Произошла ошибка при обработке сообщения"
-        )
+        resp = await http_clients.get("replicas").post(
+            url, json=data, headers=headers,
+            timeout=httpx.Timeout(5, connect=1))
+    except httpx.HTTPError as e:
+        logger.error("Forward to %s failed: %s", url, e)
+        return False
+    if resp.status_code != 200:
+        logger.error("Forward to %s failed: %s", url, resp.status_code)
+        return False
+    return True
 
 
 @router.post("/webhook")
 async def webhook(request: Request):
-    """Webhook для получения обновлений от Telegram"""
+    """
+    Webhook для получения обновлений от Telegram.
+    Отвечает сразу, обработка идёт в воркерах.
+    """
+    t0 = time.perf_counter()
+    if not verify_secret(WEBHOOK_SECRET, request.headers.get(SECRET_HEADER)):
+        webhook_counters["unauthorized"] += 1
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+
     try:
         data = await request.json()
-        update = Update.de_json(data, get_bot())
-
-        if update:
-            # Обрабатываем обновление
-            if update.message:
-                if update.message.text:
-                    if update.message.text.startswith('/'):
-                        # Обработка команд
-                        if update.message.text.startswith('/start'):
-                            await start_command(update, None)
-                        elif update.message.text.startswith('/help'):
-                            await help_command(update, None)
-                        elif update.message.text.startswith('/status'):
-                            await status_command(update, None)
-                    else:
-                        # Обработка обычных сообщений
-                        await handle_message(update, None)
-
-        return {"status": "ok"}
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        webhook_counters["invalid"] += 1
+        raise HTTPException(status_code=400, detail="Invalid update")
+
+    update_id = data.get("update_id")
+    if update_id is not None and deduplicator.seen(update_id):
+        # Повторная доставка: Telegram не дождался прошлого ответа
+        webhook_counters["duplicates"] += 1
+        return {"status": "duplicate"}
+
+    chat_id = update_chat_id(data)
+    if (not replica_ring.is_local(chat_id)
+            and FORWARDED_HEADER not in request.headers):
+        # Чат принадлежит другой реплике: там его очередь и кэш истории
+        if not await forward_update(chat_id, data):
+            webhook_counters["forward_failures"] += 1
+            if update_id is not None:
+                deduplicator.forget(update_id)
+            raise HTTPException(
+                status_code=503,
+                detail="Replica is unavailable",
+                headers={"Retry-After": "1"})
+        webhook_counters["forwarded"] += 1
+        ack_latency.record(time.perf_counter() - t0)
+        return {"status": "forwarded"}
+
+    if not webhook_workers.submit(data):
+        # Telegram доставит обновление повторно
+        if update_id is not None:
+            deduplicator.forget(update_id)
+        logger.warning("Webhook queue is full, update %s rejected", update_id)
+        raise HTTPException(
+            status_code=503,
+            detail="Webhook queue is full",
+            headers={"Retry-After": "1"})
+
+    traffic_recorder.record_update(data, "w")
+    ack_latency.record(time.perf_counter() - t0)
+    return {"status": "ok"}
 
-    except Exception as e:
-        logger.error(f"Ошибка в webhook: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/webhook-metrics")
+async def get_webhook_metrics():
+    """Метрики приёма webhook-обновлений"""
+    return {
+        "ack_latency": ack_latency.metrics(),
+        "workers": webhook_workers.metrics(),
+        "dedup_window": len(deduplicator),
+        **webhook_counters,
+    }
 
 
 @router.get("/set-webhook")
@@ -169,11 +157,19 @@ async def set_webhook():
     if not WEBHOOK_URL:
         raise HTTPException(status_code=500, detail="WEBHOOK_URL not set")
 
+    if bot_runtime.polling:
+        # Иначе getUpdates начнёт получать Conflict
+        raise HTTPException(
+            status_code=409,
+            detail="Bot is polling; restart with BOT_INGESTION=webhook")
+
     try:
         bot = get_bot()
         webhook_url = f"{WEBHOOK_URL}/api/telegram_bot/webhook"
 
-        result = await bot.set_webhook(url=webhook_url)
+        result = await bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET or None)
 
         if result:
             return {
@@ -190,8 +186,7 @@ async def set_webhook():
         logger.error(f"Ошибка установки webhook: {e}")
         raise HTTPException(
             status_code=500,
-            detail=f"Error setting webhook: {
-                str(e)}")
+            detail=f"Error setting webhook: {e}")
 
 
 @router.get("/delete-webhook")
@@ -220,8 +215,7 @@ async def delete_webhook():
         logger.error(f"Ошибка удаления webhook: {e}")
         raise HTTPException(
             status_code=500,
-            detail=f"Error deleting webhook: {
-                str(e)}")
+            detail=f"Error deleting webhook: {e}")
 
 
 @router.get("/webhook-info")
@@ -253,5 +247,4 @@ async def get_webhook_info():
         logger.error(f"Ошибка получения информации о webhook: {e}")
         raise HTTPException(
             status_code=500,
-            detail=f"Error getting webhook info: {
-                str(e)}")
+            detail=f"Error getting webhook info: {e}")
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Привязка чатов к репликам бота.
+
+BOT_REPLICAS — базовые URL всех реплик через запятую (одинаковый список
+на каждой), BOT_REPLICA_INDEX — номер текущей. Владелец чата выбирается
+rendezvous-хешированием по chat_id: порядок сообщений и локальный кэш
+истории чата живут на одной реплике, а при добавлении реплики
+переезжает только ~1/N чатов.
+"""
+import hashlib
+import os
+from typing import List, Optional
+
+# Заголовок пересланного между репликами обновления: не пересылать снова
+FORWARDED_HEADER = "X-Bot-Replica-Forwarded"
+
+
+def _score(replica: str, chat_id: int) -> int:
+    digest = hashlib.blake2b(
+        f"{replica}|{chat_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ReplicaRing:
+    def __init__(self, replicas: List[str], index: int = 0) -> None:
+        self.replicas = [r.rstrip("/") for r in replicas if r.strip()]
+        self.index = index
+        if self.replicas and not 0 <= index < len(self.replicas):
+            raise ValueError(
+                f"BOT_REPLICA_INDEX={index} вне списка из "
+                f"{len(self.replicas)} реплик")
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.replicas) > 1
+
+    def owner(self, chat_id: int) -> int:
+        if not self.enabled:
+            return self.index
+        return max(range(len(self.replicas)),
+                   key=lambda i: _score(self.replicas[i], chat_id))
+
+    def is_local(self, chat_id: Optional[int]) -> bool:
+        return chat_id is None or self.owner(chat_id) == self.index
+
+    def owner_url(self, chat_id: int) -> str:
+        return self.replicas[self.owner(chat_id)]
+
+
+replica_ring = ReplicaRing(
+    os.getenv("BOT_REPLICAS", "").split(","),
+    int(os.getenv("BOT_REPLICA_INDEX", "0")),
+)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище состояния бота, общее для реплик.
+
+STATE_BACKEND_URL выбирает реализацию:
+    memory://                — словарь в памяти процесса (по умолчанию)
+    redis://[:pass@]host:port/db — любой сервер с протоколом Redis (RESP)
+
+Клиент RESP минимальный (GET/SET EX/DEL/PING) и не тянет зависимостей;
+в тестах и нагрузочном прогоне его место занимает локальный сервер-заглушка
+(benchmarks/multi_replica.py). Ошибки сети превращаются в
+StateBackendError — вызывающий решает, можно ли работать дальше на
+локальном состоянии.
+"""
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackendError(Exception):
+    """Хранилище состояния недоступно или вернуло ошибку"""
+
+
+class StateBackend(ABC):
+    # Видят ли состояние другие процессы
+    shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Значение ключа или None"""
+
+    @abstractmethod
+    async def set(
+            self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """Запись значения; ttl — срок жизни в секундах"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Удаление ключа (отсутствующий ключ — не ошибка)"""
+
+    async def aclose(self) -> None:
+        pass
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"backend": type(self).__name__, "shared": self.shared}
+
+
+class MemoryBackend(StateBackend):
+    def __init__(self) -> None:
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    async def set(
+            self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (value, expires_at)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**super().metrics(), "keys": len(self._data)}
+
+
+def encode_command(*args: Any) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        raise StateBackendError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        size = int(body)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(body)
+        if size < 0:
+            return None
+        return [await read_reply(reader) for _ in range(size)]
+    raise StateBackendError(f"unexpected reply: {line!r}")
+
+
+class _Connection:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+
+class RespBackend(StateBackend):
+    """Клиент Redis-протокола с небольшим пулом соединений"""
+    shared = True
+
+    def __init__(
+            self,
+            host: str = "localhost",
+            port: int = 6379,
+            db: int = 0,
+            password: Optional[str] = None,
+            pool_size: int = 8,
+            timeout: float = 1.0) -> None:
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._idle: List[_Connection] = []
+        self._slots = asyncio.Semaphore(pool_size)
+        self._commands = 0
+        self._errors = 0
+
+    async def _connect(self) -> _Connection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        conn = _Connection(reader, writer)
+        try:
+            if self.password:
+                await self._roundtrip(conn, "AUTH", self.password)
+            if self.db:
+                await self._roundtrip(conn, "SELECT", self.db)
+        except BaseException:
+            # Отказ AUTH/SELECT или отмена: сокет в пул не попадёт
+            writer.close()
+            raise
+        return conn
+
+    @staticmethod
+    async def _roundtrip(conn: _Connection, *args: Any) -> Any:
+        conn.writer.write(encode_command(*args))
+        await conn.writer.drain()
+        return await read_reply(conn.reader)
+
+    async def execute(self, *args: Any) -> Any:
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            try:
+                if conn is None:
+                    conn = await asyncio.wait_for(
+                        self._connect(), self.timeout)
+                result = await asyncio.wait_for(
+                    self._roundtrip(conn, *args), self.timeout)
+            except StateBackendError:
+                # Ошибка команды: соединение исправно. Ошибка AUTH/SELECT
+                # приходит без соединения — его уже закрыл _connect
+                self._errors += 1
+                if conn is not None:
+                    self._idle.append(conn)
+                raise
+            except (OSError, ConnectionError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError) as e:
+                self._errors += 1
+                if conn is not None:
+                    conn.writer.close()
+                raise StateBackendError(
+                    f"{self.host}:{self.port}: {e!r}") from e
+            except BaseException:
+                # Отмена посреди ответа: соединение в неизвестном состоянии
+                if conn is not None:
+                    conn.writer.close()
+                raise
+            self._commands += 1
+            self._idle.append(conn)
+            return result
+
+    async def ping(self) -> bool:
+        return await self.execute("PING") == "PONG"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.execute("GET", key)
+
+    async def set(
+            self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if ttl:
+            await self.execute("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            await self.execute("SET", key, value)
+
+    async def delete(self, key: str) -> None:
+        await self.execute("DEL", key)
+
+    async def aclose(self) -> None:
+        for conn in self._idle:
+            conn.writer.close()
+        self._idle.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **super().metrics(),
+            "address": f"{self.host}:{self.port}/{self.db}",
+            "idle_connections": len(self._idle),
+            "commands": self._commands,
+            "errors": self._errors,
+        }
+
+
+def make_backend(url: str) -> StateBackend:
+    parsed = urlparse(url or "memory://")
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "redis":
+        db = parsed.path.strip("/")
+        return RespBackend(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=parsed.password,
+        )
+    raise ValueError(f"Unknown state backend: {url}")
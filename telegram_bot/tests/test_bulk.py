@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+/bulk: элемент пакета проходит конвейер бота (валидатор, RAG, системный
+промпт) без истории и встаёт в справедливую очередь с весом пакета.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot_app  # noqa: E402
+from admission import AdmissionController  # noqa: E402
+from routers import telegram_bot_routers as routers  # noqa: E402
+
+
+def run_item(allowed=True, history=()):
+    calls = []
+
+    def handler(request):
+        body = json.loads(request.content or b"{}")
+        calls.append((request.url.path, body))
+        if request.url.path == "/api/val":
+            return httpx.Response(200, json={"is_allowed": allowed})
+        if request.url.path == "/api/rag":
+            return httpx.Response(200, json={"context": "Статья 1."})
+        if request.url.path.startswith("/api/llm_agent"):
+            return httpx.Response(200, json={"gen_text": "Ответ Сола."})
+        # Модерация LLM: ошибка — не блокировка
+        return httpx.Response(500)
+
+    async def scenario():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        original_get = bot_app.http_clients.get
+
+        async def token():
+            return "token"
+        bot_app.http_clients.get = lambda name: client
+        bot_app.iam_tokens.aget_token = token
+        try:
+            for role, text in history:
+                bot_app.yandex_bot.history.append(7, role, text)
+            line = json.dumps({"id": "a", "chat_id": 7, "user_id": 3,
+                               "message_text": "Что такое закон?"})
+            return await routers._bulk_item(0, line, time.perf_counter())
+        finally:
+            bot_app.http_clients.get = original_get
+            # Убираем подмену с экземпляра — снова виден метод класса
+            del bot_app.iam_tokens.aget_token
+            await client.aclose()
+    return asyncio.run(scenario()), calls
+
+
+def test_bulk_item_runs_bot_pipeline():
+    # RAG готов: цепь замкнута, как после успешной проверки /ready
+    bot_app.rag_breaker.reset()
+    bot_app.yandex_bot.history.start(7, bot_app.yandex_bot.system_prompt.ref)
+    result, calls = run_item(history=[("user", "прежний вопрос"),
+                                      ("assistant", "прежний ответ")])
+    assert result["status"] == "ok"
+    assert result["response_text"] == "Ответ Сола."
+    paths = [path for path, _ in calls]
+    assert "/api/val" in paths and "/api/rag" in paths
+    llm_request = next(body for path, body in calls
+                       if path.startswith("/api/llm_agent"))
+    messages = llm_request["payload"]["messages"]
+    # Системный промпт Сола, контекст RAG в ходе, история чата не видна
+    assert messages[0] == {
+        "role": "system", "text": bot_app.yandex_bot.system_prompt.text}
+    assert len(messages) == 2 and "Статья 1." in messages[1]["text"]
+    assert {"admission_ms", "validate_ms", "generate_ms"} <= set(
+        result["timings"])
+    # Ответ пакета в историю чата не пишется
+    assert len(bot_app.yandex_bot.history.messages(7)) == 2
+
+
+def test_bulk_item_blocked_by_validator():
+    result, calls = run_item(allowed=False)
+    assert result["status"] == "blocked"
+    assert not any(path.startswith("/api/llm_agent") for path, _ in calls)
+
+
+def test_bulk_flow_does_not_starve_chats():
+    admission = AdmissionController(initial_limit=1, min_limit=1, max_limit=1)
+    order = []
+
+    async def job(name, flow, weight):
+        async with admission.slot(flow=flow, weight=weight):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        holder = asyncio.create_task(job("first", 1, 1.0))
+        await asyncio.sleep(0)
+        bulk = [asyncio.create_task(job(f"bulk{i}", routers.BULK_FLOW,
+                                        routers.BULK_FAIR_WEIGHT))
+                for i in range(8)]
+        await asyncio.sleep(0)
+        chat = asyncio.create_task(job("chat", 2, 1.0))
+        await asyncio.gather(holder, chat, *bulk)
+    asyncio.run(scenario())
+    # Чат, пришедший после восьми элементов пакета, не ждёт их всех
+    assert order.index("chat") <= 2
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chat_queue import ChatQueues  # noqa: E402
+
+
+def test_pending_is_capped_per_chat():
+    async def scenario():
+        turns = []
+        release = asyncio.Event()
+
+        async def handler(chat_id, batch):
+            turns.append((chat_id, list(batch)))
+            await release.wait()
+
+        queues = ChatQueues(handler, coalesce_window=0, max_batch=2,
+                            max_pending=3)
+        accepted = [queues.submit(1, i) for i in range(10)]
+        # Первый ход забирает пачку, в очереди снова есть место
+        await asyncio.sleep(0)
+        accepted += [queues.submit(1, i) for i in range(10, 15)]
+        accepted.append(queues.submit(2, "other"))
+        release.set()
+        await queues.drain(1)
+        return accepted, turns, queues.metrics()
+
+    accepted, turns, metrics = asyncio.run(scenario())
+    assert accepted[:3] == [True] * 3 and not any(accepted[3:10])
+    assert accepted[10:12] == [True, True] and not any(accepted[12:15])
+    assert accepted[-1] is True
+    delivered = [m for chat, batch in turns if chat == 1 for m in batch]
+    assert delivered == [0, 1, 2, 10, 11]
+    assert metrics["dropped"] == 10
+    assert metrics["received"] == 16
+    assert metrics["pending_messages"] == 0
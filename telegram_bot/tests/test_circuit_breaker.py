@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+CircuitBreaker и rag_pipeline: ошибки и таймауты размыкают цепь,
+отменённые вызовы — нет.
+"""
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot_app  # noqa: E402
+from circuit_breaker import (  # noqa: E402
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker)
+
+
+def test_failures_open_and_success_resets():
+    breaker = CircuitBreaker("t", failure_threshold=3, initial_state=CLOSED)
+    breaker.record(0.1, ok=False, error="HTTP 500")
+    breaker.record(0.1, ok=False, error="HTTP 500")
+    breaker.record(0.1)
+    breaker.record(0.1, ok=False, error="HTTP 500")
+    assert breaker.state == CLOSED
+    breaker.record(5.0)  # медленный ответ — ошибка
+    breaker.record(0.1, ok=False, error="timeout")
+    assert breaker.state == OPEN and breaker.reason == "timeout"
+    assert not breaker.allow()
+
+
+def test_cancel_frees_half_open_trial():
+    breaker = CircuitBreaker("t")
+    breaker.probe(True)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() and not breaker.allow()
+    breaker.cancel()
+    # Отменённая проба не размыкает цепь и не занимает слот навсегда
+    assert breaker.state == HALF_OPEN and breaker.allow()
+
+
+def rag_calls(handler, calls, cancel_after=None):
+    async def scenario():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        original = bot_app.http_clients.get
+        bot_app.http_clients.get = lambda name: client
+        try:
+            for _ in range(calls):
+                task = asyncio.create_task(bot_app.rag_pipeline("вопрос"))
+                if cancel_after is None:
+                    await task
+                    continue
+                await asyncio.sleep(cancel_after)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        finally:
+            bot_app.http_clients.get = original
+            await client.aclose()
+    bot_app.rag_breaker.reset()
+    asyncio.run(scenario())
+    return bot_app.rag_breaker
+
+
+def test_cancelled_rag_calls_keep_circuit_closed():
+    async def hang(request):
+        await asyncio.sleep(10)
+        return httpx.Response(200, json={"context": "поздно"})
+    breaker = rag_calls(
+        hang, bot_app.rag_breaker.failure_threshold, cancel_after=0.01)
+    assert breaker.state == CLOSED
+    assert breaker.metrics()["consecutive_failures"] == 0
+
+
+def test_rag_timeouts_open_circuit():
+    def timeout(request):
+        raise httpx.ReadTimeout("slow", request=request)
+    breaker = rag_calls(timeout, bot_app.rag_breaker.failure_threshold)
+    assert breaker.state == OPEN and breaker.reason == "timeout"
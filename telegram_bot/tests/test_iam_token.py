@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+IAMTokenManager против медленной заглушки IAM.
+
+    cd telegram_bot && python -m pytest -q tests
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+sys.path.insert(0, os.path.join(HERE, ".."))
+from e2e_load import private_key_pem  # noqa: E402
+from fakes import FakeIAM, LatencyModel  # noqa: E402
+from iam_token import EXPIRY_SKEW, IAMTokenManager  # noqa: E402
+
+PRIVATE_KEY = private_key_pem()
+
+
+def manager(iam: FakeIAM, **kwargs) -> IAMTokenManager:
+    return IAMTokenManager("sa-id", "key-id", PRIVATE_KEY,
+                           iam_url=iam.tokens_url, **kwargs)
+
+
+def test_concurrent_callers_share_one_refresh():
+    async def scenario():
+        iam = FakeIAM(LatencyModel("0.3"))
+        await iam.start()
+        try:
+            tokens = manager(iam)
+            results = await asyncio.gather(
+                *(tokens.aget_token() for _ in range(50)))
+            # Второй заход — из кэша, без обращения к IAM
+            results.append(await tokens.aget_token())
+            return results, iam.calls["tokens"], tokens.metrics()
+        finally:
+            await iam.stop()
+
+    results, calls, metrics = asyncio.run(scenario())
+    assert calls == 1
+    assert len(set(results)) == 1
+    assert metrics["refreshes"] == 1
+    assert metrics["failures"] == 0
+
+
+def test_cold_burst_uses_one_thread():
+    async def scenario():
+        iam = FakeIAM(LatencyModel("0.3"))
+        await iam.start()
+        try:
+            tokens = manager(iam)
+            threads = []
+            get_token = tokens.get_token
+
+            def counted():
+                threads.append(threading.get_ident())
+                return get_token()
+            tokens.get_token = counted
+            waiters = [asyncio.create_task(tokens.aget_token())
+                       for _ in range(50)]
+            await asyncio.sleep(0.05)
+            # Отменённый ожидающий не срывает обновление остальным
+            waiters[0].cancel()
+            results = await asyncio.gather(
+                *waiters[1:], return_exceptions=True)
+            return threads, results, iam.calls["tokens"]
+        finally:
+            await iam.stop()
+
+    threads, results, calls = asyncio.run(scenario())
+    assert len(threads) == 1
+    assert calls == 1
+    assert all(isinstance(r, str) for r in results)
+    assert len(set(results)) == 1
+
+
+def test_background_refresh_happens_before_expiry():
+    # Токен живёт EXPIRY_SKEW + 3 секунды, обновление — за
+    # EXPIRY_SKEW + 2 до конца, то есть примерно через секунду
+    lifetime = EXPIRY_SKEW + 3
+
+    async def scenario():
+        iam = FakeIAM(LatencyModel("0.2"), lifetime=lifetime)
+        await iam.start()
+        tokens = manager(iam, refresh_margin=EXPIRY_SKEW + 2)
+        try:
+            tokens.start()
+            seen = []
+            misses = 0
+            deadline = time.monotonic() + 3
+            while time.monotonic() < deadline:
+                token = tokens.peek()
+                if token is None:
+                    misses += bool(seen)
+                elif not seen or seen[-1] != token:
+                    seen.append(token)
+                await asyncio.sleep(0.02)
+            return seen, misses, iam.calls["tokens"]
+        finally:
+            await asyncio.to_thread(tokens.stop)
+            await iam.stop()
+
+    seen, misses, calls = asyncio.run(scenario())
+    assert calls >= 2
+    assert len(seen) >= 2
+    # После первого токена кэш ни разу не пустел: замена приходит
+    # раньше, чем старый токен истекает
+    assert misses == 0
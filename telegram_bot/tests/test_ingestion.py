@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Режим приёма обновлений: задаётся BOT_INGESTION, а не числом реплик;
+запись трафика в обработчике PTB — только при polling.
+"""
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot_app  # noqa: E402
+from sharding import ReplicaRing  # noqa: E402
+
+
+def mode(monkeypatch, ingestion="", webhook_url="", replicas=()):
+    monkeypatch.setattr(bot_app, "BOT_INGESTION", ingestion)
+    monkeypatch.setattr(bot_app, "replica_ring", ReplicaRing(list(replicas)))
+    if webhook_url:
+        monkeypatch.setenv("WEBHOOK_URL", webhook_url)
+    else:
+        monkeypatch.delenv("WEBHOOK_URL", raising=False)
+    return bot_app.ingestion_mode()
+
+
+def test_single_replica_can_use_webhook(monkeypatch):
+    assert mode(monkeypatch) == "polling"
+    assert mode(monkeypatch, ingestion="webhook") == "webhook"
+    assert mode(monkeypatch, webhook_url="https://bot.example") == "webhook"
+    assert mode(monkeypatch, ingestion="polling",
+                webhook_url="https://bot.example") == "polling"
+
+
+def test_replicas_always_use_webhook(monkeypatch):
+    replicas = ("http://a:9999", "http://b:9999")
+    assert mode(monkeypatch, replicas=replicas) == "webhook"
+    assert mode(monkeypatch, ingestion="polling",
+                replicas=replicas) == "webhook"
+
+
+def test_unknown_mode_is_detected(monkeypatch):
+    assert mode(monkeypatch, ingestion="sse") == "polling"
+
+
+def test_capture_handler_only_when_polling(monkeypatch):
+    monkeypatch.setattr(bot_app, "TELEGRAM_TOKEN", "123:TEST")
+    monkeypatch.setattr(bot_app.traffic_recorder, "path", "capture.jsonl")
+
+    def capture_groups(capture):
+        app = bot_app.build_application(capture=capture)
+        return [h.callback for h in app.handlers.get(-1, [])]
+    assert capture_groups(True) == [bot_app.capture_update]
+    # Webhook записывает обновление при приёме — второй записи нет
+    assert capture_groups(False) == []
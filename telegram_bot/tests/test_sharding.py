@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+ReplicaRing: у чата один владелец на всех репликах, новая реплика
+забирает около 1/N чатов.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharding import ReplicaRing  # noqa: E402
+
+REPLICAS = ["http://a:9999", "http://b:9999", "http://c:9999/"]
+
+
+def test_single_replica_owns_everything():
+    ring = ReplicaRing([""])
+    assert not ring.enabled
+    assert all(ring.is_local(chat) for chat in range(100))
+
+
+def test_replicas_agree_on_owner():
+    rings = [ReplicaRing(REPLICAS, i) for i in range(len(REPLICAS))]
+    for chat in range(1000):
+        owners = {ring.owner(chat) for ring in rings}
+        assert len(owners) == 1
+        assert sum(ring.is_local(chat) for ring in rings) == 1
+    assert rings[0].owner_url(7) in [r.rstrip("/") for r in REPLICAS]
+    # Обновление без чата обрабатывает любая реплика
+    assert all(ring.is_local(None) for ring in rings)
+
+
+def test_adding_replica_moves_about_one_nth():
+    chats = range(3000)
+    before = ReplicaRing(REPLICAS)
+    after = ReplicaRing(REPLICAS + ["http://d:9999"])
+    moved = [c for c in chats if before.owner(c) != after.owner(c)]
+    # Переезжают только чаты новой реплики
+    assert all(after.owner(c) == 3 for c in moved)
+    assert 0.15 < len(moved) / len(chats) < 0.35
+
+
+def test_index_outside_list_is_rejected():
+    with pytest.raises(ValueError):
+        ReplicaRing(REPLICAS, 3)
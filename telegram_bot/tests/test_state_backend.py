@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+RespBackend против локального сервера RESP и HistorySync поверх него.
+"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from history_store import HistoryStore, HistorySync  # noqa: E402
+from state_backend import (  # noqa: E402
+    RespBackend, StateBackendError, make_backend, read_reply)
+
+
+class RespServer:
+    """GET, SET [PX], DEL, PING, SELECT и AUTH с паролем"""
+
+    def __init__(self, password=None) -> None:
+        self.password = password
+        self.data = {}
+        self.connections = 0
+        self.open = 0
+        self.port = 0
+        self._server = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(
+            self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _execute(self, args, state):
+        cmd = args[0].upper()
+        if cmd == b"AUTH":
+            state["auth"] = args[1].decode() == self.password
+            return b"+OK\r\n" if state["auth"] else b"-WRONGPASS\r\n"
+        if self.password and not state["auth"]:
+            return b"-NOAUTH Authentication required\r\n"
+        if cmd in (b"PING", b"SELECT"):
+            return b"+PONG\r\n" if cmd == b"PING" else b"+OK\r\n"
+        if cmd == b"GET":
+            value, expires = self.data.get(args[1], (None, None))
+            if value is None or (expires and expires <= time.monotonic()):
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if cmd == b"SET":
+            expires = (time.monotonic() + int(args[4]) / 1000
+                       if len(args) >= 5 else None)
+            self.data[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if cmd == b"DEL":
+            return b":%d\r\n" % (self.data.pop(args[1], None) is not None)
+        return b"-ERR unknown command\r\n"
+
+    async def _serve(self, reader, writer) -> None:
+        self.connections += 1
+        self.open += 1
+        state = {"auth": False}
+        try:
+            while True:
+                args = await read_reply(reader)
+                writer.write(self._execute(args, state))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.open -= 1
+            writer.close()
+
+
+def test_commands_reuse_one_connection():
+    async def scenario():
+        async with RespServer(password="secret") as server:
+            backend = make_backend(
+                f"redis://:secret@127.0.0.1:{server.port}/1")
+            assert isinstance(backend, RespBackend) and backend.db == 1
+            await backend.set("k", b"v")
+            await backend.set("ttl", b"x", ttl=0.05)
+            assert await backend.get("k") == b"v"
+            assert await backend.ping()
+            await asyncio.sleep(0.1)
+            assert await backend.get("ttl") is None
+            await backend.delete("k")
+            assert await backend.get("k") is None
+            with pytest.raises(StateBackendError):
+                await backend.execute("NOPE")
+            # Ошибка команды не портит соединение
+            assert await backend.ping()
+            assert server.connections == 1
+            await backend.aclose()
+    asyncio.run(scenario())
+
+
+def test_auth_failure_does_not_leak_connection():
+    async def scenario():
+        async with RespServer(password="secret") as server:
+            backend = RespBackend("127.0.0.1", server.port, password="wrong")
+            for _ in range(3):
+                with pytest.raises(StateBackendError):
+                    await backend.get("k")
+            assert backend.metrics()["idle_connections"] == 0
+            await backend.aclose()
+            await asyncio.sleep(0.05)
+            assert server.open == 0
+    asyncio.run(scenario())
+
+
+def test_unreachable_server_is_backend_error():
+    async def scenario():
+        async with RespServer() as server:
+            port = server.port
+        backend = RespBackend("127.0.0.1", port, timeout=0.5)
+        with pytest.raises(StateBackendError):
+            await backend.get("k")
+        await backend.aclose()
+    asyncio.run(scenario())
+
+
+def test_history_sync_restores_chat_on_another_store():
+    async def scenario():
+        async with RespServer() as server:
+            url = f"redis://127.0.0.1:{server.port}/0"
+            first, second = HistoryStore(), HistoryStore()
+            sync_a = HistorySync(first, make_backend(url))
+            sync_b = HistorySync(second, make_backend(url))
+            first.start(5, "saul")
+            first.append(5, "user", "вопрос")
+            first.append(5, "assistant", "ответ")
+            await sync_a.save(5)
+
+            assert await sync_b.load(5)
+            assert second.system_ref(5) == "saul"
+            assert [m.text for m in second.messages(5)] == ["вопрос", "ответ"]
+            # Чат уже есть локально — хранилище не читается
+            assert not await sync_b.load(5)
+
+            await sync_a.delete(5)
+            assert not await HistorySync(
+                HistoryStore(), sync_b.backend).load(5)
+            await sync_a.backend.aclose()
+            await sync_b.backend.aclose()
+    asyncio.run(scenario())
+
+
+def test_history_sync_survives_backend_outage():
+    async def scenario():
+        async with RespServer() as server:
+            port = server.port
+        history = HistoryStore()
+        sync = HistorySync(
+            history, RespBackend("127.0.0.1", port, timeout=0.5))
+        history.start(1, None)
+        history.append(1, "user", "вопрос")
+        await sync.save(1)
+        assert not await sync.load(2)
+        assert sync.metrics()["errors"] == 2
+        await sync.backend.aclose()
+    asyncio.run(scenario())
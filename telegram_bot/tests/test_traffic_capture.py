@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from traffic_capture import scrub  # noqa: E402
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Меня зовут Иванов Иван, живу ул. Ленина д. 5 кв 12",
+     "Меня зовут <NAME>, живу <ADDRESS>"),
+    ("ФИО: Петров П.П., адрес: проспект Мира 10, кв. 3",
+     "ФИО: <NAME>, адрес: <ADDRESS>"),
+    ("Сосед Сидоров Пётр Алексеевич залил квартиру",
+     "Сосед <NAME> залил квартиру"),
+    ("Подписал И.И. Иванов, дом 7 корп. 2",
+     "Подписал <NAME>, <ADDRESS>"),
+    ("Москва, ул. Большая Садовая, 10", "Москва, <ADDRESS>"),
+    ("Позвоните 8 (912) 345-67-89 или пишите на a@b.ru",
+     "Позвоните <PHONE> или пишите на <EMAIL>"),
+])
+def test_scrub_removes_pii(text, expected):
+    assert scrub(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Какие документы нужны для расторжения брака через суд?",
+    "Площадь квартиры 50 кв. м, в доме 7 этажей",
+    "Статья 5 Гражданского кодекса, срок 3 года",
+    "Работодатель задерживает зарплату второй месяц. Куда жаловаться?",
+])
+def test_scrub_keeps_questions(text):
+    assert scrub(text) == text
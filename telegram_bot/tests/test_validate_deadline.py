@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+validate_with_service: исчерпанный бюджет — DeadlineExceeded,
+ошибки валидатора — отказ.
+"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bot_app  # noqa: E402
+from deadline import Deadline, DeadlineExceeded  # noqa: E402
+
+
+def validate(handler, deadline):
+    async def scenario():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        original = bot_app.http_clients.get
+        bot_app.http_clients.get = lambda name: client
+        try:
+            return await bot_app.validate_with_service(
+                "вопрос", "token", "folder", deadline)
+        finally:
+            bot_app.http_clients.get = original
+            await client.aclose()
+    return asyncio.run(scenario())
+
+
+def test_allowed():
+    assert validate(lambda r: httpx.Response(200, json={"is_allowed": True}),
+                    Deadline.after(30))
+
+
+def test_validator_504_is_deadline():
+    with pytest.raises(DeadlineExceeded):
+        validate(lambda r: httpx.Response(504), Deadline.after(30))
+
+
+def test_timeout_on_budget_is_deadline():
+    def handler(request):
+        raise httpx.ReadTimeout("slow", request=request)
+    with pytest.raises(DeadlineExceeded):
+        validate(handler, Deadline.after(1))
+
+
+def test_validator_errors_fail_closed():
+    assert not validate(lambda r: httpx.Response(500), Deadline.after(30))
+
+    def timeout(request):
+        raise httpx.ReadTimeout("slow", request=request)
+    # Таймаут при полном бюджете — сбой валидатора, а не дедлайн
+    assert not validate(timeout, Deadline.after(30))
+
+    def refused(request):
+        raise httpx.ConnectError("refused", request=request)
+    assert not validate(refused, Deadline.after(1))
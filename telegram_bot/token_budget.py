@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Бюджет токенов для истории диалога и статистика размера промптов.
+"""
+import bisect
+from collections import deque
+from typing import Any, Deque, Dict, List, Sequence, Tuple
+
+from history_store import Message
+
+PROMPT_SIZE_BUCKETS = (500, 1000, 2000, 3000, 4000, 6000, 8000)
+
+
+def fit_history(messages: Sequence[Message],
+                budget: int) -> Tuple[List[Message], int]:
+    """
+    Самые свежие сообщения, суммарно укладывающиеся в budget токенов.
+    История всегда начинается с реплики пользователя.
+    Возвращает (сообщения, их токены).
+    """
+    kept: List[Message] = []
+    used = 0
+    for message in reversed(messages):
+        if used + message.tokens > budget:
+            break
+        kept.append(message)
+        used += message.tokens
+    kept.reverse()
+    while kept and kept[0].role != "user":
+        used -= kept.pop(0).tokens
+    return kept, used
+
+
+class PromptSizeStats:
+    """Распределение размера промптов (в оценочных токенах)"""
+
+    def __init__(self, window: int = 1000) -> None:
+        self.buckets = [0] * (len(PROMPT_SIZE_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.trimmed = 0
+        self._recent: Deque[int] = deque(maxlen=window)
+
+    def record(self, tokens: int, trimmed: int = 0) -> None:
+        self.buckets[bisect.bisect_left(PROMPT_SIZE_BUCKETS, tokens)] += 1
+        self.count += 1
+        self.total += tokens
+        self.max = max(self.max, tokens)
+        self.trimmed += trimmed
+        self._recent.append(tokens)
+
+    def percentile(self, q: float) -> int:
+        if not self._recent:
+            return 0
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def metrics(self) -> Dict[str, Any]:
+        labels = [f"<={b}" for b in PROMPT_SIZE_BUCKETS] + [
+            f">{PROMPT_SIZE_BUCKETS[-1]}"]
+        return {
+            "requests": self.count,
+            "avg": round(self.total / self.count, 1) if self.count else 0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max,
+            "trimmed_messages": self.trimmed,
+            "histogram": dict(zip(labels, self.buckets)),
+        }
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная оценка числа токенов без обращения к tokenize API.
+
+Грубая модель BPE-токенизатора YandexGPT: слово дробится на куски
+примерно по 4 символа латиницы или 3 символа кириллицы, каждый знак
+препинания — отдельный токен, перевод строки — токен, пробелы сверх
+одного — по токену на каждые 4.
+"""
+import re
+
+RE_PIECES = re.compile(
+    r"(?P<cyr>[А-Яа-яЁё]+)|(?P<word>\w+)|(?P<nl>\n)|(?P<sp>[ \t]{2,})|(?P<p>[^\w\s])")
+
+
+def estimate_tokens(text: str) -> int:
+    tokens = 0
+    for m in RE_PIECES.finditer(text):
+        kind = m.lastgroup
+        size = m.end() - m.start()
+        if kind == "cyr":
+            tokens += (size + 2) // 3
+        elif kind == "word":
+            tokens += (size + 3) // 4
+        elif kind == "sp":
+            tokens += size // 4 or 1
+        else:
+            tokens += 1
+    return tokens
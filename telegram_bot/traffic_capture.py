@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Запись входящего трафика для воспроизведения в нагрузочных прогонах.
+
+Включается TRAFFIC_CAPTURE_PATH. Каждое текстовое сообщение — строка
+JSON с короткими ключами в файле, открытом на дозапись (.gz — сжатый):
+
+    {"t": 1700000000.123, "c": "3f2a9c01d4e5", "u": "...", "s": "p",
+     "k": "m", "n": 42, "x": "текст без персональных данных"}
+
+t — время получения, c/u — HMAC чата и пользователя (соль
+TRAFFIC_CAPTURE_SALT; без неё — случайная на процесс), s — источник
+(p — polling, w — webhook), k — m сообщение / c команда, n — длина
+исходного текста, x — текст после вычистки PII (только при
+TRAFFIC_CAPTURE_TEXT=true; у команд — сама команда). Запись идёт из
+буфера фоновой задачей; при переполнении события теряются и считаются.
+
+Вычистка — эвристики на регулярных выражениях: контакты, номера
+документов, адреса с маркерами улицы или дома («ул. Ленина д. 5 кв 12»),
+ФИО с отчеством, инициалами или после «меня зовут». Имя без таких
+признаков («пишет Петров») или адрес в свободной форме не распознаются,
+поэтому файл с TRAFFIC_CAPTURE_TEXT=true может содержать персональные
+данные: хранить его нужно как переписку пользователей.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+NAME_WORD = r"[А-ЯЁA-Z][а-яёa-z]+(?:-[А-ЯЁA-Z][а-яёa-z]+)?"
+STREET = (r"(?:ул|улиц[аеуы]|пр-?т|просп(?:ект[аеу]?)?|пер(?:еул(?:ок|ке))?"
+          r"|б-р|бульвар[аеу]?|ш|шоссе|наб(?:ережн(?:ая|ой))?"
+          r"|пл(?:ощад[ьи])?|мкр|микрорайон[аеу]?)")
+HOUSE = r"(?:д\.|дом|кв\.?|квартира|корп\.?|стр\.)\s*\d+[а-яё]?(?!\w)"
+
+# Порядок важен: длинные номера раньше телефонов и общих чисел,
+# адреса и имена — до общих чисел (номера домов и квартир)
+PII_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<EMAIL>"),
+    (re.compile(r"https?://\S+|www\.\S+"), "<URL>"),
+    (re.compile(r"(?<!\w)@\w{4,}"), "<USERNAME>"),
+    (re.compile(r"\b(?:\d[ -]?){15,18}\d\b"), "<CARD>"),
+    (re.compile(r"\b\d{3}-\d{3}-\d{3}[ -]?\d{2}\b"), "<SNILS>"),
+    (re.compile(r"\b\d{10}(?:\d{2})?\b"), "<INN>"),
+    (re.compile(r"\b\d{2}\s?\d{2}\s?№?\s?\d{6}\b"), "<PASSPORT>"),
+    (re.compile(
+        r"(?:\+7|\b8)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}\b"),
+     "<PHONE>"),
+    # «ул. Ленина, д. 5, кв 12», «пр-т Мира 10»
+    (re.compile(
+        rf"\b{STREET}\.?\s+(?:{NAME_WORD}|\d+-?[а-я]*)"
+        rf"(?:\s+{NAME_WORD})*(?:[,\s]+(?:\d+[а-яё]?(?!\w)|{HOUSE}))*"),
+     "<ADDRESS>"),
+    (re.compile(rf"\b{HOUSE}(?:[,\s]+{HOUSE})*"), "<ADDRESS>"),
+    # «меня зовут Иванов Иван», «ФИО: Петров П.П.»
+    (re.compile(
+        rf"((?i:\b(?:меня\s+зовут|мо[её]\s+имя|моя\s+фамилия|фио))[:\s-]+)"
+        rf"{NAME_WORD}(?:\s+(?:{NAME_WORD}|[А-ЯЁ]\.\s?(?:[А-ЯЁ]\.)?)){{0,2}}"),
+     r"\1<NAME>"),
+    # Фамилия Имя Отчество, Фамилия И.О., И.О. Фамилия
+    (re.compile(
+        rf"\b{NAME_WORD}\s+{NAME_WORD}\s+[А-ЯЁ][а-яё]+(?:вич|вна|ична|чна|ич)\b"
+        rf"|\b{NAME_WORD}\s+[А-ЯЁ]\.\s?[А-ЯЁ]\.(?!\s?[А-ЯЁ][а-яё])"
+        rf"|\b[А-ЯЁ]\.\s?[А-ЯЁ]\.\s?{NAME_WORD}"),
+     "<NAME>"),
+    (re.compile(r"\b\d{5,}\b"), "<NUM>"),
+]
+
+
+def scrub(text: str) -> str:
+    for pattern, token in PII_PATTERNS:
+        text = pattern.sub(token, text)
+    return text
+
+
+class TrafficRecorder:
+    def __init__(
+            self,
+            path: str = "",
+            with_text: bool = False,
+            sample: float = 1.0,
+            salt: str = "",
+            flush_interval: float = 1.0,
+            max_buffer: int = 10000) -> None:
+        self.path = path
+        self.with_text = with_text
+        self.sample = sample
+        self._salt = (salt or secrets.token_hex(16)).encode()
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self._buffer: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self._recorded = 0
+        self._dropped = 0
+        self._written = 0
+        self._errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _hash(self, value: Any) -> str:
+        return hmac.new(
+            self._salt, str(value).encode(), hashlib.sha256).hexdigest()[:12]
+
+    def _sampled(self, chat_hash: str) -> bool:
+        # Решение по чату, а не по сообщению: диалоги пишутся целиком
+        return self.sample >= 1 or int(chat_hash[:8], 16) < (
+            self.sample * 0xFFFFFFFF)
+
+    def record(self, chat_id: int, user_id: Optional[int], text: str,
+               source: str) -> None:
+        """Событие в буфер; на пути сообщения — только хеши и regex"""
+        if not self.enabled or not text:
+            return
+        chat_hash = self._hash(chat_id)
+        if not self._sampled(chat_hash):
+            return
+        if len(self._buffer) >= self.max_buffer:
+            self._dropped += 1
+            return
+        command = text.startswith("/")
+        event: Dict[str, Any] = {
+            "t": round(time.time(), 3),
+            "c": chat_hash,
+            "u": self._hash(user_id if user_id is not None else chat_id),
+            "s": source,
+            "k": "c" if command else "m",
+            "n": len(text),
+        }
+        if command:
+            event["x"] = text.split()[0].split("@")[0]
+        elif self.with_text:
+            event["x"] = scrub(text)
+        self._buffer.append(json.dumps(event, ensure_ascii=False))
+        self._recorded += 1
+
+    def record_update(self, data: Dict[str, Any], source: str) -> None:
+        """Сырое обновление Telegram (dict из webhook)"""
+        message = data.get("message") or data.get("edited_message") or {}
+        chat = message.get("chat") or {}
+        if "id" not in chat:
+            return
+        self.record(chat["id"], (message.get("from") or {}).get("id"),
+                    message.get("text") or "", source)
+
+    def _write(self, lines: List[str]) -> None:
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self._written += len(lines)
+        except OSError as e:
+            self._errors += 1
+            self._dropped += len(lines)
+            logger.error("Traffic capture write failed: %s", e)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if self._task is None or self._task.done():
+            logger.info("Traffic capture to %s (text=%s, sample=%.2f)",
+                        self.path, self.with_text, self.sample)
+            self._task = asyncio.create_task(
+                self._run(), name="traffic-capture")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "path": self.path or None,
+            "with_text": self.with_text,
+            "sample": self.sample,
+            "recorded": self._recorded,
+            "written": self._written,
+            "buffered": len(self._buffer),
+            "dropped": self._dropped,
+            "write_errors": self._errors,
+        }
+
+
+traffic_recorder = TrafficRecorder(
+    os.getenv("TRAFFIC_CAPTURE_PATH", ""),
+    # Текст после эвристической вычистки: PII может остаться (см. выше)
+    with_text=os.getenv(
+        "TRAFFIC_CAPTURE_TEXT", "false").lower() in ("1", "true", "yes"),
+    sample=float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1")),
+    salt=os.getenv("TRAFFIC_CAPTURE_SALT", ""),
+)
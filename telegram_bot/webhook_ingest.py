@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Приём webhook-обновлений Telegram: быстрый ack, дедупликация, воркеры.
+
+Эндпоинт только проверяет секрет, отбрасывает повторы по update_id и
+кладёт обновление в очередь — ответ Telegram уходит сразу, медленная
+обработка не вызывает повторных доставок. Воркеров несколько, у
+каждого своя очередь; обновление попадает к воркеру по chat_id, так
+что сообщения одного чата обрабатываются по порядку.
+"""
+import asyncio
+import hmac
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def verify_secret(expected: str, received: Optional[str]) -> bool:
+    """Проверка X-Telegram-Bot-Api-Secret-Token; пустой секрет — без проверки"""
+    if not expected:
+        return True
+    return received is not None and hmac.compare_digest(
+        expected.encode(), received.encode())
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """chat_id из сырого обновления без построения объекта Update"""
+    for key in ("message", "edited_message", "channel_post",
+                "edited_channel_post", "callback_query"):
+        item = data.get(key)
+        if not isinstance(item, dict):
+            continue
+        if key == "callback_query":
+            item = item.get("message") or {}
+        chat = item.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+class UpdateDeduplicator:
+    """Скользящее окно update_id: последние max_size за ttl секунд"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    def seen(self, update_id: int) -> bool:
+        """True, если обновление уже приходило; иначе запоминает его"""
+        now = time.monotonic()
+        while self._seen:
+            oldest, ts = next(iter(self._seen.items()))
+            if now - ts <= self.ttl and len(self._seen) < self.max_size:
+                break
+            del self._seen[oldest]
+        if update_id in self._seen:
+            return True
+        self._seen[update_id] = now
+        return False
+
+    def forget(self, update_id: int) -> None:
+        """Обновление не принято — повторная доставка не дубль"""
+        self._seen.pop(update_id, None)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class WebhookWorkers:
+    def __init__(
+            self,
+            handler: UpdateHandler,
+            workers: int = 8,
+            max_queue: int = 1000) -> None:
+        self._handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+
+        self._queues: List["asyncio.Queue[Dict[str, Any]]"] = []
+        self._tasks: List["asyncio.Task[None]"] = []
+
+        self._accepted = 0
+        self._dropped = 0
+        self._processed = 0
+        self._failures = 0
+
+    def _ensure_started(self) -> None:
+        if self._tasks:
+            return
+        # Очереди создаются внутри работающего event loop
+        per_worker = max(1, self.max_queue // self.workers)
+        self._queues = [
+            asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._run(q), name=f"webhook-worker-{i}")
+            for i, q in enumerate(self._queues)
+        ]
+        logger.info("Webhook workers started: %d", self.workers)
+
+    def submit(self, data: Dict[str, Any]) -> bool:
+        """Поставить обновление в очередь; False — очередь переполнена"""
+        self._ensure_started()
+        chat_id = update_chat_id(data)
+        key = chat_id if chat_id is not None else data.get("update_id", 0)
+        try:
+            self._queues[hash(key) % self.workers].put_nowait(data)
+        except asyncio.QueueFull:
+            self._dropped += 1
+            return False
+        self._accepted += 1
+        return True
+
+    async def _run(self, queue: "asyncio.Queue[Dict[str, Any]]") -> None:
+        while True:
+            data = await queue.get()
+            try:
+                await self._handler(data)
+                self._processed += 1
+            except Exception:
+                self._failures += 1
+                logger.exception(
+                    "Webhook update %s failed", data.get("update_id"))
+            finally:
+                queue.task_done()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    async def drain(self, timeout: float) -> bool:
+        """Дождаться обработки принятых обновлений"""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(q.join() for q in self._queues)), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Webhook drain timeout, %d updates left",
+                           self.queue_depth)
+            return False
+
+    async def aclose(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": bool(self._tasks),
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "accepted": self._accepted,
+            "dropped": self._dropped,
+            "processed": self._processed,
+            "failures": self._failures,
+        }
+
+
+class AckLatency:
+    """Задержка ответа webhook-эндпоинта"""
+
+    def __init__(self, window: int = 1000) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile_ms(self, q: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        value = ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+        return round(value * 1000, 3)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self._samples),
+            "p50_ms": self.percentile_ms(50),
+            "p95_ms": self.percentile_ms(95),
+            "p99_ms": self.percentile_ms(99),
+        }
@@ -1,14 +1,29 @@
 """
 Класс YandexGPTBot для работы с Telegram ботом
 Этот класс будет использоваться в основном сервисе Telegram бота
+
+Асинхронный клиент к HTTP API микросервиса: один httpx.AsyncClient с
+keep-alive пулом, не больше max_concurrency запросов одновременно.
+Идемпотентные вызовы (GET статуса) повторяются с экспоненциальной
+задержкой и полным джиттером при сетевых ошибках и 502/503/504;
+обработка сообщения повторяется, только если соединение не было
+установлено и запрос точно не дошёл до сервиса.
+
+    async with YandexGPTBot() as bot:
+        answers = await bot.process_many(messages, concurrency=32)
 """
 
-import requests
+import asyncio
 import logging
-from typing import Optional
+import random
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
 
 logger = logging.getLogger(__name__)
 
+RETRY_STATUSES = (502, 503, 504)
+
 
 class YandexGPTBot:
     """
@@ -18,15 +33,100 @@ class YandexGPTBot:
     def __init__(
             self,
             telegram_bot_service_url:
-            str = "http://localhost:9999/api/telegram_bot"):
+            str = "http://localhost:9999/api/telegram_bot",
+            max_concurrency: int = 16,
+            retries: int = 3,
+            backoff_base: float = 0.2,
+            backoff_max: float = 5.0,
+            timeout: float = 30.0,
+            status_timeout: float = 10.0,
+            client: Optional[httpx.AsyncClient] = None):
         """
         Инициализация бота
 
         Args:
             telegram_bot_service_url: URL микросервиса Telegram бота
+            max_concurrency: Одновременных запросов и соединений в пуле
+            retries: Повторов после первой попытки
+            backoff_base: Начальная задержка перед повтором, сек
+            backoff_max: Потолок задержки перед повтором, сек
+            timeout: Таймаут обработки сообщения, сек
+            status_timeout: Таймаут запроса статуса, сек
+            client: Готовый httpx.AsyncClient (закрывает владелец)
         """
-        self.telegram_bot_service_url = telegram_bot_service_url
-        self.session = requests.Session()
+        self.telegram_bot_service_url = telegram_bot_service_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.status_timeout = status_timeout
+
+        self._client = client
+        self._own_client = client is None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._calls = 0
+        self._retried = 0
+        self._failed = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=3.05),
+            )
+            self._own_client = True
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._own_client and self._client is not None:
+            await self._client.aclose()
+        self._client = None
+
+    async def __aenter__(self) -> "YandexGPTBot":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    def _backoff(self, attempt: int) -> float:
+        # Полный джиттер: клиенты после общего сбоя не бьют синхронно
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _request(
+            self,
+            method: str,
+            url: str,
+            idempotent: bool,
+            **kwargs) -> httpx.Response:
+        """Запрос через общий пул с ограничением параллелизма и повторами"""
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    self._calls += 1
+                    response = await self.client.request(method, url, **kwargs)
+                if not (idempotent and response.status_code in RETRY_STATUSES
+                        and attempt < self.retries):
+                    return response
+            except (httpx.ConnectError, httpx.ConnectTimeout,
+                    httpx.PoolTimeout):
+                # Запрос не ушёл — повтор безопасен для любого метода
+                if attempt >= self.retries:
+                    self._failed += 1
+                    raise
+            except httpx.TransportError:
+                if not idempotent or attempt >= self.retries:
+                    self._failed += 1
+                    raise
+            attempt += 1
+            self._retried += 1
+            await asyncio.sleep(self._backoff(attempt - 1))
 
     async def process_message(
             self,
@@ -54,10 +154,12 @@ class YandexGPTBot:
                 "username": username
             }
 
-            response = self.session.post(
-                self.telegram_bot_service_url,
+            response = await self._request(
+                "POST",
+                f"{self.telegram_bot_service_url}/",
+                idempotent=False,
                 json=payload,
-                timeout=30
+                timeout=self.timeout
             )
 
             if response.status_code == 200:
@@ -72,7 +174,7 @@ class YandexGPTBot:
                     "при обработке сообщения"
                     }
 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка соединения с микросервисом: {str(e)}")
             return {
                 "chat_id": chat_id,
@@ -85,6 +187,36 @@ class YandexGPTBot:
                 "response_text": "Извините, произошла неожиданная ошибка"
             }
 
+    async def process_many(
+            self,
+            messages: Iterable[Dict[str, Any]],
+            concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Обрабатывает пачку сообщений, держа в работе не больше
+        concurrency запросов
+
+        Args:
+            messages: Словари с аргументами process_message
+            concurrency: Параллелизм (по умолчанию max_concurrency)
+
+        Returns:
+            list: Ответы в порядке входных сообщений
+        """
+        items = list(messages)
+        results: List[Dict[str, Any]] = [{}] * len(items)
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in enumerate(items):
+            queue.put_nowait(item)
+
+        async def worker() -> None:
+            while not queue.empty():
+                i, message = queue.get_nowait()
+                results[i] = await self.process_message(**message)
+
+        workers = min(concurrency or self.max_concurrency, len(items))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        return results
+
     async def get_bot_status(self):
         """
         Получает статус бота
@@ -92,11 +224,12 @@ class YandexGPTBot:
         Returns:
             dict: Статус бота
         """
-        url = self.telegram_bot_service_url.replace('/api/telegram_bot', '')
         try:
-            response = self.session.get(
-                f"{url}/api/telegram_bot/status",
-                timeout=10
+            response = await self._request(
+                "GET",
+                f"{self.telegram_bot_service_url}/status",
+                idempotent=True,
+                timeout=self.status_timeout
             )
 
             if response.status_code == 200:
@@ -109,3 +242,10 @@ class YandexGPTBot:
         except Exception as e:
             logger.error(f"Ошибка получения статуса: {str(e)}")
             return {"status": "error", "message": "Ошибка получения статуса"}
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "calls": self._calls,
+            "retried": self._retried,
+            "failed": self._failed,
+        }
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Дедлайн запроса из заголовка X-Request-Deadline (unix-время в секундах).
+
+Middleware отвечает 504 на запросы с истёкшим дедлайном, не начиная
+работу, и кладёт разобранный дедлайн в request.state.deadline (None,
+если заголовка нет). Таймауты вызовов апстримов ограничиваются
+остатком бюджета, заголовок передаётся дальше.
+"""
+import time
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+DEADLINE_HEADER = "X-Request-Deadline"
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени на запрос исчерпан"""
+
+
+class Deadline:
+    __slots__ = ("at",)
+
+    def __init__(self, at: float) -> None:
+        self.at = at
+
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> Optional["Deadline"]:
+        try:
+            return cls(float(value)) if value else None
+        except ValueError:
+            return None
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.time())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Таймаут вызова: не больше cap и остатка бюджета"""
+        left = self.remaining()
+        if left <= 0:
+            raise DeadlineExceeded("deadline exceeded")
+        return min(cap, left)
+
+    def headers(self) -> Dict[str, str]:
+        return {DEADLINE_HEADER: f"{self.at:.3f}"}
+
+
+async def deadline_middleware(request: Request, call_next):
+    deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    if deadline is not None and deadline.expired:
+        return JSONResponse(
+            {"detail": "deadline exceeded"}, status_code=504)
+    request.state.deadline = deadline
+    return await call_next(request)
@@ -1,13 +1,34 @@
 import asyncio
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from deadline import deadline_middleware
+from loop_monitor import DEBUG_TOKEN_HEADER, debug_allowed, loop_monitor
 from routers import router
 # from settings import settings
 
-app = FastAPI(debug=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_monitor.start()
+    yield
+    await loop_monitor.stop()
+
+
+app = FastAPI(debug=True, lifespan=lifespan)
+# Запросы с истёкшим X-Request-Deadline отбрасываются сразу
+app.middleware("http")(deadline_middleware)
 app.include_router(router)
 
 
+@app.get("/debug/loop")
+async def debug_loop(request: Request, top: int = 10):
+    """Задержка event loop и места, которые его блокировали"""
+    if not debug_allowed(request.headers.get(DEBUG_TOKEN_HEADER)):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return loop_monitor.metrics(top)
+
+
 async def main():
     uvicorn.run(
         "main:app",
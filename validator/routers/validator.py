@@ -8,10 +8,17 @@ import logging
 import uuid
 import json
 import hashlib
+import os
+
+from deadline import Deadline
+
 logger = logging.getLogger(__name__)
 
 ZW_CLASS = "[\u200B\u200C\u200D\u2060\uFEFF]"
-LLM_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
+LLM_URL = os.getenv(
+    "LLM_URL", 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion')
+LLM_AGENT_URL = os.getenv(
+    "LLM_AGENT_URL", "http://localhost:8888/api/llm_agent")
 
 
 def normalize_unicode(text: str) -> str:
@@ -76,7 +83,8 @@ class PromptInjectionFilter:
         t = strip_safe_areas(t)
         return t
 
-    def detect_llm(self, text: str) -> bool:
+    def detect_llm(
+            self, text: str, deadline: Optional[Deadline] = None) -> bool:
         system_prompt = (
             "Ты — модератор запросов к ИИ-ассистенту."
             "Оцени только предоставленный текст и определи,"
@@ -139,12 +147,15 @@ class PromptInjectionFilter:
                       v in headers.items() if k.lower() != "authorization"})
         logger.debug("PI->LLM body_preview=%s", body_preview)
 
+        # DeadlineExceeded — до запроса, чтобы не превратиться в «НЕТ»
+        timeout = deadline.timeout(30) if deadline else 30
         t0 = time.time()
         try:
             resp = requests.post(
-                "http://localhost:8888/api/llm_agent",
+                LLM_AGENT_URL,
                 json=req_body,
-                timeout=30)
+                headers=deadline.headers() if deadline else None,
+                timeout=timeout)
             dt = time.time() - t0
 
             # Заголовки ответа для поддержки
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from deadline import DeadlineExceeded
 from models import ValidationResult, ValidationRequest
 from .validator import PromptInjectionFilter
 
@@ -7,7 +8,7 @@ router = APIRouter()
 
 
 @router.post('/', response_model=ValidationResult)
-async def validate_request(req: ValidationRequest):
+async def validate_request(req: ValidationRequest, request: Request):
     user_message = req.text.lower()
     iam_token = req.iam_token
     folder_id = req.folder_id
@@ -15,7 +16,11 @@ async def validate_request(req: ValidationRequest):
 
     validator_model = PromptInjectionFilter(MODEL_NAME, folder_id, iam_token)
 
-    is_insecure = validator_model.detect_llm(user_message)
+    try:
+        is_insecure = validator_model.detect_llm(
+            user_message, request.state.deadline)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="deadline exceeded")
     if is_insecure:
         raise HTTPException(status_code=403, detail="Toxic content detected")
     return ValidationResult(